@@ -0,0 +1,136 @@
+"""
+Memory-mapped Arrow working cache of the DESS datasets, for interactive analysis.
+
+Reading complete/reprocess/uncomplete from Parquet decompresses and decodes every part on each
+open. open_dataset instead materializes the latest version of each row once into an uncompressed
+Arrow IPC (Feather v2) file next to the dataset (`<dir>/.arrow_cache/<dataset>.arrow`) and
+memory-maps it afterwards: opening is near-instant, buffers are read straight from the page cache
+and only the columns (and rows) that are actually used take memory.
+
+The cache records the dataset fingerprint it was built from (data_pipeline_manager.dataset_fingerprint)
+and is rebuilt on the next open once the dataset changes. The directory is dot-prefixed, so
+orchestrate_upload_workflow does not back it up.
+
+    complete = arrow_cache.open_dataset(COMPLETE_FILE_PATH)
+    complete['isProfessor'].sum()                       # converts (and keeps) just that column
+    complete.to_pandas(['id_text', 'rawText'], rows=[0, 10, 20])
+"""
+
+import os
+import pyarrow as pa
+import parquet_schema
+
+CACHE_DIR_NAME = '.arrow_cache'
+_FINGERPRINT_KEY = b'dess_source_fingerprint'
+_BATCH_SIZE = parquet_schema.ROW_GROUP_SIZE
+
+
+class CachedDataset:
+    """
+    A dataset backed by a memory-mapped Arrow file. Columns are converted to pandas on first access.
+
+    Attributes:
+        table (pa.Table): Zero-copy view of the cache file; slicing, take and compute kernels on it
+            only touch the pages they need.
+    """
+    def __init__(self, table: pa.Table, path: str):
+        self.table = table
+        self.path = path
+        self._series = {}
+
+    @property
+    def columns(self) -> list:
+        return self.table.column_names
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def __contains__(self, column):
+        return column in self.table.column_names
+
+    def __getitem__(self, column: str):
+        if column not in self._series:
+            self._series[column] = self.table.column(column).to_pandas()
+        return self._series[column]
+
+    def to_pandas(self, columns: list = None, rows=None):
+        """
+        The given columns (all if None) as a DataFrame, optionally only the rows at the given positions.
+        Columns missing from the dataset are skipped.
+        """
+        table = self.table
+        if columns is not None:
+            table = table.select([col for col in columns if col in table.column_names])
+        if rows is not None:
+            table = table.take(pa.array(rows, type=pa.int64()))
+        return table.to_pandas()
+
+
+def cache_path(dataset_path: str) -> str:
+    """Location of the cache file of dataset_path."""
+    dataset_path = os.path.normpath(dataset_path)
+    return os.path.join(os.path.dirname(dataset_path), CACHE_DIR_NAME, f"{os.path.basename(dataset_path)}.arrow")
+
+def open_dataset(dataset_path: str, key: str = 'id_text', refresh: bool = False) -> CachedDataset:
+    """
+    Opens the cached copy of a dataset (partitioned directory or single Parquet file), building it
+    first if it is missing, was built from an older version of the dataset, or refresh is True.
+
+    Args:
+        dataset_path (str): Dataset directory or Parquet file.
+        key (str): Column identifying a row across parts; only its latest version is kept, at the
+            position of its first appearance (as data_pipeline_manager.read_dataset does).
+        refresh (bool): Rebuild the cache even if it looks current.
+    """
+    import data_pipeline_manager as dpm
+    if not os.path.exists(dataset_path):
+        raise FileNotFoundError(dataset_path)
+
+    path = cache_path(dataset_path)
+    fingerprint = dpm.dataset_fingerprint(dataset_path).encode('utf-8')
+    table = None if refresh else _open(path)
+    if table is None or (table.schema.metadata or {}).get(_FINGERPRINT_KEY) != fingerprint:
+        print(f"BUILDING ARROW CACHE: {dataset_path}")
+        _build(dataset_path, path, key, fingerprint)
+        table = _open(path)
+    return CachedDataset(table, path)
+
+def drop(dataset_path: str):
+    """Removes the cache file of dataset_path, if any."""
+    path = cache_path(dataset_path)
+    if os.path.exists(path):
+        os.remove(path)
+
+def _open(path):
+    """Memory-maps the cache file at path; None if it doesn't exist or can't be read."""
+    if not os.path.exists(path):
+        return None
+    try:
+        return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    except (pa.ArrowInvalid, OSError):
+        return None
+
+def _build(dataset_path, path, key, fingerprint):
+    """Writes the latest version of each row of the dataset to path, uncompressed, tagged with fingerprint."""
+    import data_pipeline_manager as dpm
+    parts = dpm.list_parts(dataset_path)
+    tables = [parquet_schema.read_table(part) for part in parts]
+    table = pa.concat_tables(tables, promote_options="permissive") if tables else pa.table({})
+    if len(parts) > 1 and key in table.column_names:
+        deleted = table[dpm.DELETED_COLUMN].to_pandas() if dpm.DELETED_COLUMN in table.column_names else None
+        table = table.take(dpm.latest_positions(table[key].to_numpy(), [t.num_rows for t in tables], deleted))
+    if dpm.DELETED_COLUMN in table.column_names:
+        table = table.drop_columns([dpm.DELETED_COLUMN])
+
+    schema = table.schema.with_metadata({**(table.schema.metadata or {}), _FINGERPRINT_KEY: fingerprint})
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    try:
+        # Uncompressed so that reads are zero-copy views of the mapped file
+        with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+            for batch in table.to_batches(max_chunksize=_BATCH_SIZE):
+                writer.write_batch(batch)
+        os.replace(tmp_path, path)  # readers mapping the previous file keep their (unlinked) copy
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -0,0 +1,32 @@
+"""
+Settings from the environment (and the .env file), read when first used instead of at import time.
+
+Every module resolves its paths and settings through here (the module-level *_PATH constants are
+looked up by a module __getattr__), so importing them has no side effects and sees the environment
+as it is when the work starts (e.g. STORAGE_DIR exported by a cron wrapper after the import).
+"""
+
+import os
+
+_ENV_LOADED = False
+
+
+def load_env():
+    """Loads the .env file into the environment, once."""
+    global _ENV_LOADED
+    if not _ENV_LOADED:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _ENV_LOADED = True
+
+
+def get(name: str, default: str = None) -> str:
+    """Environment variable name (after loading .env), or default."""
+    load_env()
+    return os.getenv(name, default)
+
+
+def storage_path(file_name: str = '') -> str:
+    """Path of file_name under STORAGE_DIR; STORAGE_DIR itself if file_name is empty."""
+    storage_dir = get('STORAGE_DIR')
+    return f"{storage_dir}/{file_name}" if file_name else storage_dir
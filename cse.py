@@ -1,38 +1,128 @@
 import os
 import re
+import time
+import sqlite3
+import datetime
+import threading
+from contextlib import closing
+from zoneinfo import ZoneInfo
 import pandas as pd
-from dotenv import load_dotenv
 import requests
 import csv
 import logging
-
-load_dotenv()
+import config
 
 logger = logging.getLogger(__name__)
-BASE_URL = "https://www.googleapis.com/customsearch/v1"
-DATASET_DIR = f"{os.getenv('STORAGE_DIR')}/dataset"
+BASE_URL = None # None: CSE_BASE_URL or the Custom Search endpoint; set to replay against mock_search_server.py
+# Paths derived from the environment, resolved when first used (see __getattr__)
+_ENV_PATHS = {
+    'DATASET_DIR': lambda: config.storage_path('dataset'),
+    'USAGE_PATH': lambda: config.storage_path('cse_usage.sqlite'),
+}
+# Limits of the Custom Search API, shared by every caller (google_api_workflow, rescrape, ...); 0 disables one.
+# There is no daily cap unless CSE_DAILY_QUOTA is set (to the searches per day of the API plan).
+_ENV_SETTINGS = {
+    'DAILY_QUOTA': lambda: int(config.get("CSE_DAILY_QUOTA", 0)),
+    'REQUESTS_PER_MINUTE': lambda: int(config.get("CSE_REQUESTS_PER_MINUTE", 100)),
+}
+_bucket = {'available': None, 'updated': 0.0}
+_bucket_lock = threading.Lock()
+
+def __getattr__(name):
+    if name in _ENV_PATHS:
+        return _ENV_PATHS[name]()
+    if name in _ENV_SETTINGS:
+        return _ENV_SETTINGS[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _path(name):
+    return __getattr__(name)
+
+def _setting(name):
+    return __getattr__(name)
+
+class QuotaExceeded(Exception):
+    """Today's Custom Search API quota (DAILY_QUOTA searches) is used up."""
+
+def remaining_quota():
+    """Searches left today under DAILY_QUOTA, or None if the quota is disabled."""
+    quota = _setting('DAILY_QUOTA')
+    if not quota:
+        return None
+    if not os.path.exists(_path('USAGE_PATH')):
+        return quota
+    with closing(_open_usage()) as conn:
+        row = conn.execute("SELECT searches FROM usage WHERE day = ?", (_today(),)).fetchone()
+    return max(quota - (row[0] if row else 0), 0)
+
+def acquire():
+    """
+    Takes one search from today's quota and waits for the request rate to allow it. The daily count
+    lives in USAGE_PATH, so separate processes (the daily workflow, the re-scrape job) share it; the
+    rate limit is a token bucket shared by the threads of this process.
+
+    Raises:
+        QuotaExceeded: If today's searches are used up.
+    """
+    quota = _setting('DAILY_QUOTA')
+    if quota:
+        with closing(_open_usage()) as conn, conn:
+            conn.execute("INSERT OR IGNORE INTO usage (day, searches) VALUES (?, 0)", (_today(),))
+            taken = conn.execute("UPDATE usage SET searches = searches + 1 WHERE day = ? AND searches < ?",
+                                 (_today(), quota)).rowcount
+        if not taken:
+            raise QuotaExceeded(f"All {quota} Custom Search API searches of today are used")
+
+    per_minute = _setting('REQUESTS_PER_MINUTE')
+    while per_minute:
+        with _bucket_lock:
+            now = time.monotonic()
+            available = per_minute if _bucket['available'] is None else _bucket['available']
+            available = min(per_minute, available + (now - _bucket['updated']) * per_minute / 60)
+            _bucket['updated'] = now
+            _bucket['available'] = available - 1 if available >= 1 else available
+            if available >= 1:
+                return
+        time.sleep((1 - available) * 60 / per_minute)
+
+def _open_usage():
+    conn = sqlite3.connect(_path('USAGE_PATH'), timeout=30)
+    conn.execute("CREATE TABLE IF NOT EXISTS usage (day TEXT PRIMARY KEY, searches INTEGER NOT NULL)")
+    return conn
+
+def _today(now: datetime.datetime = None):
+    """The quota day of now (an aware datetime; the current time by default): Google resets the Custom
+    Search quota at midnight Pacific time."""
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    return now.astimezone(ZoneInfo('America/Los_Angeles')).date().isoformat()
+
+def base_url():
+    """The Custom Search endpoint: BASE_URL if set, else CSE_BASE_URL from the environment, else Google's."""
+    return BASE_URL or config.get("CSE_BASE_URL", "https://www.googleapis.com/customsearch/v1")
 
 def _build_payload(search_query, date_restrict):
     """Constructs the payload for the Google Custom Search API request."""
     return {
-        'key': os.getenv('CSE_API_KEY'), 
-        'cx': os.getenv('SEARCH_ENGINE_ID'),
+        'key': config.get('CSE_API_KEY'), 
+        'cx': config.get('SEARCH_ENGINE_ID'),
         'q': search_query
         # 'dateRestrict':date_restrict,
         # 'sort': "date:r:20100101:20101231"
     }
 
 def make_API_CALL(search_query, date_restrict=None):
-    response = requests.get(BASE_URL, params=_build_payload(search_query, date_restrict))
+    acquire()
+    response = requests.get(base_url(), params=_build_payload(search_query, date_restrict))
     
     if response.status_code == 200:  # Save CSV only if response is successful
         results = response.json()
         df_results = pd.json_normalize(results.get('items', []))
         file_name = '_'.join(search_query.split(" "))
         file_name = file_name.replace('/', '_').replace('\\', '_')
-        df_results.to_csv(f"{DATASET_DIR}/{file_name}.csv", index=False, quoting=csv.QUOTE_ALL)
+        file_path = f"{_path('DATASET_DIR')}/{file_name}.csv"
+        df_results.to_csv(file_path, index=False, quoting=csv.QUOTE_ALL)
         
-        return f"{DATASET_DIR}/{file_name}.csv"
+        return file_path
     else:
         raise Exception(f"API call failed with status code: {response.status_code}")
 
@@ -72,28 +162,39 @@ def populate_rawText_col(df):
     """
     Populates the rawText column in the DataFrame. Any failure (API error, empty results, 
     file processing error) will result in None values that can be filtered with isna().
+    Once today's quota is used up (QuotaExceeded), the remaining rows are not searched.
 
     Args:
         df (pd.DataFrame): DataFrame containing an 'id_text' column.
 
     Returns:
-        pd.DataFrame: DataFrame with populated 'rawText' column, None for any failures.
+        pd.DataFrame: The rows that were searched, with populated 'rawText' column, None for any failures.
     """
     df['rawText'] = None
 
     # Log only at the beginning of processing
     logger.info(f"Starting to process {len(df)} rows for API calls")
 
-    for index, row in df.iterrows():
-        id_text = row['id_text']
+    for n_searched, (index, row) in enumerate(df.iterrows()):
         try:
-            file_name = make_API_CALL(id_text)
-            raw_text = _get_rawText(file_name)
-            df.at[index, 'rawText'] = raw_text
-        except Exception as e:
-            logger.error(f"Error processing row {index} ({id_text}): {e}")
+            df.at[index, 'rawText'] = fetch_rawText(row['id_text'])
+        except QuotaExceeded as e:
+            logger.warning(f"Stopping after {n_searched} of {len(df)} rows: {e}")
+            return df.iloc[:n_searched]
 
     return df
+
+def fetch_rawText(id_text):
+    """Searches for one id_text and returns its rawText, or None on any failure except QuotaExceeded,
+    which is raised: a search that was never made is not a failed row."""
+    try:
+        file_name = make_API_CALL(id_text)
+        return _get_rawText(file_name)
+    except QuotaExceeded:
+        raise
+    except Exception as e:
+        logger.error(f"Error processing {id_text}: {e}")
+        return None
         
 if __name__=='__main__':
     search_query = 'Ngoyi Bukonda northern illinois university'
@@ -1,52 +1,297 @@
 import os
-import pandas as pd
+import time
+import datetime
+import hashlib
+import uuid
+import shutil
+import threading
 import numpy as np
-from dotenv import load_dotenv
-from tqdm import tqdm
-import dropbox
-from dropbox.files import WriteMode
-
-load_dotenv()
-
-STORAGE_DIR = os.getenv("STORAGE_DIR")
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import config
+import arrow_cache
+import entity_resolution
+import id_index
+import parquet_schema
+import stata_writer
+import stats
+# The Dropbox SDK (dropbox, dropbox_sync, dropbox_upload) and tqdm are imported by the functions that
+# talk to Dropbox, so the local data steps don't pay for loading them
+
+# Paths derived from the environment, resolved when first used (see __getattr__)
+_ENV_PATHS = {
+    'STORAGE_DIR': lambda: config.storage_path(),
+    'COMPLETE_FILE_PATH': lambda: config.storage_path('complete.parquet'),
+    'REPROCESS_FILE_PATH': lambda: config.storage_path('reprocess.parquet'),
+    'UNCOMPLETE_FILE_PATH': lambda: config.storage_path('uncomplete.parquet'),
+}
 PARQUET_FILE_NAME = "shishir-toSearch-2025-02-11.parquet"
+COMPACT_AFTER_PARTS = 32 # datasets are compacted once they accumulate more part files than this
+SCRAPED_MARKER = '_SCRAPED' # written into a dataset's directory once the scraper went through all its rows
+DELETED_COLUMN = parquet_schema.DELETED_COLUMN # flags the tombstone rows of remove_from_dataset
+UPDATES_SUFFIX = '.updates' # update_parquet_file's delta parts live in '<file>.updates', next to the file
+_COMPACTION_LOCK = threading.Lock()
+
+def __getattr__(name):
+    if name in _ENV_PATHS:
+        return _ENV_PATHS[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _path(name):
+    return __getattr__(name)
+
+def get_new_rows(chunksize: int = 100_000, resolve_entities: bool = True):
+    """Reads the master (stata) dataset in chunks and returns new rows not present in 'complete' or 
+    'reprocess' files, probing the persistent id_text index instead of loading those files.
+    If resolve_entities is True, new rows that are a differently written id_text of a complete record
+    (see entity_resolution) are returned with that record's rawText and extraction already filled in,
+    so the scraper skips them and the merge files them into 'complete'. Nothing is written to the datasets."""
+    conn = _open_synced_index()
+    new_chunks = []
+    try:
+        with pd.read_stata(f"{_path('STORAGE_DIR')}/input.dta", chunksize=chunksize) as reader:
+            for chunk in reader:
+                # ids are stored stripped (prepare_dess_data_structure), so probe them stripped too
+                is_new = id_index.find_new(conn, chunk['id_text'].astype(str).str.strip())
+                new_chunks.append(chunk[is_new])
+    finally:
+        conn.close()
+
+    df_u = pd.concat(new_chunks) if new_chunks else pd.DataFrame()
+    if resolve_entities and len(df_u) and os.path.exists(_path('COMPLETE_FILE_PATH')):
+        df_u = _fill_resolved_rows(df_u)
 
-def get_new_rows():
-    """Reads the master (stata) dataset and returns new rows not present in 'complete' or 'reprocess' files."""
-    df_master = pd.read_stata(f"{STORAGE_DIR}/input.dta")
-    df_c = pd.read_parquet(f"{STORAGE_DIR}/complete.parquet")
-    df_r = pd.read_parquet(f"{STORAGE_DIR}/reprocess.parquet")
-    # Combine id_text values from df_c and df_r into a single set
-    id_text_set = set(df_c['id_text'].astype(str)).union(set(df_r['id_text'].astype(str)))
-
-    df_u = df_master[~df_master['id_text'].astype(str).isin(id_text_set)]
+    return df_u
 
+def _fill_resolved_rows(df_u: pd.DataFrame):
+    """Copies the scraped and extracted columns of the complete record each row of df_u resolves to
+    (if any) into the row; the other rows get empty values in those columns."""
+    complete_path = _path('COMPLETE_FILE_PATH')
+    conn = entity_resolution.open_index()
+    try:
+        fingerprint = dataset_fingerprint(complete_path)
+        if entity_resolution.get_fingerprint(conn) != fingerprint:
+            print(f"SYNCING ENTITY INDEX: {complete_path}")
+            entity_resolution.sync(conn, read_dataset(complete_path, columns=['id_text'])['id_text'], fingerprint)
+
+        resolved_ids = pd.Series(entity_resolution.link(conn, df_u['id_text'].astype(str).str.strip()), index=df_u.index)
+        is_linked = resolved_ids.notna()
+        if not is_linked.any():
+            return df_u
+
+        # The new rows keep their own master columns; everything the search and extraction added comes from the record
+        records = read_rows(complete_path, resolved_ids[is_linked].unique())
+    finally:
+        conn.close()
+
+    df_u = df_u.copy()
+    for col in records.columns.difference(df_u.columns, sort=False):
+        values = records[col].reindex(resolved_ids[is_linked]).to_numpy()
+        df_u[col] = pd.Series(values, index=df_u.index[is_linked.to_numpy()], dtype=object).reindex(df_u.index)
+
+    print(f"RESOLVED: {is_linked.sum()} of {len(df_u)} new rows reuse an existing record (not searched)")
     return df_u
 
+def read_rows(dataset_path: str, ids, key: str = 'id_text'):
+    """Latest version of the dataset's rows whose key is in ids, indexed by key, reading only the
+    row groups that can contain them."""
+    parts = list_parts(dataset_path)
+    ids = [str(id_text) for id_text in ids]
+    tables = [parquet_schema.read_table(part, filters=[(key, 'in', ids)]) for part in parts]
+    df = pa.concat_tables(tables, promote_options="permissive").to_pandas()
+    df = df.drop_duplicates(subset=key, keep='last').set_index(key)
+    if DELETED_COLUMN in df:
+        df = df[~df[DELETED_COLUMN].eq(True)].drop(columns=DELETED_COLUMN)
+    return df
+
 def write_to_file(file_path: str, df: pd.DataFrame, overwrite: bool = False):
-    """Writes DataFrame to a Parquet file, either overwriting or 
-    appending to the file if it exists."""
+    """Writes DataFrame to a partitioned Parquet dataset (a directory of part files), either 
+    replacing its contents or appending a new part file if it exists."""
     if overwrite or not os.path.exists(file_path):
         action = "CREATING NEW FILE"
+        _replace_dataset(file_path, df)
     else:
         action = "APPENDING TO FILE"
-        existing_df = pd.read_parquet(file_path)
-        df = pd.concat([existing_df, df], ignore_index=True)
+        append_to_dataset(file_path, df)
     
     print(f"{action}: {file_path}")
-    df.to_parquet(file_path)
+
+def append_to_dataset(dataset_path: str, df: pd.DataFrame, compact_threshold: int = COMPACT_AFTER_PARTS):
+    """Adds df as a new part file of the dataset. Existing parts are never read or rewritten.
+    Once the dataset has more than compact_threshold parts, a background compaction is started."""
+    _ensure_dataset(dataset_path)
+    part_path = os.path.join(dataset_path, _new_part_name())
+    _atomic_write_parquet(df, part_path)
+    stats.record_part(dataset_path, part_path, df)
+
+    if compact_threshold and len(list_parts(dataset_path)) > compact_threshold:
+        compact_dataset(dataset_path, background=True)
+    return part_path
+
+def remove_from_dataset(dataset_path: str, ids, key: str = 'id_text'):
+    """Removes the rows whose key is in ids by appending a tombstone part (a row with DELETED_COLUMN set
+    per key): readers drop every version of those keys written before it, and compaction drops them
+    for good. Returns the part's path, or None if there was nothing to remove."""
+    ids = pd.unique(pd.Series(list(ids), dtype=object).astype(str))
+    if not len(ids) or not os.path.exists(dataset_path):
+        return None
+    return append_to_dataset(dataset_path, pd.DataFrame({key: ids, DELETED_COLUMN: True}))
+
+def mark_scraped(dataset_path: str):
+    """Records that the scraper went through every row of the dataset (SCRAPED_MARKER in its directory).
+    Rewriting the dataset (write_to_file with overwrite) drops the marker with the old directory."""
+    _ensure_dataset(dataset_path)
+    with open(os.path.join(dataset_path, SCRAPED_MARKER), 'w') as f:
+        f.write(datetime.datetime.now().isoformat(timespec='seconds'))
+
+def is_scraped(dataset_path: str) -> bool:
+    """Whether the dataset's rows can be filed: the scraper marked it (see mark_scraped), or every row
+    already has rawText. Rows whose search failed are only filed into 'reprocess' once it is marked."""
+    if not os.path.exists(dataset_path):
+        return False
+    if os.path.isdir(dataset_path) and os.path.exists(os.path.join(dataset_path, SCRAPED_MARKER)):
+        return True
+    return bool(parquet_schema.has_raw_text(read_dataset(dataset_path, columns=['rawText'])['rawText']).all())
+
+def read_dataset(dataset_path: str, columns: list = None, key: str = 'id_text', latest_only: bool = True):
+    """
+    Reads a partitioned dataset (or a legacy single Parquet file) as one DataFrame.
+
+    Args:
+        dataset_path (str): Dataset directory or Parquet file.
+        columns (list): Columns to read; all columns if None. The key column is always read.
+        key (str): Column identifying a row across parts.
+        latest_only (bool): Keep only the most recently written version of each key, and drop removed
+            keys (see keep_latest). Rows keep the position of their first appearance so chunk-based
+            progress tracking still works.
+    """
+    if columns is not None and key not in columns:
+        columns = [key] + list(columns)
+    if os.path.isfile(dataset_path):
+        return pd.read_parquet(dataset_path, columns=columns)
+
+    parts = list_parts(dataset_path)
+    if not parts:
+        return pd.DataFrame(columns=columns)
+    tables = [read_part(part, columns) for part in parts]
+    df = pa.concat_tables(tables, promote_options="permissive").to_pandas()
+
+    if latest_only and (len(parts) > 1 or DELETED_COLUMN in df):
+        df = keep_latest(df, key, [table.num_rows for table in tables])
+    return df
+
+def read_part(part: str, columns: list = None):
+    """A part file as an Arrow table. With columns, only the ones the part has are read (a tombstone
+    part has just the key), plus DELETED_COLUMN if it has it."""
+    if columns is not None:
+        available = pq.read_schema(part).names
+        columns = [col for col in list(columns) + [DELETED_COLUMN] if col in available]
+    return parquet_schema.read_table(part, columns=columns)
+
+def compact_dataset(dataset_path: str, key: str = 'id_text', background: bool = False):
+    """Merges all current part files into one, keeping the latest version of each key (removed keys
+    and their tombstones are dropped). Parts appended while compaction runs are left untouched."""
+    if background:
+        thread = threading.Thread(target=compact_dataset, args=(dataset_path, key), daemon=True)
+        thread.start()
+        return thread
+
+    with _COMPACTION_LOCK:
+        parts = list_parts(dataset_path)
+        if len(parts) <= 1:
+            return None
+        tables = [parquet_schema.read_table(part) for part in parts]
+        df = keep_latest(pa.concat_tables(tables, promote_options="permissive").to_pandas(), key,
+                          [table.num_rows for table in tables])
+
+        # Reuse the newest merged part's name so ordering relative to later appends is preserved
+        compacted_path = parts[-1]
+        _atomic_write_parquet(df, compacted_path)
+        stats.record_part(dataset_path, compacted_path, df, replaces=parts)
+        for part in parts[:-1]:
+            os.remove(part)
+        print(f"COMPACTED {len(parts)} parts into {compacted_path}")
+        return compacted_path
+
+def keep_latest(df: pd.DataFrame, key: str, part_sizes: list):
+    """
+    Keeps the latest version of each key from the concatenated rows of parts of part_sizes rows: its
+    rows in the last part that has it, placed at the position where the key first appeared. Only
+    versions across parts are superseded; rows sharing a key within one part (genuine duplicates,
+    e.g. from the master file) are all kept. A key whose latest version is a tombstone (see
+    remove_from_dataset) is dropped, and so is DELETED_COLUMN.
+    """
+    deleted = df[DELETED_COLUMN] if DELETED_COLUMN in df else None
+    df = df.take(latest_positions(df[key], part_sizes, deleted)).reset_index(drop=True)
+    return df.drop(columns=DELETED_COLUMN, errors='ignore')
+
+def latest_positions(keys, part_sizes: list, deleted=None) -> np.ndarray:
+    """Positions of the rows keep_latest keeps, in its order. deleted flags the tombstone rows, if any."""
+    frame = pd.DataFrame({'key': np.asarray(keys), 'part': np.repeat(np.arange(len(part_sizes)), part_sizes)})
+    grouped = frame.groupby('key', sort=False, dropna=False)
+    positions = np.flatnonzero(frame['part'].to_numpy() == grouped['part'].transform('max').to_numpy())
+    first_seen = grouped.ngroup().to_numpy() # groups are numbered in order of first appearance
+    positions = positions[np.argsort(first_seen[positions], kind='stable')]
+    if deleted is not None:
+        positions = positions[~pd.Series(np.asarray(deleted, dtype=object)).eq(True).to_numpy()[positions]]
+    return positions
+
+def _replace_dataset(dataset_path: str, df: pd.DataFrame):
+    """Writes df as the only part of the dataset, swapping directories so readers never see a partial state."""
+    staging_path = f"{dataset_path}.staging-{os.getpid()}"
+    part_name = _new_part_name()
+    os.makedirs(staging_path)
+    parquet_schema.write_table(df, os.path.join(staging_path, part_name))
+
+    if os.path.exists(dataset_path):
+        retired_path = f"{dataset_path}.old-{os.getpid()}"
+        os.replace(dataset_path, retired_path)
+        os.replace(staging_path, dataset_path)
+        if os.path.isdir(retired_path):
+            shutil.rmtree(retired_path)
+        else:
+            os.remove(retired_path)
+    else:
+        os.replace(staging_path, dataset_path)
+    stats.record_part(dataset_path, os.path.join(dataset_path, part_name), df)
+
+def _ensure_dataset(dataset_path: str):
+    """Creates the dataset directory, converting a legacy single Parquet file into its first part."""
+    if os.path.isfile(dataset_path):
+        legacy_path = f"{dataset_path}.legacy-{os.getpid()}"
+        os.replace(dataset_path, legacy_path)
+        os.makedirs(dataset_path)
+        os.replace(legacy_path, os.path.join(dataset_path, _new_part_name()))
+    else:
+        os.makedirs(dataset_path, exist_ok=True)
+
+def list_parts(dataset_path: str):
+    """Returns the dataset's part files, oldest first; a legacy single Parquet file is its only part."""
+    if os.path.isfile(dataset_path):
+        return [dataset_path]
+    if not os.path.isdir(dataset_path):
+        return []
+    return sorted(os.path.join(dataset_path, f) for f in os.listdir(dataset_path)
+                  if f.startswith('part-') and f.endswith('.parquet'))
+
+def _new_part_name():
+    # Zero-padded nanosecond timestamps sort in write order; the suffix avoids collisions between writers
+    return f"part-{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.parquet"
 
 def prepare_dess_data_structure(df: pd.DataFrame):
     """Adds custom DESS-related columns to the given DataFrame. This may change
-    but generally includes: 'isProfessor', 'isProfessor2', 'rawText', and 'department'."""
+    but generally includes: 'isProfessor', 'isProfessor2', 'rawText', and 'department'.
+    Columns that are already there (e.g. filled in by get_new_rows for resolved rows) are kept."""
     print(df.columns)
      # Normalize formatting in the 'id_text' column
     df['id_text'] = df['id_text'].str.strip()
     # Add new empty columns directly to the DataFrame
-    df['isProfessor'] = None
-    df['isProfessor2'] = None
-    df['rawText'] = None           
-    df['department'] = ""
+    for col, empty in (('isProfessor', None), ('isProfessor2', None), ('rawText', None), ('department', "")):
+        if col not in df.columns:
+            df[col] = empty
+        elif empty is not None:
+            df[col] = df[col].fillna(empty)
     return df
 
 def get_merged_data_from_parallel_scrape(df1: pd.DataFrame, df2: pd.DataFrame, split_ratio: float =0.5):
@@ -59,28 +304,102 @@ def get_merged_data_from_parallel_scrape(df1: pd.DataFrame, df2: pd.DataFrame, s
     merged_df.loc[split_index:, 'rawText'] = df2.loc[split_index:, 'rawText']
     return merged_df
 
-def update_internal_files(df_c: pd.DataFrame, df_r: pd.DataFrame, df_u: pd.DataFrame):
-    """Updates the internal files with the given DataFrames."""
+def update_internal_files(df_c: pd.DataFrame, df_r: pd.DataFrame, df_u: pd.DataFrame, persist: bool = False):
+    """Updates the internal files with the given DataFrames. If persist is True, the scraped rows are
+    also filed on disk with file_scraped_rows (appended, never rewriting the datasets)."""
     # TODO: Test
-    new_non_empty_rawText_rows = df_u[df_u['rawText'].apply(lambda x: isinstance(x, np.ndarray) and len(x) > 0)]
+    new_non_empty_rawText_rows = df_u[parquet_schema.has_raw_text(df_u['rawText'])]
     new_empty_rawText_rows = df_u[~df_u['id_text'].isin(new_non_empty_rawText_rows['id_text'])]
 
     # Merging to complete.parquet + error checking
     updated_df_c, completed_conflicts = _safe_merge(df_c, new_non_empty_rawText_rows)
     if len(completed_conflicts):
-        error_file_path = os.path.join(STORAGE_DIR, 'completed_conflicts.csv')
+        error_file_path = os.path.join(_path('STORAGE_DIR'), 'completed_conflicts.csv')
         completed_conflicts.to_csv(error_file_path, index = False)
         print(f"{len(completed_conflicts)} conflicts found updating complete.parquet. Conflicting rows saved to {error_file_path}.")
 
     # Merging to reprocess.parquet + error checking
     updated_df_r, reprocess_conflicts = _safe_merge(df_r, new_empty_rawText_rows)
     if len(reprocess_conflicts):
-        error_file_path = os.path.join(STORAGE_DIR, 'reprocess_conflicts.csv')
+        error_file_path = os.path.join(_path('STORAGE_DIR'), 'reprocess_conflicts.csv')
         reprocess_conflicts.to_csv(error_file_path, index = False)
         print(f"{len(reprocess_conflicts)} conflicts found updating complete.parquet. Conflicting rows saved to {error_file_path}.")
 
+    if persist:
+        file_scraped_rows(df_u)
+
     return updated_df_c, updated_df_r
 
+def file_scraped_rows(df_u: pd.DataFrame, source: str = None):
+    """
+    Files a scraped batch without loading the complete/reprocess datasets: rows with rawText are
+    appended to 'complete' and the rest to 'reprocess', as one new part file each. An id_text that is
+    already filed (in either dataset, or earlier in the batch) is a conflict: the id_text index
+    rejects it and it is saved to completed_conflicts.csv / reprocess_conflicts.csv.
+
+    Args:
+        df_u (pd.DataFrame): The scraped rows.
+        source (str): Dataset the rows come from (e.g. UNCOMPLETE_FILE_PATH). Filed rows are removed
+            from it (see remove_from_dataset) in the same index transaction that claims them, so an id
+            is never filed in two places. Rows coming from reprocess or complete are moved: their
+            existing entry is not a conflict, and rows filed back into their own dataset are new versions.
+
+    Returns:
+        dict: Number of rows filed per state.
+    """
+    has_raw_text = parquet_schema.has_raw_text(df_u['rawText'])
+    paths = {'complete': _path('COMPLETE_FILE_PATH'), 'reprocess': _path('REPROCESS_FILE_PATH')}
+    source_state = next((state for state, path in paths.items()
+                         if source is not None and os.path.abspath(path) == os.path.abspath(source)), None)
+    conn = _open_synced_index()
+    counts = {}
+    try:
+        for state, rows, conflicts_file in (('complete', df_u[has_raw_text], 'completed_conflicts.csv'),
+                                            ('reprocess', df_u[~has_raw_text], 'reprocess_conflicts.csv')):
+            dataset_path = paths[state]
+            with conn: # the claims are rolled back if a write fails
+                indexed = {indexed_state: id_index.get_fingerprint(conn, indexed_state) == dataset_fingerprint(paths[indexed_state])
+                           for indexed_state in {state, source_state} - {None}}
+                claimed = np.array(id_index.claim_ids(conn, state, rows['id_text'], moving_from=source_state), dtype=bool)
+                if claimed.any():
+                    append_to_dataset(dataset_path, rows[claimed])
+                    if source is not None and source_state != state:
+                        remove_from_dataset(source, rows.loc[claimed, 'id_text'])
+                for indexed_state, in_sync in indexed.items():
+                    if in_sync:
+                        id_index.set_fingerprint(conn, indexed_state, dataset_fingerprint(paths[indexed_state]))
+            counts[state] = int(claimed.sum())
+
+            if not claimed.all():
+                conflicts = rows.loc[~claimed, ['id_text']].copy()
+                conflicts['existing_state'] = conflicts['id_text'].astype(str).map(id_index.get_states(conn, conflicts['id_text']))
+                error_file_path = os.path.join(_path('STORAGE_DIR'), conflicts_file)
+                conflicts.to_csv(error_file_path, index=False)
+                print(f"{len(conflicts)} conflicts found updating {os.path.basename(dataset_path)}. Conflicting rows saved to {error_file_path}.")
+    finally:
+        conn.close()
+    print(f"FILED: {counts.get('complete', 0)} rows to complete, {counts.get('reprocess', 0)} to reprocess")
+    return counts
+
+def _open_synced_index():
+    """Opens the id_text index, re-indexing any dataset that changed since it was last synced."""
+    conn = id_index.open_index()
+    for state, dataset_path in (('complete', _path('COMPLETE_FILE_PATH')), ('reprocess', _path('REPROCESS_FILE_PATH'))):
+        fingerprint = dataset_fingerprint(dataset_path)
+        if id_index.get_fingerprint(conn, state) != fingerprint:
+            print(f"REINDEXING: {dataset_path}")
+            ids = read_dataset(dataset_path, columns=['id_text'])['id_text'] if os.path.exists(dataset_path) else []
+            id_index.rebuild_state(conn, state, ids, fingerprint)
+    return conn
+
+def dataset_fingerprint(dataset_path: str):
+    """Cheap change marker for a dataset: names and sizes of its part files (or the legacy file's size/mtime)."""
+    if os.path.isfile(dataset_path):
+        stat = os.stat(dataset_path)
+        return f"file:{stat.st_size}:{stat.st_mtime_ns}"
+    parts = [f"{os.path.basename(part)}:{os.path.getsize(part)}" for part in list_parts(dataset_path)]
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
 def _safe_merge(df_master: pd.DataFrame, df: pd.DataFrame, col_name: str = 'id_text'):
     """Concatenates df to df_master, avoiding duplicate id_text entries."""
     conflicting_ids = df[col_name].isin(df_master[col_name])
@@ -96,11 +415,12 @@ def _safe_merge(df_master: pd.DataFrame, df: pd.DataFrame, col_name: str = 'id_t
 
 def dropbox_oauth():
     """Create Dropbox client using refresh token stored in environment"""
+    import dropbox
     try:
         dbx = dropbox.Dropbox(
-            app_key=os.getenv("DROPBOX_APP_KEY"),
-            app_secret=os.getenv("DROPBOX_APP_SECRET"),
-            oauth2_refresh_token=os.getenv("DROPBOX_REFRESH_TOKEN")
+            app_key=config.get("DROPBOX_APP_KEY"),
+            app_secret=config.get("DROPBOX_APP_SECRET"),
+            oauth2_refresh_token=config.get("DROPBOX_REFRESH_TOKEN")
         )
         
         # Test the connection
@@ -111,127 +431,108 @@ def dropbox_oauth():
         print(f'Error creating Dropbox client: {e}')
         raise
 
-def orchestrate_upload_workflow(overwrite=False, client=None):
-    for file_name in os.listdir(STORAGE_DIR):
-        if file_name == "input.dta" or file_name.startswith("."):
-            print(f"Skipping: {file_name}")
-            continue
-        print(f'Uploading: {file_name}')
-        file_path = os.path.join(STORAGE_DIR, file_name)
-        _upload_file_to_dropbox(client, file_path, overwrite)
-
-def _upload_file_to_dropbox(client, file_path, overwrite=False):
-    """Uploads a file to Dropbox."""
-    # Finding upload path
-    dropbox_folder = os.getenv("DROPBOX_FOLDER")
-    file_name = os.path.basename(file_path)
-    upload_path = f"/{dropbox_folder}/{file_name}"
-
+def orchestrate_upload_workflow(overwrite=False, client=None, policy=None, max_workers=4):
+    """Backs up STORAGE_DIR to Dropbox, transferring only files whose content changed. Existing remote
+    files with different content are replaced if overwrite is True (or per policy, see dropbox_sync).
+    The folders of partitioned datasets are mirrored: remote parts that no longer exist locally (e.g.
+    after a compaction) are deleted."""
+    dropbox_folder = config.get("DROPBOX_FOLDER")
     if not dropbox_folder:
         raise ValueError("Dropbox folder must be set in the .env file.")
 
-    # Configuring dropbox client
-    if client: # if OAuth is successful
-        dbx = client
-    else:
-        access_token = os.getenv("DROPBOX_ACCESS_TOKEN")
-        if not access_token:
-            raise ValueError("Access token must be set in the .env file.")
-        dbx = dropbox.Dropbox(access_token) # dropbox client
+    storage_dir = _path('STORAGE_DIR')
+    files, dataset_folders = [], []
+    for file_name in sorted(os.listdir(storage_dir)):
+        file_path = os.path.join(storage_dir, file_name)
+        if file_name == "input.dta" or file_name.startswith("."):
+            print(f"Skipping: {file_name}")
+        elif os.path.isdir(file_path): # partitioned dataset: sync each part under the dataset's folder
+            files.extend((part_path, f"{file_name}/{os.path.basename(part_path)}") for part_path in list_parts(file_path))
+            if file_name.endswith('.parquet'): # not e.g. dataset/, which also holds files that are only remote
+                dataset_folders.append(file_name)
+        else:
+            files.append((file_path, file_name))
 
-    # Check if the file already exists in Dropbox
-    try:
-        dbx.files_get_metadata(upload_path)
-        if overwrite:
-            confirm = input(f"{file_name} already exists. Do you want to overwrite it? (y/n): ").strip().lower()
-            if confirm != 'y':
-                print(f"Skipping upload of {file_name}.")
-                return
-    except dropbox.exceptions.ApiError as e:
-        print(f"NEW FILE FOUND: {file_name}")
+    import dropbox_sync
+    policy = policy or ('overwrite' if overwrite else 'skip')
+    return dropbox_sync.upload_changed_files(_dropbox_client(client), files, f"/{dropbox_folder}", policy, max_workers,
+                                             mirror_folders=dataset_folders)
 
-    try:
-        with open(file_path, 'rb') as f:
-            mode = WriteMode.overwrite if overwrite else WriteMode.add
-            dbx.files_upload(f.read(), upload_path, mode=mode)
-        print(f"\tSuccessfully uploaded {file_name} to {upload_path}")
-    except Exception as e:
-        print(f"Error uploading {file_name} to Dropbox: {e}")
+def _dropbox_client(client=None):
+    """Returns client, or a Dropbox client built from the access token in the .env file."""
+    if client: # if OAuth is successful
+        return client
+    import dropbox
+    access_token = config.get("DROPBOX_ACCESS_TOKEN")
+    if not access_token:
+        raise ValueError("Access token must be set in the .env file.")
+    return dropbox.Dropbox(access_token) # dropbox client
     
 def create_stata_output_file(df,file_name):
-    """Reads the dataframe and does some post-processing to ensure stata conversion is optimized."""
-    snippet_1, snippet_2, snippet_3, snippet_4 = zip(*[rawText for rawText in df['rawText'] if len(rawText) == 4])
+    """Writes the dataframe to a Stata file, with rawText projected onto the snippet_1..snippet_4 columns.
+    Strings are sanitized and rows are written batch by batch (see stata_writer)."""
+    table = parquet_schema.to_table(df.drop(columns='rawText'))
+    for col, snippets in zip(parquet_schema.SNIPPET_COLUMNS, parquet_schema.snippet_arrays(df['rawText'])):
+        table = table.append_column(col, snippets)
     
-    df = df.drop(columns='rawText')
-    df[['snippet_1', 'snippet_2', 'snippet_3', 'snippet_4']] = list(zip(snippet_1, snippet_2, snippet_3, snippet_4))
-    
-    stata_file_path = os.path.join(STORAGE_DIR, file_name)
-    df.to_stata(stata_file_path, version=118)
+    stata_file_path = os.path.join(_path('STORAGE_DIR'), file_name)
+    stata_writer.export_table(table, stata_file_path)
     print(f"Successfully generated {stata_file_path}")
-    return df
+    return stata_file_path
 
-def import_files_from_dropbox(client=None):
-    """Imports files from Dropbox into the storage directory."""
-    if client:
-        dbx = client
-    else:
-        access_token = os.getenv("DROPBOX_ACCESS_TOKEN")
-        # Read & download files from Dropbox
-        dbx = dropbox.Dropbox(access_token)
-    
-    dropbox_folder = os.getenv("DROPBOX_FOLDER")
-    files = dbx.files_list_folder(f'/{dropbox_folder}/data-files/')
-    for file in files.entries:
-        if file.name.endswith('.parquet'):
-            print(f"Downloading {file.path_lower}")
-            dbx.files_download_to_file(os.path.join(STORAGE_DIR, 'dataset', file.name), file.path_lower)
-
-def generate_sample_output_file(filename='sample.xlsx', n_samples=200, onlyIsProfessor=False):
+def import_files_from_dropbox(client=None, policy='overwrite', max_workers=4):
+    """Imports changed .parquet files from Dropbox into the storage directory."""
+    import dropbox_sync
+    dropbox_folder = config.get("DROPBOX_FOLDER")
+    return dropbox_sync.download_changed_files(_dropbox_client(client), f'/{dropbox_folder}/data-files/',
+                                               os.path.join(_path('STORAGE_DIR'), 'dataset'), policy, max_workers,
+                                               suffixes=('.parquet',))
+
+def generate_sample_output_file(filename='sample.xlsx', n_samples=200, onlyIsProfessor=False, use_cache=False):
     """Reads the complete Parquet file, randomly samples n_samples rows, and writes to an Excel file.
     If onlyIsProfessor is True, samples only from rows where isProfessor is True.
+    If use_cache is True, rows are sampled from the memory-mapped Arrow cache (see arrow_cache) and
+    only the sampled rows are converted.
     """
-    df = pd.read_parquet(f"{STORAGE_DIR}/complete.parquet")
-    
-    if onlyIsProfessor:
-        df = df[df['isProfessor'] == True]
-    
-    sample_df = df.sample(n=n_samples)
-    sample_df.to_excel(os.path.join(STORAGE_DIR, filename), index=False)
-    print(f"Successfully generated {filename} with {n_samples} samples.")
+    if use_cache:
+        sample_df = _sample_cached(_path('COMPLETE_FILE_PATH'), n_samples, onlyIsProfessor)
+    else:
+        df = read_dataset(_path('COMPLETE_FILE_PATH'))
 
-def upload_large_file(dbx, file_path, dropbox_file_path):
-    CHUNK_SIZE = 4 * 1024 * 1024  # 4MB chunks
-    file_size = os.path.getsize(file_path)
+        if onlyIsProfessor:
+            df = df[df['isProfessor'] == True]
 
-    with open(file_path, "rb") as f:
-        if file_size <= CHUNK_SIZE:
-            # If the file is small enough, upload it directly
-            dbx.files_upload(f.read(), dropbox_file_path, mode=WriteMode.overwrite)
-        else:
-            # Chunked upload
-            upload_session_start_result = dbx.files_upload_session_start(f.read(CHUNK_SIZE))
-            session_id = upload_session_start_result.session_id
-            cursor = dropbox.files.UploadSessionCursor(session_id=session_id, offset=f.tell())
-            commit = dropbox.files.CommitInfo(path=dropbox_file_path, mode=WriteMode.overwrite)
-
-            # Initialize progress bar
-            with tqdm(total=file_size, unit='B', unit_scale=True, desc="Uploading") as pbar:
-                pbar.update(CHUNK_SIZE)  # Update for the first chunk
-
-                while f.tell() < file_size:
-                    if (file_size - f.tell()) <= CHUNK_SIZE:
-                        dbx.files_upload_session_finish(f.read(CHUNK_SIZE), cursor, commit)
-                    else:
-                        dbx.files_upload_session_append(f.read(CHUNK_SIZE), cursor.session_id, cursor.offset)
-                        cursor.offset = f.tell()
-                    
-                    pbar.update(CHUNK_SIZE)  # Update progress bar after each chunk
+        sample_df = df.sample(n=n_samples)
+    sample_df.to_excel(os.path.join(_path('STORAGE_DIR'), filename), index=False)
+    print(f"Successfully generated {filename} with {n_samples} samples.")
+
+def _sample_cached(dataset_path, n_samples, onlyIsProfessor):
+    """Samples n_samples rows of the dataset's Arrow cache without converting the rest."""
+    dataset = arrow_cache.open_dataset(dataset_path)
+    if onlyIsProfessor:
+        candidates = np.flatnonzero(dataset['isProfessor'].to_numpy() == True)
+    else:
+        candidates = np.arange(len(dataset))
+    if n_samples > len(candidates):
+        raise ValueError(f"Cannot take a sample of {n_samples} rows from {len(candidates)}.")
+    rows = np.sort(np.random.default_rng().choice(candidates, size=n_samples, replace=False))
+    return dataset.to_pandas(rows=rows)
+
+def upload_large_file(dbx, file_path, dropbox_file_path, chunk_size=None, max_workers=1):
+    """Uploads a (large) file in chunks (dropbox_upload.DEFAULT_CHUNK_SIZE by default), resuming an
+    interrupted upload session. See dropbox_upload."""
+    import dropbox_upload
+    return dropbox_upload.upload_large_file(dbx, file_path, dropbox_file_path,
+                                            chunk_size=chunk_size or dropbox_upload.DEFAULT_CHUNK_SIZE,
+                                            max_workers=max_workers)
 
 def push_new_dataset_files_to_dropbox(dbx):
     """Pushes CSV file generated from API calls to the dropbox folder and empties local cache"""
+    from tqdm import tqdm
+    from dropbox.files import WriteMode
     # Define Dropbox folder and local cache path
-    dropbox_folder = os.getenv("DROPBOX_FOLDER")
-    local_cache_path = f"{STORAGE_DIR}/dataset"
+    dropbox_folder = config.get("DROPBOX_FOLDER")
+    local_cache_path = f"{_path('STORAGE_DIR')}/dataset"
 
     # Check for CSV files in the local cache
     csv_files = [f for f in os.listdir(local_cache_path) if f.endswith('.csv')]
@@ -254,7 +555,7 @@ def push_new_dataset_files_to_dropbox(dbx):
             pbar.update(1)
 
     # Upload [updating] parquet file without deleting it
-    file_path = os.path.join(STORAGE_DIR, 'dataset', PARQUET_FILE_NAME)
+    file_path = os.path.join(_path('STORAGE_DIR'), 'dataset', PARQUET_FILE_NAME)
     dropbox_file_path = os.path.join(dropbox_folder, 'data-files', PARQUET_FILE_NAME)
 
     upload_large_file(dbx, file_path, dropbox_file_path)
@@ -270,39 +571,92 @@ def push_new_dataset_files_to_dropbox(dbx):
 
 def update_parquet_file(df: pd.DataFrame, parquet_file_path: str, processed_ids):
     """
-    Updates a Parquet file with information from the provided DataFrame, matching on id_text.
+    Records updates to a Parquet file, matching on id_text, without rewriting it: the rows of df
+    (rawText split into the snippet columns) and the processed ids are appended as a delta part of
+    `<file>.updates` (UPDATES_SUFFIX), in time proportional to the update. fold_parquet_updates later
+    applies every delta in one rewrite; until then pending_updates lists the ids marked processed.
     
     Args:
         df (pd.DataFrame): DataFrame containing the new information
         parquet_file_path (str): Path to the Parquet file to be updated
         processed_ids (list): List of id_text values to mark as processed
     """
-    # Read the existing Parquet file
-    parquet_df = pd.read_parquet(parquet_file_path)
-    
-    # Ensure id_text is string type in both DataFrames
-    parquet_df['id_text'] = parquet_df['id_text'].astype(str)
-    df['id_text'] = df['id_text'].astype(str)
+    updates = df.copy()
+    updates['id_text'] = updates['id_text'].astype(str)
     
     # Convert rawText lists directly to snippet columns
-    df[['snippet_1', 'snippet_2', 'snippet_3', 'snippet_4']] = pd.DataFrame(df['rawText'].tolist(), index=df.index)
-    df = df.drop(columns='rawText')
+    if 'rawText' in updates.columns:
+        updates[parquet_schema.SNIPPET_COLUMNS] = parquet_schema.split_snippets(updates['rawText'])
+        updates = updates.drop(columns='rawText')
     
-    # Create a mapping of id_text to row updates
-    update_dict = df.set_index('id_text').to_dict('index')
+    processed_ids = pd.Index(pd.Series(list(processed_ids), dtype=object).astype(str).unique())
+    updates['isProcessed'] = updates['id_text'].isin(processed_ids).where(lambda marked: marked, None)
+    # Processed ids without new information go to a part of their own, which only marks them
+    marks = pd.DataFrame({'id_text': processed_ids.difference(updates['id_text'], sort=False), 'isProcessed': True})
+
+    updates_path = parquet_file_path + UPDATES_SUFFIX
+    _ensure_dataset(updates_path)
+    for delta in (updates, marks):
+        if len(delta):
+            _atomic_write_parquet(delta, os.path.join(updates_path, _new_part_name()))
+
+def pending_updates(parquet_file_path: str) -> set:
+    """The ids that update_parquet_file marked processed but that are not folded into the file yet."""
+    ids = set()
+    for part in list_parts(parquet_file_path + UPDATES_SUFFIX):
+        delta = parquet_schema.read_table(part, columns=['id_text', 'isProcessed']).to_pandas()
+        ids.update(delta.loc[delta['isProcessed'].eq(True), 'id_text'])
+    return ids
+
+def fold_parquet_updates(parquet_file_path: str) -> int:
+    """
+    Applies the delta parts written by update_parquet_file to the file, oldest first, in one atomic
+    rewrite, then removes them. All updated (or new) columns of a delta are written in one aligned
+    assignment per column. Rows are written sorted by isProcessed, unprocessed first. Folding again
+    after a crash between the rewrite and the removal gives the same file.
+
+    Returns:
+        int: Number of delta parts applied.
+    """
+    updates_path = parquet_file_path + UPDATES_SUFFIX
+    parts = list_parts(updates_path)
+    if parts:
+        parquet_df = pd.read_parquet(parquet_file_path)
+        parquet_df['id_text'] = parquet_df['id_text'].astype(str)
+        for part in parts:
+            _apply_delta(parquet_df, pd.read_parquet(part))
+
+        # Keep unprocessed rows clustered at the start (stable, so file order is otherwise kept): their row
+        # groups are the only ones the statistics-based work selection has to read
+        parquet_df = parquet_df.sort_values('isProcessed', kind='stable', ignore_index=True)
+        _atomic_write_parquet(parquet_df, parquet_file_path)
+    if os.path.exists(updates_path):
+        shutil.rmtree(updates_path)
+    return len(parts)
+
+def _apply_delta(parquet_df: pd.DataFrame, delta: pd.DataFrame):
+    """Writes the columns of one delta part into the matching rows of parquet_df, in place."""
+    # Index updates by id_text (last occurrence wins) and align them to the file's rows
+    updates = delta.drop_duplicates(subset='id_text', keep='last').set_index('id_text')
+    matched = parquet_df['id_text'].isin(updates.index)
+    aligned = updates.reindex(parquet_df.loc[matched, 'id_text'])
     
-    # Update matching rows
-    for idx, row in parquet_df.iterrows():
-        if row['id_text'] in update_dict:
-            for col, value in update_dict[row['id_text']].items():
-                if col in parquet_df.columns:  # Update if column exists
-                    parquet_df.at[idx, col] = value
-                else:  # Add new column if it doesn't exist
-                    parquet_df[col] = None  # Initialize new column with None
-                    parquet_df.at[idx, col] = value  # Set the value for the new column
+    for col in updates.columns.drop('isProcessed'):
+        if col not in parquet_df.columns:
+            parquet_df[col] = None  # Initialize new column with None
+        elif parquet_df[col].dtype != aligned[col].dtype:
+            parquet_df[col] = parquet_df[col].astype(object)  # Avoid lossy casts when dtypes differ
+        parquet_df.loc[matched, col] = aligned[col].to_numpy()
     
     # Mark rows as processed
-    parquet_df.loc[parquet_df['id_text'].isin(processed_ids), 'isProcessed'] = True
-    
-    # Save the updated DataFrame back to Parquet format
-    parquet_df.to_parquet(parquet_file_path, index=False)
+    parquet_df.loc[parquet_df['id_text'].isin(updates.index[updates['isProcessed'].eq(True)]), 'isProcessed'] = True
+
+def _atomic_write_parquet(df: pd.DataFrame, file_path: str):
+    """Writes df to a temp file next to file_path and renames it into place."""
+    tmp_path = f"{file_path}.tmp-{os.getpid()}"
+    try:
+        parquet_schema.write_table(df, tmp_path)
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
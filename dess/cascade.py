@@ -0,0 +1,106 @@
+"""
+Rules-first department cascade: the regex/keyword rules of nlp.py run on every row, and only the
+rows they couldn't resolve confidently are sent to the LLM.
+
+A row is routed to the LLM when it is a professor with snippets and
+- neither rule found a department ('missing'), or
+- the department came only from a backup pattern ('backup_only'), or
+- the department came only from a keyword above the accepted precision level ('low_precision').
+
+The final department and the tier that produced it are written to `department` and
+`department_source`, in this order of precedence: textual_primary, keyword, llm, textual_backup,
+keyword_low_precision, none. The raw LLM answer is kept in `department_llm`.
+"""
+
+import pandas as pd
+import dess.nlp as nlp
+from dess.llm import infer_departments_with_llm
+
+MAX_KEYWORD_PRECISION = 2 # keyword levels 1 (most precise) to 3; levels above this are 'low precision'
+MISSING = "MISSING"
+
+
+def resolve_departments(df: pd.DataFrame, run_rules: bool = True, max_keyword_precision: int = MAX_KEYWORD_PRECISION,
+                        accept_backup: bool = False, professors_only: bool = True, llm_type: str = "gemini",
+                        model_name: str = None, **engine_options) -> dict:
+    """
+    Runs the cascade on df in place.
+
+    Args:
+        run_rules (bool): Run nlp.extract_department_information first; False if df already has its columns.
+        max_keyword_precision (int): Highest keyword precision level accepted without the LLM.
+        accept_backup (bool): Accept backup-pattern matches without the LLM.
+        professors_only (bool): Only route rows with isProfessor; other rows keep their rule result.
+        llm_type, model_name, engine_options: Passed on to infer_departments_with_llm (e.g. pack_size=20).
+
+    Returns:
+        dict: Number of rows routed per reason, and number of rows per final department_source.
+    """
+    if run_rules:
+        nlp.extract_department_information(df)
+
+    reasons = route_to_llm(df, max_keyword_precision, accept_backup, professors_only)
+    routed = reasons.notna()
+    print(f"Routing {routed.sum()} of {len(df)} rows to the LLM")
+
+    df['department_llm'] = None
+    if routed.any():
+        texts = df.loc[routed, 'rawText'].apply(lambda snippets: "\n".join(snippets))
+        answers = infer_departments_with_llm(texts, llm_type=llm_type, model_name=model_name, **engine_options)
+        df.loc[routed, 'department_llm'] = answers.map(_normalize_answer)
+
+    _choose_department(df, max_keyword_precision)
+    summary = {'routed': reasons.value_counts().to_dict(),
+               'department_source': df['department_source'].value_counts().to_dict()}
+    print(summary)
+    return summary
+
+
+def route_to_llm(df: pd.DataFrame, max_keyword_precision: int = MAX_KEYWORD_PRECISION, accept_backup: bool = False,
+                 professors_only: bool = True) -> pd.Series:
+    """Returns, per row, why it should go to the LLM ('missing', 'backup_only', 'low_precision'), or None."""
+    textual_found = df['department_textual'].ne(MISSING) & df['department_textual'].notna()
+    keyword_found = df['department_keyword'].ne(MISSING) & df['department_keyword'].notna()
+    primary = textual_found & df['isPrimaryPattern'].eq(1)
+    backup = textual_found & df['isPrimaryPattern'].eq(0)
+    confident_keyword = keyword_found & df['keyword_precision'].between(1, max_keyword_precision)
+    resolved = primary | confident_keyword | (backup & accept_backup)
+
+    eligible = df['rawText'].map(lambda snippets: snippets is not None and len(snippets) > 0)
+    if professors_only:
+        eligible &= df['isProfessor'].eq(True)
+
+    reasons = pd.Series(None, index=df.index, dtype=object)
+    reasons[~textual_found & ~keyword_found] = 'missing'
+    reasons[backup] = 'backup_only'
+    reasons[keyword_found & ~confident_keyword & ~backup] = 'low_precision'
+    reasons[resolved | ~eligible] = None
+    return reasons
+
+
+def _choose_department(df, max_keyword_precision):
+    """Fills department/department_source from the highest-precedence tier that found something."""
+    textual_found = df['department_textual'].ne(MISSING) & df['department_textual'].notna()
+    keyword_found = df['department_keyword'].ne(MISSING) & df['department_keyword'].notna()
+    llm_found = df['department_llm'].notna() & df['department_llm'].ne(MISSING)
+    tiers = [
+        ('textual_primary', textual_found & df['isPrimaryPattern'].eq(1), 'department_textual'),
+        ('keyword', keyword_found & df['keyword_precision'].between(1, max_keyword_precision), 'department_keyword'),
+        ('llm', llm_found, 'department_llm'),
+        ('textual_backup', textual_found, 'department_textual'),
+        ('keyword_low_precision', keyword_found, 'department_keyword'),
+    ]
+    df['department'] = MISSING
+    df['department_source'] = 'none'
+    # Assign from the lowest tier up, so higher tiers overwrite
+    for source, found, col in reversed(tiers):
+        df.loc[found, 'department'] = df.loc[found, col]
+        df.loc[found, 'department_source'] = source
+
+
+def _normalize_answer(answer):
+    """Lower-cases LLM answers like the rule outputs; failed requests stay None so they are retried next run."""
+    if answer is None:
+        return None
+    answer = answer.strip().strip('."\'').lower()
+    return MISSING if not answer or answer == MISSING.lower() else answer
@@ -1,19 +1,26 @@
 import pandas as pd
-from dess.llms.gemini_llm import GeminiLLM
+from dess.llms.llm_factory import LLMFactory
+from dess.llms.inference_engine import InferenceEngine
+from dess.llms.prompt_packing import infer_departments_packed
 
-def infer_departments_with_llm(texts: pd.Series) -> pd.Series:
-    """Infer departments using the Gemini LLM model."""
-    llm = GeminiLLM()
+def infer_departments_with_llm(texts: pd.Series, llm_type: str = "gemini", model_name: str = None,
+                               pack_size: int = 1, **engine_options) -> pd.Series:
+    """
+    Infer departments using an LLM backend (Gemini by default, "stub" for offline runs).
+
+    Requests are sent concurrently under the in-flight, requests-per-minute and tokens-per-minute
+    limits of the InferenceEngine (configurable through engine_options or the LLM_* environment
+    variables). With pack_size > 1, up to pack_size texts share one prompt with a JSON answer
+    (see prompt_packing). Rows whose request failed after all retries get None.
+    """
+    llm = LLMFactory.get_llm(llm_type, model_name)
     if not llm.isOk():
         raise ValueError("Failed to initialize LLM")
-    
-    # Process in batches of 10 to avoid rate limits
-    batch_size = 10
-    results = []
-    
-    for i in range(0, len(texts), batch_size):
-        batch = texts.iloc[i:i + batch_size].tolist()
-        batch_results = llm.infer_departments_batch(batch)
-        results.extend(batch_results)
-    
-    return pd.Series(results, index=texts.index)
\ No newline at end of file
+
+    engine = InferenceEngine(llm, **engine_options)
+    if pack_size > 1:
+        results = infer_departments_packed(llm, texts.tolist(), engine, max_records=pack_size)
+    else:
+        results = engine.run([llm.department_prompt(text) for text in texts.tolist()])
+
+    return pd.Series([result.strip() if result is not None else None for result in results], index=texts.index)
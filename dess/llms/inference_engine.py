@@ -0,0 +1,204 @@
+"""
+Concurrent, rate-limited inference over an LLMBase backend.
+
+Prompts are sent concurrently, up to max_in_flight at a time, while token buckets keep the
+request rate under requests_per_minute and the estimated token rate under tokens_per_minute.
+Requests that are rate limited, time out or hit a transient server/connection error are retried
+with exponential backoff and jitter; other errors (bad request, auth, ...) fail the prompt at once.
+Results are returned in input order; a prompt that still fails after max_retries gets None.
+
+The timeout is passed to the backend's client, which gives up on the request and frees its thread.
+A call that ignores it keeps its in-flight slot until its thread returns, so hung calls can never
+grow the number of busy threads beyond max_in_flight.
+
+Usage:
+    llm = LLMFactory.get_llm("stub", latency=0.05)
+    engine = InferenceEngine(llm, max_in_flight=16, requests_per_minute=600)
+    responses = engine.run(prompts)
+    python3 -m dess.llms.inference_engine 500      # offline throughput check against the stub backend
+"""
+
+import sys
+import time
+import random
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+import config
+
+# Settings derived from the environment, resolved when first used (see __getattr__)
+_ENV_SETTINGS = {
+    'MAX_IN_FLIGHT': lambda: int(config.get("LLM_MAX_IN_FLIGHT", 8)),
+    'REQUESTS_PER_MINUTE': lambda: int(config.get("LLM_REQUESTS_PER_MINUTE", 60)),
+    'TOKENS_PER_MINUTE': lambda: int(config.get("LLM_TOKENS_PER_MINUTE", 100_000)),
+}
+EXPECTED_OUTPUT_TOKENS = 16 # department names are short
+TIMEOUT_GRACE = 5.0 # seconds past the client timeout before a call is given up on without its thread
+# Errors worth retrying, by class name (google.api_core / HTTP client errors) or HTTP status code
+TRANSIENT_ERROR_NAMES = {'ResourceExhausted', 'TooManyRequests', 'ServiceUnavailable', 'DeadlineExceeded',
+                         'InternalServerError', 'GatewayTimeout', 'BadGateway', 'Aborted'}
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+def __getattr__(name):
+    if name in _ENV_SETTINGS:
+        return _ENV_SETTINGS[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _setting(name):
+    return __getattr__(name)
+
+
+def is_transient(error: BaseException) -> bool:
+    """Whether a failed request may succeed if retried: rate limits, timeouts, connection and server errors."""
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    if any(cls.__name__ in TRANSIENT_ERROR_NAMES for cls in type(error).__mro__):
+        return True
+    code = getattr(error, 'code', None) or getattr(error, 'status_code', None)
+    return isinstance(code, int) and code in TRANSIENT_STATUS_CODES
+
+
+def estimate_tokens(prompt: str) -> int:
+    """Rough token count of a request: ~4 characters per prompt token plus the expected answer."""
+    return len(prompt) // 4 + EXPECTED_OUTPUT_TOKENS
+
+
+class RateLimiter:
+    """
+    Token bucket refilled continuously at per_minute units per minute (bursts up to per_minute).
+
+    The bucket is guarded by a thread lock that is never held while waiting, so one limiter can be
+    shared by every run of an engine, whichever event loop (or helper thread, see InferenceEngine.run)
+    each run happens on.
+    """
+    def __init__(self, per_minute: int):
+        self.per_minute = per_minute
+        self.available = float(per_minute)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    async def acquire(self, amount: int = 1):
+        # A request larger than the whole bucket would wait forever; let it drain the bucket instead
+        amount = min(amount, self.per_minute)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.available = min(self.per_minute, self.available + (now - self.updated) * self.per_minute / 60)
+                self.updated = now
+                if self.available >= amount:
+                    self.available -= amount
+                    return
+                wait = (amount - self.available) * 60 / self.per_minute
+            await asyncio.sleep(wait)
+
+
+class InferenceEngine:
+    """
+    Runs prompts through an LLM concurrently under in-flight, request-rate and token-rate limits.
+
+    Args:
+        llm (LLMBase): Backend; its blocking generate is called on a pool of max_in_flight threads. Prompts
+            found in the backend's response cache are answered without a request (or a rate-limit slot).
+        max_in_flight (int): Maximum concurrent requests; MAX_IN_FLIGHT if None.
+        requests_per_minute (int): Request budget; REQUESTS_PER_MINUTE if None, 0 disables the limit.
+        tokens_per_minute (int): Estimated token budget (see estimate_tokens); TOKENS_PER_MINUTE if None,
+            0 disables the limit.
+        max_retries (int): Retries per prompt after the first attempt (transient errors only, see is_transient).
+        backoff (float): Base delay in seconds; attempt n waits backoff * 2**n plus jitter.
+        timeout (float): Seconds the backend's client waits for an answer before the request is retried.
+    """
+    def __init__(self, llm, max_in_flight: int = None, requests_per_minute: int = None,
+                 tokens_per_minute: int = None, max_retries: int = 4, backoff: float = 1.0,
+                 timeout: float = 60.0):
+        self.llm = llm
+        self.max_in_flight = max_in_flight or _setting('MAX_IN_FLIGHT')
+        self.requests_per_minute = _setting('REQUESTS_PER_MINUTE') if requests_per_minute is None else requests_per_minute
+        self.tokens_per_minute = _setting('TOKENS_PER_MINUTE') if tokens_per_minute is None else tokens_per_minute
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.metrics = {'cache_hits': 0, 'requests': 0, 'retries': 0, 'failures': 0, 'abandoned': 0}
+        # Created once, so back-to-back runs (e.g. packed prompts, then their retries) share one budget
+        self.request_limiter = RateLimiter(self.requests_per_minute) if self.requests_per_minute else None
+        self.token_limiter = RateLimiter(self.tokens_per_minute) if self.tokens_per_minute else None
+
+    def run(self, prompts: List[str]) -> List[str]:
+        """Blocking entry point. Works from scripts and from notebooks (which already run an event loop)."""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.arun(prompts))
+
+        # An event loop is already running in this thread (e.g. Jupyter): run ours on a helper thread
+        results = []
+        thread = threading.Thread(target=lambda: results.append(asyncio.run(self.arun(prompts))))
+        thread.start()
+        thread.join()
+        return results[0]
+
+    async def arun(self, prompts: List[str]) -> List[str]:
+        """Sends every prompt and returns the responses in input order (None where all attempts failed)."""
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=self.max_in_flight)
+        request_limiter, token_limiter = self.request_limiter, self.token_limiter
+
+        async def infer(prompt):
+            cached = self.llm.cached_response(prompt)
+            if cached is not None:
+                self.metrics['cache_hits'] += 1
+                return cached
+            for attempt in range(self.max_retries + 1):
+                if request_limiter:
+                    await request_limiter.acquire()
+                if token_limiter:
+                    await token_limiter.acquire(estimate_tokens(prompt))
+                await semaphore.acquire()
+                self.metrics['requests'] += 1
+                call = loop.run_in_executor(executor, functools.partial(self.llm.generate, prompt, timeout=self.timeout))
+                # The slot is freed when the thread is, not when we stop waiting for it
+                call.add_done_callback(lambda _: semaphore.release())
+                try:
+                    response = await asyncio.wait_for(asyncio.shield(call), self.timeout + TIMEOUT_GRACE)
+                    self.llm.cache_response(prompt, response)
+                    return response
+                except asyncio.TimeoutError as e:
+                    self.metrics['abandoned'] += 1
+                    error = e
+                except Exception as e:
+                    error = e
+                    if not is_transient(e):
+                        break
+                if attempt < self.max_retries:
+                    self.metrics['retries'] += 1
+                    await asyncio.sleep(self.backoff * 2 ** attempt * (1 + random.random()))
+            self.metrics['failures'] += 1
+            print(f"LLM request failed after {attempt + 1} attempts: {error!r}")
+            return None
+
+        try:
+            # gather keeps the order of its arguments, whatever order the requests finish in
+            return await asyncio.gather(*(infer(prompt) for prompt in prompts))
+        finally:
+            executor.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    from dess.llms.llm_factory import LLMFactory
+
+    n_prompts = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    llm = LLMFactory.get_llm("stub", use_cache=False, latency=0.05, failure_rate=0.05)
+    engine = InferenceEngine(llm, max_in_flight=16, requests_per_minute=0, tokens_per_minute=0, backoff=0.05)
+    # Distinct department per prompt (letters, since the stub's department pattern has no digits)
+    departments = [''.join(chr(ord('A') + int(d)) for d in str(i)) for i in range(n_prompts)]
+    texts = [f"Jane Doe is a professor in the Department of {department}." for department in departments]
+
+    start = time.perf_counter()
+    responses = engine.run([llm.department_prompt(text) for text in texts])
+    elapsed = time.perf_counter() - start
+
+    in_order = responses == departments
+    print(f"{n_prompts} prompts in {elapsed:.2f}s ({n_prompts / elapsed:.1f}/s), in order: {in_order}, "
+          f"metrics: {engine.metrics}")
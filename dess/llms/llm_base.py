@@ -1,4 +1,11 @@
 from abc import ABC
+from typing import List
+
+DEPARTMENT_PROMPT = """Given the following text about a professor or faculty member, extract their department name.
+        If no department is mentioned, return "MISSING". Only return the department name, nothing else.
+
+        Text: {text}
+        Department:"""
 
 class LLMBase(ABC):
     """
@@ -6,8 +13,43 @@ class LLMBase(ABC):
     contructor of the derived classes. The common code to get the response
     from the model is in this class.
     """
+    cache = None # optional ResponseCache shared by get_response and the inference engine
+
     def isOk(self) -> bool:
         return self.model_name is not None and self.llm is not None
-    
+
     def get_response(self, prompt: str) -> str:
+        """Get the response for a prompt, from the cache if this model already answered it."""
+        response = self.cached_response(prompt)
+        if response is None:
+            response = self.generate(prompt)
+            self.cache_response(prompt, response)
+        return response
+
+    def generate(self, prompt: str, timeout: float = None) -> str:
+        """Sends the prompt to the model (no caching); overridden by the backends, which give up (and
+        raise TimeoutError or their client's timeout error) after timeout seconds if it is set."""
         return self.llm.get_response(prompt)
+
+    def cached_response(self, prompt: str):
+        return self.cache.get(self.model_name, prompt) if self.cache is not None else None
+
+    def cache_response(self, prompt: str, response: str):
+        if self.cache is not None and response is not None:
+            self.cache.put(self.model_name, prompt, response)
+
+    def get_batch_responses(self, prompts: List[str]) -> List[str]:
+        """Get responses for multiple prompts, one request per prompt."""
+        return [self.get_response(prompt) for prompt in prompts]
+
+    def department_prompt(self, text: str) -> str:
+        """Builds the department extraction prompt for one text."""
+        return DEPARTMENT_PROMPT.format(text=text)
+
+    def infer_department(self, text: str) -> str:
+        """Infer department from text using a specific prompt."""
+        return self.get_response(self.department_prompt(text))
+
+    def infer_departments_batch(self, texts: List[str]) -> List[str]:
+        """Infer departments from multiple texts in batch."""
+        return self.get_batch_responses([self.department_prompt(text) for text in texts])
@@ -1,13 +1,46 @@
-from dess.llms.gemini_llm import GeminiLLM
+import config
+from dess.llms.stub_llm import StubLLM
+from dess.llms.response_cache import ResponseCache
+
+# Settings derived from the environment, resolved when first used (see __getattr__)
+_ENV_SETTINGS = {
+    'DEFAULT_GEMINI_MODEL': lambda: config.get("GEMINI_MODEL", "gemini-1.5-flash"),
+}
+
+def __getattr__(name):
+    if name in _ENV_SETTINGS:
+        return _ENV_SETTINGS[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _setting(name):
+    return __getattr__(name)
 
 
 class LLMFactory:
     """
     This class creates and returns the right LLM object.
     """
+    _cache = None
+
     @staticmethod
-    def get_llm(llm_type: str):
+    def get_llm(llm_type: str, model_name: str = None, use_cache: bool = True, **kwargs):
+        """Builds the backend; with use_cache, responses are read from and saved to the persistent ResponseCache."""
         if llm_type == "gemini":
-            return GeminiLLM(llm_type)
+            # Imported here so the stub backend works without the Gemini SDK installed
+            from dess.llms.gemini_llm import GeminiLLM
+            llm = GeminiLLM(model_name or _setting('DEFAULT_GEMINI_MODEL'))
+        elif llm_type == "stub":
+            llm = StubLLM(model_name or "stub", **kwargs)
         else:
-            raise ValueError(f"Invalid LLM type: {llm_type}")
\ No newline at end of file
+            raise ValueError(f"Invalid LLM type: {llm_type}")
+
+        if use_cache:
+            llm.cache = LLMFactory.get_cache()
+        return llm
+
+    @staticmethod
+    def get_cache() -> ResponseCache:
+        """The process-wide response cache (opened on first use)."""
+        if LLMFactory._cache is None:
+            LLMFactory._cache = ResponseCache()
+        return LLMFactory._cache
@@ -0,0 +1,108 @@
+"""
+Multi-record prompt packing for department inference.
+
+Up to max_records texts are packed into one prompt (staying under a token budget) that states
+the instructions once and asks for a JSON array of {"id", "department"} objects. Responses are
+validated; records that are missing, duplicated or malformed in the answer are retried one by one
+with the single-record prompt. Every answer is also cached under its single-record prompt, so
+re-runs hit the cache whatever the packing.
+"""
+
+import re
+import json
+from typing import List
+from dess.llms.inference_engine import InferenceEngine, estimate_tokens
+
+PACKED_DEPARTMENT_PROMPT = """Each record below is text about a professor or faculty member. Extract each person's department name.
+If no department is mentioned, use "MISSING". Answer with only a JSON array containing one object per record,
+[{{"id": "<record id>", "department": "<department name or MISSING>"}}], and nothing else.
+
+Records:
+{records}"""
+MAX_RECORDS = 20
+TOKEN_BUDGET = 6_000
+
+
+def packed_prompt(records: List[tuple]) -> str:
+    """Builds the packed prompt for (id, text) records, one JSON object per line."""
+    lines = "\n".join(json.dumps({'id': record_id, 'text': text}, ensure_ascii=False) for record_id, text in records)
+    return PACKED_DEPARTMENT_PROMPT.format(records=lines)
+
+
+def pack_records(texts: List[str], max_records: int = MAX_RECORDS, token_budget: int = TOKEN_BUDGET) -> List[list]:
+    """Groups (id, text) records greedily into packs of at most max_records and ~token_budget tokens."""
+    packs, pack, pack_tokens = [], [], estimate_tokens(PACKED_DEPARTMENT_PROMPT)
+    for i, text in enumerate(texts):
+        # Each record costs its text plus its JSON wrapper and its share of the answer
+        tokens = estimate_tokens(json.dumps({'id': str(i), 'text': text}, ensure_ascii=False))
+        if pack and (len(pack) >= max_records or pack_tokens + tokens > token_budget):
+            packs.append(pack)
+            pack, pack_tokens = [], estimate_tokens(PACKED_DEPARTMENT_PROMPT)
+        pack.append((str(i), text))
+        pack_tokens += tokens
+    if pack:
+        packs.append(pack)
+    return packs
+
+
+def parse_packed_response(response: str, record_ids: List[str]) -> dict:
+    """Returns {id: department} for the well-formed answers to record_ids in a packed response."""
+    if response is None:
+        return {}
+    # Tolerate code fences or text around the array
+    match = re.search(r"\[.*\]", response, re.DOTALL)
+    if not match:
+        return {}
+    try:
+        items = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(items, list):
+        return {}
+
+    expected, answers, seen = set(record_ids), {}, set()
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        record_id, department = str(item.get('id')), item.get('department')
+        if record_id in seen: # answered twice: trust neither
+            answers.pop(record_id, None)
+            continue
+        seen.add(record_id)
+        if record_id in expected and isinstance(department, str) and department.strip():
+            answers[record_id] = department.strip()
+    return answers
+
+
+def infer_departments_packed(llm, texts: List[str], engine: InferenceEngine = None, max_records: int = MAX_RECORDS,
+                             token_budget: int = TOKEN_BUDGET) -> List[str]:
+    """
+    Infers a department for each text with packed prompts, in input order.
+
+    Texts already cached under their single-record prompt are not sent. Records a packed answer
+    misses are retried individually; a record whose retry also fails gets None.
+    """
+    engine = engine or InferenceEngine(llm)
+    single_prompts = [llm.department_prompt(text) for text in texts]
+    results = [llm.cached_response(prompt) for prompt in single_prompts]
+
+    pending = [i for i, result in enumerate(results) if result is None]
+    packs = pack_records([texts[i] for i in pending], max_records, token_budget)
+    responses = engine.run([packed_prompt(pack) for pack in packs])
+
+    retry = []
+    for pack, response in zip(packs, responses):
+        answers = parse_packed_response(response, [record_id for record_id, _ in pack])
+        for record_id, _ in pack:
+            i = pending[int(record_id)]
+            if record_id in answers:
+                results[i] = answers[record_id]
+                llm.cache_response(single_prompts[i], answers[record_id])
+            else:
+                retry.append(i)
+
+    if retry:
+        print(f"Retrying {len(retry)} of {len(pending)} records individually")
+        for i, response in zip(retry, engine.run([single_prompts[i] for i in retry])):
+            results[i] = response
+    return results
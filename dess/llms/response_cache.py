@@ -0,0 +1,154 @@
+"""
+Persistent prompt -> response cache for LLM backends.
+
+Responses are stored in a local SQLite file keyed by a SHA-256 of the model name and the
+whitespace-normalized prompt, so re-running inference over text that was already classified costs
+nothing. The cache is bounded: once it holds more than max_entries, the least recently used
+entries are evicted. Hits, misses and evictions are counted in `metrics`.
+
+Sharing across machines: with shared_dir set (e.g. a folder synced by Dropbox, or LLM_CACHE_SHARED_DIR),
+every new response is also appended to `llm_cache-<hostname>.jsonl` in that folder, and the files
+written by other machines are imported when the cache is opened. Each machine only appends to its
+own file, so the synced files never conflict.
+"""
+
+import os
+import json
+import socket
+import sqlite3
+import hashlib
+import datetime
+import threading
+import config
+
+# Settings derived from the environment, resolved when first used (see __getattr__)
+_ENV_SETTINGS = {
+    'CACHE_FILE_PATH': lambda: config.storage_path('llm_cache.sqlite'),
+    'SHARED_DIR': lambda: config.get("LLM_CACHE_SHARED_DIR"),
+    'MAX_ENTRIES': lambda: int(config.get("LLM_CACHE_MAX_ENTRIES", 500_000)),
+}
+
+def __getattr__(name):
+    if name in _ENV_SETTINGS:
+        return _ENV_SETTINGS[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _setting(name):
+    return __getattr__(name)
+
+
+def cache_key(model_name: str, prompt: str) -> str:
+    """Cache key of a prompt: whitespace differences (e.g. template indentation) don't matter."""
+    normalized = ' '.join(prompt.split())
+    return hashlib.sha256(f"{model_name}\n{normalized}".encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    SQLite-backed LRU cache of LLM responses, safe to use from the inference engine's worker threads.
+
+    Args:
+        cache_path (str): Local SQLite file; CACHE_FILE_PATH by default.
+        max_entries (int): Entries kept; the least recently used 10% beyond this are evicted in one go.
+            MAX_ENTRIES by default.
+        shared_dir (str): Folder to exchange new entries with other machines through; SHARED_DIR by
+            default, '' to disable.
+    """
+    def __init__(self, cache_path: str = None, max_entries: int = None, shared_dir: str = None):
+        cache_path = cache_path or _setting('CACHE_FILE_PATH')
+        shared_dir = _setting('SHARED_DIR') if shared_dir is None else shared_dir
+        self.max_entries = max_entries or _setting('MAX_ENTRIES')
+        self.shared_dir = shared_dir
+        self.metrics = {'hits': 0, 'misses': 0, 'evictions': 0, 'imported': 0}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                  key TEXT PRIMARY KEY,
+                                  model_name TEXT NOT NULL,
+                                  response TEXT NOT NULL,
+                                  last_used TEXT NOT NULL
+                              ) WITHOUT ROWID""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_by_last_used ON responses (last_used)")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS shared_offsets (
+                                  file_name TEXT PRIMARY KEY,
+                                  offset INTEGER NOT NULL
+                              )""")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if shared_dir:
+            os.makedirs(shared_dir, exist_ok=True)
+            self._shared_file = os.path.join(shared_dir, f"llm_cache-{socket.gethostname()}.jsonl")
+            self.import_shared()
+
+    def get(self, model_name: str, prompt: str):
+        """Returns the cached response, or None."""
+        key = cache_key(model_name, prompt)
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.metrics['misses'] += 1
+                return None
+            self.metrics['hits'] += 1
+            with self._conn:
+                self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (_now(), key))
+        return row[0]
+
+    def put(self, model_name: str, prompt: str, response: str):
+        """Stores a response (and shares it, if a shared folder is configured)."""
+        key = cache_key(model_name, prompt)
+        with self._lock:
+            if self._insert(key, model_name, response) and self.shared_dir:
+                with open(self._shared_file, 'a') as f:
+                    f.write(json.dumps({'key': key, 'model_name': model_name, 'response': response}) + '\n')
+            if self._size > self.max_entries:
+                self._evict()
+
+    def import_shared(self):
+        """Imports the entries other machines appended to the shared folder since the last import."""
+        own_file = os.path.basename(self._shared_file)
+        with self._lock:
+            offsets = dict(self._conn.execute("SELECT file_name, offset FROM shared_offsets"))
+            for file_name in sorted(os.listdir(self.shared_dir)):
+                if file_name == own_file or not (file_name.startswith('llm_cache-') and file_name.endswith('.jsonl')):
+                    continue
+                with open(os.path.join(self.shared_dir, file_name)) as f:
+                    f.seek(offsets.get(file_name, 0))
+                    for line in iter(f.readline, ''):
+                        if not line.endswith('\n'): # partially synced last line: pick it up next time
+                            break
+                        entry = json.loads(line)
+                        self.metrics['imported'] += self._insert(entry['key'], entry['model_name'], entry['response'])
+                        offsets[file_name] = f.tell()
+                with self._conn:
+                    self._conn.execute("INSERT OR REPLACE INTO shared_offsets (file_name, offset) VALUES (?, ?)",
+                                       (file_name, offsets.get(file_name, 0)))
+            if self._size > self.max_entries:
+                self._evict()
+
+    def __len__(self):
+        return self._size
+
+    def close(self):
+        self._conn.close()
+
+    def _insert(self, key, model_name, response):
+        """Inserts an entry unless the key is cached already. Returns whether it was new."""
+        with self._conn:
+            inserted = self._conn.execute("""INSERT OR IGNORE INTO responses (key, model_name, response, last_used)
+                                             VALUES (?, ?, ?, ?)""", (key, model_name, response, _now())).rowcount
+        self._size += inserted
+        return bool(inserted)
+
+    def _evict(self):
+        # Evict down to 90% of the bound so eviction runs once per many inserts, not on every insert
+        n_evict = self._size - int(self.max_entries * 0.9)
+        with self._conn:
+            self._conn.execute("""DELETE FROM responses WHERE key IN (
+                                      SELECT key FROM responses ORDER BY last_used LIMIT ?)""", (n_evict,))
+        self._size -= n_evict
+        self.metrics['evictions'] += n_evict
+
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec='microseconds')
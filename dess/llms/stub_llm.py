@@ -0,0 +1,67 @@
+from dess.llms.llm_base import LLMBase
+import re
+import json
+import time
+import hashlib
+import threading
+
+DEPARTMENT_PATTERN = re.compile(r"\b(?:Department|School|Faculty) of ([A-Z][A-Za-z&,\- ]*?)(?:[.,;:\n]|$)")
+
+class StubLLM(LLMBase):
+    """
+    Deterministic local stand-in for an LLM backend, for offline throughput and ordering tests.
+    It answers department prompts with the first "Department of X" found in the text (or "MISSING"),
+    after an optional delay. failure_rate makes a fixed, prompt-dependent share of first attempts fail.
+    Packed prompts (see prompt_packing) get a JSON array; drop_rate leaves a fixed, record-dependent
+    share of records out of it.
+    """
+    def __init__(self, model_name: str = "stub", latency: float = 0.0, failure_rate: float = 0.0,
+                 drop_rate: float = 0.0):
+        self.model_name = model_name
+        self.llm = self
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.drop_rate = drop_rate
+        self.calls = 0
+        self._attempted = set()
+        self._lock = threading.Lock()
+
+    def generate(self, prompt: str, timeout: float = None) -> str:
+        """Get response for a single prompt."""
+        digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        with self._lock:
+            self.calls += 1
+            first_attempt = digest not in self._attempted
+            self._attempted.add(digest)
+        if timeout and self.latency > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"Stub LLM: no answer within {timeout}s")
+        if self.latency:
+            time.sleep(self.latency)
+        if first_attempt and _fraction(digest) < self.failure_rate:
+            raise ConnectionError("Stub LLM: injected transient failure")
+        if "\nRecords:\n" in prompt:
+            return self.answer_packed(prompt)
+        return self.answer(prompt)
+
+    def answer(self, prompt: str) -> str:
+        """The deterministic answer to a department prompt."""
+        text = prompt.split("Text:", 1)[-1].rsplit("Department:", 1)[0]
+        return _find_department(text)
+
+    def answer_packed(self, prompt: str) -> str:
+        """The deterministic JSON answer to a packed prompt."""
+        records = [json.loads(line) for line in prompt.split("\nRecords:\n", 1)[1].splitlines() if line.strip()]
+        answers = [{'id': record['id'], 'department': _find_department(record['text'])} for record in records
+                   if _fraction(hashlib.sha256(record['text'].encode('utf-8')).hexdigest()) >= self.drop_rate]
+        return f"```json\n{json.dumps(answers)}\n```"
+
+
+def _find_department(text):
+    match = DEPARTMENT_PATTERN.search(text)
+    return match.group(1).strip() if match else "MISSING"
+
+
+def _fraction(digest):
+    """Maps a hex digest to a number in [0, 1]."""
+    return int(digest[:8], 16) / 0xFFFFFFFF
@@ -1,13 +1,12 @@
 import re
+import json
+import hashlib
 import pandas as pd
 import pickle
-import os
-from dotenv import load_dotenv
+import config
 # ------------------------------------------------------------------------------
 # Config
 
-load_dotenv()
-
 # criteria associated with dummy variables
 CRITERIA_FLAGS = {
     'isProfessor': ["professor", "faculty"],
@@ -62,40 +61,65 @@ IGNORE_TERMS = ['the', 'department','assistant','associate','full','special','un
                 'dept', 'in', 'research', 'professor', 'specialty']
 
 # Path to the file containing the whitelist of keywords for department extraction
-KEYWORD_WHITELIST_FILE_PATH = f"{os.getenv('STORAGE_DIR')}/department-whitelist.pkl"
+# (None: department-whitelist.pkl in STORAGE_DIR, resolved when used)
+KEYWORD_WHITELIST_FILE_PATH = None
 # ------------------------------------------------------------------------------
 
-def extract_department_information(df: pd.DataFrame):
-    """Populates the isFaculty and department columns in the DataFrame."""
-    df[['isProfessor', 'isInstructor', 'isEmeritus', 'isAssistantProf', 'isAssociateProf', 
-        'isFullProf', 'isClinicalProf', 'isResearcher', 'isRetired', 'teaching_intensity', 'department_textual',
+def whitelist_path() -> str:
+    """The keyword whitelist in use: KEYWORD_WHITELIST_FILE_PATH, or the one in STORAGE_DIR."""
+    return KEYWORD_WHITELIST_FILE_PATH or config.storage_path('department-whitelist.pkl')
+
+def ruleset_version() -> str:
+    """Short hash of the extraction rules above. It changes whenever a flag criterion, pattern or
+    ignore term changes (including edits made at runtime, e.g. from the notebook)."""
+    rules = json.dumps([CRITERIA_FLAGS, DEPARTMENT_PATTERNS, IGNORE_TERMS], sort_keys=True)
+    return hashlib.sha256(rules.encode('utf-8')).hexdigest()[:16]
+
+def current_ruleset() -> dict:
+    """
+    A copy of the rules in effect: 'criteria_flags', 'department_patterns', 'ignore_terms' and
+    'keywords' (the whitelist, {precision level: [keyword, ...]}). Edit the copy to describe a
+    candidate ruleset for the functions below or for dess.whatif.
+    """
+    return {'criteria_flags': {flag: list(criteria) for flag, criteria in CRITERIA_FLAGS.items()},
+            'department_patterns': {kind: list(patterns) for kind, patterns in DEPARTMENT_PATTERNS.items()},
+            'ignore_terms': list(IGNORE_TERMS),
+            'keywords': _load_department_names(whitelist_path())}
+
+def extract_department_information(df: pd.DataFrame, ruleset: dict = None):
+    """Populates the isFaculty and department columns in the DataFrame, with the current rules or
+    the given ruleset (see current_ruleset)."""
+    ruleset = ruleset or current_ruleset()
+    df[[*ruleset['criteria_flags'], 'teaching_intensity', 'department_textual',
         'isPrimaryPattern', 'department_keyword', 'keyword_precision']] =  df.apply(
-        lambda row: populate_faculty_columns(row['rawText']),
+        lambda row: populate_faculty_columns(row['rawText'], ruleset),
         axis=1,
         result_type='expand'
     )
 
-def populate_faculty_columns(rawText: list[str]):
-    flags = populate_dummy_variables(rawText)
-    department_textual, isPrimaryPattern, department_keyword, keyword_precision  = populate_department_variables(rawText)
+def populate_faculty_columns(rawText: list[str], ruleset: dict = None):
+    ruleset = ruleset or current_ruleset()
+    flags = populate_dummy_variables(rawText, ruleset['criteria_flags'])
+    department_textual, isPrimaryPattern, department_keyword, keyword_precision  = populate_department_variables(rawText, ruleset)
     return  (*flags, department_textual, isPrimaryPattern, department_keyword, keyword_precision)
 
-def populate_dummy_variables(rawText: list[str]) -> str:
+def populate_dummy_variables(rawText: list[str], criteria_flags: dict = None) -> str:
+    criteria_flags = criteria_flags or CRITERIA_FLAGS
     if rawText is None:
-        return tuple([False] * len(CRITERIA_FLAGS)) + (0,)
+        return tuple([False] * len(criteria_flags)) + (0,)
 
-    flags = {key: False for key in CRITERIA_FLAGS.keys()}
+    flags = {key: False for key in criteria_flags.keys()}
     teaching_intensity = 0
 
     for text in rawText:
         teaching_intensity += _count_teaching_intensity(text)
-        for flag, criteria in CRITERIA_FLAGS.items():
+        for flag, criteria in criteria_flags.items():
             if flags[flag] == False and _lookup_criteria(text, criteria):
                 flags[flag] = True
 
     return  tuple(flags.values()) + (teaching_intensity,)
 
-def populate_department_variables(rawText):
+def populate_department_variables(rawText, ruleset: dict = None):
     """
     Uses regex to extract department and populates all 
     department-related variables.
@@ -105,31 +129,35 @@ def populate_department_variables(rawText):
     if rawText is None:
         return department_textual, isPrimaryPattern, department_keyword, keyword_precision
     
-    department_textual, isPrimaryPattern = _extract_department_regex(rawText)
-    department_keyword, keyword_precision = _extract_department_fuzzy_match(rawText)
+    ruleset = ruleset or current_ruleset()
+    department_textual, isPrimaryPattern = _extract_department_regex(rawText, ruleset['department_patterns'],
+                                                                     ruleset['ignore_terms'])
+    department_keyword, keyword_precision = _extract_department_fuzzy_match(rawText, ruleset['keywords'])
 
     return department_textual, isPrimaryPattern, department_keyword, keyword_precision
 
-def _extract_department_regex(rawText):
+def _extract_department_regex(rawText, department_patterns: dict = None, ignore_terms: list = None):
+    department_patterns = department_patterns or DEPARTMENT_PATTERNS
+    ignore_terms = IGNORE_TERMS if ignore_terms is None else ignore_terms
     # Try primary patterns first
     for text in rawText:
-        for pattern in DEPARTMENT_PATTERNS['primary']:
+        for pattern in department_patterns['primary']:
             if match := re.search(pattern, text, re.IGNORECASE):
                 department_textual = match.group(1).strip().lower()
                 
                 # Skip terms in the ignore list (to avoid false positives)
-                if department_textual in IGNORE_TERMS:
+                if department_textual in ignore_terms:
                     continue
                 return department_textual, 1
 
     # Fall back to secondary patterns            
     for text in rawText:
-        for pattern in DEPARTMENT_PATTERNS['backup']:
+        for pattern in department_patterns['backup']:
             if match := re.search(pattern, text, re.IGNORECASE):
                 department_textual = match.group(1).strip().lower()
                 
                 # Skip terms in the ignore list (to avoid false positives)
-                if department_textual in IGNORE_TERMS:
+                if department_textual in ignore_terms:
                     continue
                 return department_textual, 0
             
@@ -147,7 +175,7 @@ def create_keyword_dict_file(excel_file_path):
         if prec in keyword_dict:
             keyword_dict[prec].append(keyword)
 
-    with open(KEYWORD_WHITELIST_FILE_PATH, 'wb') as f:
+    with open(whitelist_path(), 'wb') as f:
         pickle.dump(keyword_dict, f)
 
 def _load_department_names(file_path):
@@ -155,8 +183,8 @@ def _load_department_names(file_path):
         department_names = pickle.load(f)
     return department_names
 
-def _extract_department_fuzzy_match(rawText):
-    DEPARTMENT_WHITELIST = _load_department_names(KEYWORD_WHITELIST_FILE_PATH)
+def _extract_department_fuzzy_match(rawText, keywords: dict = None):
+    DEPARTMENT_WHITELIST = keywords or _load_department_names(whitelist_path())
 
     for i in range(1, 4):
         for text in rawText:
@@ -7,20 +7,31 @@ Dependencies:
 is installed and accessible in your PATH.
 """
 
-import pandas as pd
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.firefox.options import Options as FireFoxOptions
+from __future__ import annotations
 import time
 import os
+import sys
 import argparse
+from typing import TYPE_CHECKING
+
+# Selenium, pandas and data_pipeline_manager are imported where they are used, so the script starts
+# (and parses its arguments) without loading them
+if TYPE_CHECKING:
+    import pandas as pd
+    from selenium import webdriver
+
+if __package__ in (None, ''): # run as `python3 dess/search.py`: make top-level modules importable
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 LOCAL_PARQUET_PATH = '../storage/scrapertesting.parquet'
 CHUNK_SIZE = 200
+GOOGLE_SEARCH_URL = None # None: GOOGLE_SEARCH_URL from the environment, or Google's; set to replay against mock_search_server.py
 counter = 0 
 
+def google_search_url() -> str:
+    import config
+    return GOOGLE_SEARCH_URL or config.get('GOOGLE_SEARCH_URL', 'https://www.google.com/search')
+
 def setup_driver(driver_type: str) -> webdriver:
     """Sets up the web driver based on the specified type."""
     if driver_type == 'chrome':
@@ -37,6 +48,9 @@ def _create_chrome_driver():
     Returns:
         webdriver.Chrome: An instance of the Chrome web driver configured with headless options.
     """
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+    from selenium.webdriver.chrome.options import Options
     options = Options()
     options.add_argument("--headless")
     #options.add_experimental_option("detach", True)
@@ -52,6 +66,8 @@ def _create_firefox_driver():
         webdriver.Firefox: An instance of the Chrome web driver configured with headless options.
     """
     # Set up Selenium options
+    from selenium import webdriver
+    from selenium.webdriver.firefox.options import Options as FireFoxOptions
     options = FireFoxOptions()
     options.set_preference("dom.popup_maximum", 0)
     options.set_preference("privacy.popups.disable_from_plugins", 3)
@@ -77,12 +93,13 @@ def get_snapshots_from_google(driver: webdriver, search_query:str, snapshots:int
     # if global counter==0:
     #     time.sleep(15)
     #     counter+=1
+    from selenium.webdriver.common.by import By
     global counter
     if counter == 0 or counter==1:
         time.sleep(15)
         counter+=1
     
-    google_url = f"https://www.google.com/search?q={search_query.replace(' ', '+')}"
+    google_url = f"{google_search_url()}?q={search_query.replace(' ', '+')}"
     driver.get(google_url)
 
     if count == 1: time.sleep(12)
@@ -168,10 +185,14 @@ def search(df: pd.DataFrame, driver_type: str, snapshots: int):
     df['rawText'] = populate_raw_text(df, driver, snapshots)
     driver.quit()
 
-def main(start_index: int):
-    if os.path.exists(LOCAL_PARQUET_PATH):
+def main(start_index: int, dataset_path: str = LOCAL_PARQUET_PATH):
+    """Scrapes the rows of dataset_path from start_index on, chunk by chunk, then marks it as scraped
+    (data_pipeline_manager.mark_scraped) so the pipeline's merge stage can file it."""
+    import data_pipeline_manager as dpm
+    import parquet_schema
+    if os.path.exists(dataset_path):
         print("Loading DataFrame from local ...")
-        df = pd.read_parquet(LOCAL_PARQUET_PATH)
+        df = dpm.read_dataset(dataset_path)
     else:
         print("FILE NOT FOUND")
         return
@@ -180,17 +201,23 @@ def main(start_index: int):
     print(f"PROCESSING: Started from index {start_index}")
     start = time.time()
     for i in range(start_index, len(df), CHUNK_SIZE):
-        chunk = df.iloc[i:i + CHUNK_SIZE].copy()
-        search(chunk, 'firefox', 4)
-        df.iloc[i:i + CHUNK_SIZE, df.columns.get_loc('rawText')] = chunk['rawText']
-        df.to_parquet(LOCAL_PARQUET_PATH, index=False)
+        chunk = df.iloc[i:i + CHUNK_SIZE]
+        # Rows resolved to an existing record at intake already have their rawText
+        chunk = chunk[~parquet_schema.has_raw_text(chunk['rawText'])].copy()
+        if len(chunk):
+            search(chunk, 'firefox', 4)
+            # Only the scraped rows are written; read_dataset overlays them on the earlier parts
+            dpm.append_to_dataset(dataset_path, chunk)
         current_time = time.time()
         time_taken = current_time - start
         start = current_time
         print(f"[{time_taken:.2f}] Processed and updated chunk {i // CHUNK_SIZE} of {(df.shape[0]) // CHUNK_SIZE}")
+    dpm.mark_scraped(dataset_path)
+    print(f"SCRAPED: {dataset_path}")
 
 
 def test_main():
+    import pandas as pd
     test_df = pd.DataFrame({
     'rawText': ['', ''],
     'id_text': ['Arnold Rosenbloom University of Toronto', 'Andrew Peterson University of Toronto']
@@ -205,5 +232,6 @@ def test_snapshots():
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Pass a start index to the script.")
     parser.add_argument("start_index", type=int, help="The index to start processing from")
+    parser.add_argument("--dataset", default=LOCAL_PARQUET_PATH, help="Dataset to scrape (e.g. STORAGE_DIR/uncomplete.parquet)")
     args = parser.parse_args()
-    main(args.start_index)
+    main(args.start_index, args.dataset)
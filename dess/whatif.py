@@ -0,0 +1,191 @@
+"""
+What-if evaluation of candidate extraction rulesets.
+
+Trying a change to DEPARTMENT_PATTERNS, IGNORE_TERMS, CRITERIA_FLAGS or the keyword whitelist no
+longer needs a full extract_department_information run per idea. RulesetEvaluator computes per-snippet
+match facts once and keeps them:
+- for each department pattern, the (lower-cased) first capture of its first match in each snippet,
+- for each keyword and each flag criterion, whether each (lower-cased) snippet contains it.
+Facts are computed over the distinct snippets of the dataset and only for rules not seen before, so
+evaluating a candidate that changes one pattern or a few ignore terms only re-runs that pattern (or
+nothing). The results are then resolved per row with the same precedence as dess/nlp.py (snippet order,
+then pattern/keyword order; primary before backup; precision level 1 before 2 before 3).
+
+    evaluator = RulesetEvaluator(df_c)
+    candidate = nlp.current_ruleset()
+    candidate['ignore_terms'].append('research')
+    report = evaluator.diff(candidate)   # only the rows whose results change, and counts per rule
+"""
+
+import re
+import numpy as np
+import pandas as pd
+import dess.nlp as nlp
+
+MISSING = "MISSING"
+DEPARTMENT_COLUMNS = ['department_textual', 'isPrimaryPattern', 'department_keyword', 'keyword_precision']
+
+
+class RulesetEvaluator:
+    """
+    Evaluates rulesets (see nlp.current_ruleset) over the rawText of df, reusing match facts.
+
+    Args:
+        df (pd.DataFrame): Rows with a rawText column (list of snippets, or None).
+        key (str): Column identifying rows in reports; the index is used if df has no such column.
+    """
+    def __init__(self, df: pd.DataFrame, key: str = 'id_text'):
+        raw_text = df['rawText'].reset_index(drop=True)
+        self.index = df.index
+        self.keys = df[key].to_numpy() if key in df else df.index.to_numpy()
+        self.n_rows = len(df)
+        self.has_text = raw_text.map(lambda snippets: snippets is not None).to_numpy()
+
+        # One entry per (row, snippet) in row and snippet order; snippets are stored once
+        occurrences = raw_text[self.has_text].explode()
+        occurrences = occurrences[occurrences.notna()]
+        self._rows = occurrences.index.to_numpy()
+        codes, snippets = pd.factorize(occurrences.astype(str), sort=False)
+        self._snippet = codes
+        self._texts = pd.Series(snippets)
+        self._lower = self._texts.str.lower()
+
+        self._pattern_facts = {}
+        self._contains_facts = {}
+
+    def evaluate(self, ruleset: dict = None) -> pd.DataFrame:
+        """
+        The flag and department columns extract_department_information would produce with ruleset
+        (the current rules if None), plus department_textual_rule / department_keyword_rule naming the
+        pattern or keyword that decided each value.
+        """
+        ruleset = ruleset or nlp.current_ruleset()
+        result = {flag: self._any_per_row(criteria) for flag, criteria in ruleset['criteria_flags'].items()}
+
+        textual, is_primary, textual_rule = self._regex_columns(ruleset['department_patterns'], ruleset['ignore_terms'])
+        keyword, precision, keyword_rule = self._keyword_columns(ruleset['keywords'])
+        result.update({'department_textual': textual, 'isPrimaryPattern': is_primary,
+                       'department_keyword': keyword, 'keyword_precision': precision,
+                       'department_textual_rule': textual_rule, 'department_keyword_rule': keyword_rule})
+        return pd.DataFrame(result, index=self.index)
+
+    def diff(self, candidate: dict, current: dict = None) -> dict:
+        """
+        Compares candidate with current (the rules in effect if None).
+
+        Returns:
+            dict: 'rows', one row per changed row with the key, the changed columns and their
+            before/after values; 'rules', the number of changed rows per deciding rule before
+            ('lost') and after ('gained'); 'counts', changed rows per column.
+        """
+        before, after = self.evaluate(current), self.evaluate(candidate)
+        flags = [col for col in dict.fromkeys([*before.columns, *after.columns])
+                 if col not in DEPARTMENT_COLUMNS and not col.endswith('_rule')]
+        columns = flags + DEPARTMENT_COLUMNS
+        before = before.reindex(columns=columns + ['department_textual_rule', 'department_keyword_rule'])
+        after = after.reindex(columns=before.columns)
+        before[flags] = before[flags].fillna(False)
+        after[flags] = after[flags].fillna(False)
+
+        changed = pd.DataFrame({col: (before[col] != after[col]).to_numpy() for col in columns}, index=self.index)
+        is_changed = changed.any(axis=1).to_numpy()
+
+        rows = pd.DataFrame({'key': self.keys[is_changed],
+                             'changed': changed[is_changed].apply(lambda r: [col for col in columns if r[col]], axis=1)},
+                            index=self.index[is_changed])
+        for col in columns:
+            if changed[col].any():
+                rows[col] = before.loc[is_changed, col]
+                rows[f"{col}_new"] = after.loc[is_changed, col]
+
+        rules = pd.concat([self._rule_counts(before, changed, flags, 'lost'),
+                           self._rule_counts(after, changed, flags, 'gained')], axis=1).fillna(0).astype(int)
+        counts = changed.sum()
+        counts = counts[counts > 0]
+        print(f"{is_changed.sum()} of {self.n_rows} rows change: {counts.to_dict()}")
+        return {'rows': rows, 'rules': rules.sort_values(['lost', 'gained'], ascending=False), 'counts': counts}
+
+    def _rule_counts(self, results, changed, flags, name):
+        """Changed rows per rule that decided the changed value in results."""
+        labels = [results.loc[changed['department_textual'] | changed['isPrimaryPattern'], 'department_textual_rule'],
+                  results.loc[changed['department_keyword'] | changed['keyword_precision'], 'department_keyword_rule']]
+        labels += [pd.Series(f"flag {flag}", index=changed.index[changed[flag]]) for flag in flags]
+        labels = pd.concat(labels)
+        return labels[labels.notna()].value_counts().rename(name)
+
+    def _regex_columns(self, department_patterns, ignore_terms):
+        textual = np.full(self.n_rows, MISSING, dtype=object)
+        is_primary = np.full(self.n_rows, -1)
+        rule = np.full(self.n_rows, None, dtype=object)
+
+        resolved = np.zeros(self.n_rows, dtype=bool)
+        for kind, primary in (('primary', 1), ('backup', 0)):
+            patterns = department_patterns[kind]
+            value, pattern_index = self._first_per_snippet(
+                [self._pattern_fact(pattern) for pattern in patterns],
+                lambda fact: pd.notna(fact) & ~pd.Series(fact).isin(ignore_terms).to_numpy())
+            rows, values, indexes = self._first_per_row(value, pattern_index)
+            new = ~resolved[rows]
+            rows, values, indexes = rows[new], values[new], indexes[new]
+            textual[rows], is_primary[rows] = values, primary
+            rule[rows] = [f"{kind} {i}: {patterns[i]}" for i in indexes]
+            resolved[rows] = True
+        return textual, is_primary, rule
+
+    def _keyword_columns(self, keywords):
+        department = np.full(self.n_rows, MISSING, dtype=object)
+        precision = np.where(self.has_text, -1, 0)
+        rule = np.full(self.n_rows, None, dtype=object)
+
+        resolved = np.zeros(self.n_rows, dtype=bool)
+        for level in range(1, 4):
+            level_keywords = keywords.get(level, [])
+            found, keyword_index = self._first_per_snippet(
+                [np.where(self._contains_fact(keyword), keyword, None) for keyword in level_keywords], pd.notna)
+            rows, values, indexes = self._first_per_row(found, keyword_index)
+            new = ~resolved[rows]
+            rows, values, indexes = rows[new], values[new], indexes[new]
+            department[rows], precision[rows] = values, level
+            rule[rows] = [f"keyword {level}: {level_keywords[i]}" for i in indexes]
+            resolved[rows] = True
+        return department, precision, rule
+
+    def _any_per_row(self, criteria):
+        """Per row: does any snippet contain any of criteria (lower-cased)?"""
+        contains = np.zeros(len(self._texts), dtype=bool)
+        for criterion in criteria:
+            contains |= self._contains_fact(criterion)
+        flags = np.zeros(self.n_rows, dtype=bool)
+        flags[self._rows[contains[self._snippet]]] = True
+        return flags
+
+    def _first_per_snippet(self, facts, is_valid):
+        """Per distinct snippet, the value and position of the first fact (in rule order) that is valid."""
+        value = np.full(len(self._texts), None, dtype=object)
+        index = np.full(len(self._texts), -1)
+        for i in reversed(range(len(facts))):
+            valid = is_valid(facts[i])
+            value[valid] = facts[i][valid]
+            index[valid] = i
+        return value, index
+
+    def _first_per_row(self, value, index):
+        """Rows whose snippets have a value, with the value and rule position of their first such snippet."""
+        occurrence_index = index[self._snippet]
+        found = np.flatnonzero(occurrence_index >= 0)
+        rows, first = np.unique(self._rows[found], return_index=True)
+        occurrences = found[first]
+        return rows, value[self._snippet[occurrences]], occurrence_index[occurrences]
+
+    def _pattern_fact(self, pattern):
+        """First capture of pattern's first match in each snippet (stripped, lower-cased), or None."""
+        if pattern not in self._pattern_facts:
+            match = self._texts.str.extract(pattern, flags=re.IGNORECASE, expand=True)[0]
+            self._pattern_facts[pattern] = match.str.strip().str.lower().to_numpy(dtype=object)
+        return self._pattern_facts[pattern]
+
+    def _contains_fact(self, term):
+        """Whether each lower-cased snippet contains term."""
+        if term not in self._contains_facts:
+            self._contains_facts[term] = self._lower.str.contains(term, regex=False).to_numpy(dtype=bool)
+        return self._contains_facts[term]
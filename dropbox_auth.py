@@ -1,15 +1,12 @@
-import os
 from dropbox import DropboxOAuth2FlowNoRedirect
 import json
-from dotenv import load_dotenv
-
-load_dotenv()
+import config
 
 def generate_refresh_token():
     """One-time script to get refresh token and save credentials"""
     auth_flow = DropboxOAuth2FlowNoRedirect(
-        os.getenv("DROPBOX_APP_KEY"),
-        os.getenv("DROPBOX_APP_SECRET"),
+        config.get("DROPBOX_APP_KEY"),
+        config.get("DROPBOX_APP_SECRET"),
         token_access_type='offline'
     )
 
@@ -26,8 +23,8 @@ def generate_refresh_token():
         credentials = {
             "refresh_token": oauth_result.refresh_token,
             "access_token": oauth_result.access_token,
-            "app_key": os.getenv("DROPBOX_APP_KEY"),
-            "app_secret": os.getenv("DROPBOX_APP_SECRET")
+            "app_key": config.get("DROPBOX_APP_KEY"),
+            "app_secret": config.get("DROPBOX_APP_SECRET")
         }
         
         # Save to a secure location
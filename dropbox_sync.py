@@ -0,0 +1,207 @@
+"""
+Incremental Dropbox sync: files are compared by Dropbox content hash and only new or changed
+files are transferred, on a bounded worker pool, without interactive prompts.
+
+Conflict policies (a file exists on both sides with different content):
+- 'skip'      — leave the destination alone and report the conflict
+- 'overwrite' — replace the destination
+- 'newer'     — replace the destination only if the source was modified more recently
+
+Uploads can mirror folders (the part files of a partitioned dataset): remote files in them that no
+longer exist locally, e.g. the parts a compaction merged, are deleted after the new ones are uploaded.
+"""
+
+import os
+import hashlib
+import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import dropbox
+from dropbox.files import WriteMode
+
+import dropbox_upload
+
+DROPBOX_HASH_BLOCK_SIZE = 4 * 1024 * 1024
+DIRECT_UPLOAD_LIMIT = 4 * 1024 * 1024 # larger files go through an upload session
+SYNC_POLICIES = ('skip', 'overwrite', 'newer')
+
+
+def dropbox_content_hash(file_path: str) -> str:
+    """Computes the Dropbox content hash of a local file (SHA-256 over per-4MB-block SHA-256 digests)."""
+    block_hashes = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while block := f.read(DROPBOX_HASH_BLOCK_SIZE):
+            block_hashes.update(hashlib.sha256(block).digest())
+    return block_hashes.hexdigest()
+
+
+def list_remote_files(dbx, remote_folder: str, recursive: bool = True):
+    """Lists files under remote_folder, following the listing cursor. Returns {path_lower: FileMetadata}."""
+    try:
+        result = dbx.files_list_folder(remote_folder, recursive=recursive)
+    except dropbox.exceptions.ApiError as e:
+        if _is_not_found(e):
+            return {}
+        raise
+
+    entries = list(result.entries)
+    while result.has_more:
+        result = dbx.files_list_folder_continue(result.cursor)
+        entries.extend(result.entries)
+    return {entry.path_lower: entry for entry in entries if isinstance(entry, dropbox.files.FileMetadata)}
+
+
+def upload_changed_files(dbx, files, remote_folder: str, policy: str = 'skip', max_workers: int = 4,
+                         mirror_folders=()):
+    """
+    Uploads local files whose content differs from (or is missing in) remote_folder.
+
+    Args:
+        dbx: Dropbox client (or a fake with the same interface).
+        files (list[tuple[str, str]]): (local_path, path relative to remote_folder) pairs.
+        remote_folder (str): Dropbox folder, e.g. '/DESS'.
+        policy (str): Conflict policy, see module docstring.
+        max_workers (int): Maximum concurrent hash/transfer workers.
+        mirror_folders (list[str]): Folders (relative to remote_folder) whose remote files that are not
+            in files are deleted. A folder is left alone if any upload into it failed or was a conflict, as
+            the remote copy would then mix old and new files.
+
+    Returns:
+        dict: Lists of relative paths under 'transferred', 'unchanged', 'conflicts', 'failed' and 'deleted'.
+    """
+    _check_policy(policy)
+    remote_folder = '/' + remote_folder.strip('/')
+    remote_files = list_remote_files(dbx, remote_folder)
+
+    def sync_one(local_path, relative_path):
+        remote_path = f"{remote_folder}/{relative_path}"
+        remote = remote_files.get(remote_path.lower())
+        if remote is not None:
+            if remote.content_hash == dropbox_content_hash(local_path):
+                return 'unchanged'
+            if not _should_replace(policy, _local_mtime(local_path), remote.client_modified):
+                return 'conflicts'
+        _upload(dbx, local_path, remote_path, overwrite=remote is not None)
+        return 'transferred'
+
+    report = _run(sync_one, files, max_workers)
+    report['deleted'] = []
+    if mirror_folders:
+        _delete_removed_files(dbx, remote_files, remote_folder, files, mirror_folders, report)
+    return report
+
+
+def download_changed_files(dbx, remote_folder: str, local_dir: str, policy: str = 'overwrite', max_workers: int = 4,
+                           suffixes: tuple = None, recursive: bool = False):
+    """
+    Downloads files from remote_folder whose content differs from (or is missing in) local_dir.
+
+    Args:
+        suffixes (tuple): Only files ending with one of these suffixes are synced; all files if None.
+        recursive (bool): Also sync files in remote sub-folders (mirrored under local_dir).
+
+    Returns:
+        dict: Lists of relative paths under 'transferred', 'unchanged', 'conflicts' and 'failed'.
+    """
+    _check_policy(policy)
+    remote_folder = '/' + remote_folder.strip('/')
+    remote_files = list_remote_files(dbx, remote_folder, recursive=recursive)
+    prefix = remote_folder.lower() + '/'
+
+    files = []
+    for path_lower, remote in sorted(remote_files.items()):
+        if suffixes and not remote.name.lower().endswith(suffixes):
+            continue
+        relative_path = remote.path_display[len(prefix):] if remote.path_display else path_lower[len(prefix):]
+        files.append((remote, relative_path))
+
+    def sync_one(remote, relative_path):
+        local_path = os.path.join(local_dir, relative_path)
+        if os.path.exists(local_path):
+            if dropbox_content_hash(local_path) == remote.content_hash:
+                return 'unchanged'
+            if not _should_replace(policy, remote.client_modified, _local_mtime(local_path)):
+                return 'conflicts'
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        # Download next to the destination and rename, so an interrupted transfer never leaves a partial file
+        tmp_path = f"{local_path}.download"
+        dbx.files_download_to_file(tmp_path, remote.path_lower)
+        os.replace(tmp_path, local_path)
+        return 'transferred'
+
+    return _run(sync_one, files, max_workers)
+
+
+def _run(sync_one, items, max_workers):
+    """Runs sync_one over items on a bounded pool and groups the relative paths by outcome."""
+    report = {'transferred': [], 'unchanged': [], 'conflicts': [], 'failed': []}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(sync_one, *item): item[1] for item in items}
+        for future in as_completed(futures):
+            relative_path = futures[future]
+            try:
+                outcome = future.result()
+            except Exception as e:
+                print(f"Error syncing {relative_path}: {e}")
+                outcome = 'failed'
+            report[outcome].append(relative_path)
+    for paths in report.values():
+        paths.sort()
+    print(f"Sync: {len(report['transferred'])} transferred, {len(report['unchanged'])} unchanged, "
+          f"{len(report['conflicts'])} conflicts, {len(report['failed'])} failed")
+    return report
+
+
+def _delete_removed_files(dbx, remote_files, remote_folder, files, mirror_folders, report):
+    """Deletes the remote files of mirror_folders that have no local counterpart in files, recording them in report."""
+    kept = {f"{remote_folder}/{relative_path}".lower() for _, relative_path in files}
+    prefix_length = len(remote_folder) + 1
+    for folder in mirror_folders:
+        folder = folder.strip('/')
+        if any(path.startswith(f"{folder}/") for path in report['failed'] + report['conflicts']):
+            print(f"Not pruning {folder}: some of its files failed to upload or conflict")
+            continue
+        folder_prefix = f"{remote_folder}/{folder}/".lower()
+        for path_lower, remote in sorted(remote_files.items()):
+            if not path_lower.startswith(folder_prefix) or path_lower in kept:
+                continue
+            relative_path = (remote.path_display or path_lower)[prefix_length:]
+            try:
+                dbx.files_delete_v2(remote.path_lower)
+                report['deleted'].append(relative_path)
+            except Exception as e:
+                print(f"Error deleting {relative_path}: {e}")
+                report['failed'].append(relative_path)
+    if report['deleted']:
+        print(f"Sync: {len(report['deleted'])} removed files deleted")
+
+
+def _upload(dbx, local_path, remote_path, overwrite):
+    mode = WriteMode.overwrite if overwrite else WriteMode.add
+    client_modified = _local_mtime(local_path)
+    if os.path.getsize(local_path) <= DIRECT_UPLOAD_LIMIT:
+        with open(local_path, 'rb') as f:
+            dbx.files_upload(f.read(), remote_path, mode=mode, client_modified=client_modified)
+    else:
+        dropbox_upload.upload_large_file(dbx, local_path, remote_path, mode=mode, client_modified=client_modified)
+
+
+def _should_replace(policy, source_modified, destination_modified):
+    if policy == 'overwrite':
+        return True
+    if policy == 'newer':
+        return source_modified is not None and destination_modified is not None and source_modified > destination_modified
+    return False
+
+
+def _local_mtime(local_path):
+    return datetime.datetime.utcfromtimestamp(int(os.path.getmtime(local_path)))
+
+
+def _check_policy(policy):
+    if policy not in SYNC_POLICIES:
+        raise ValueError(f"Invalid sync policy: {policy}. Use one of {SYNC_POLICIES}.")
+
+
+def _is_not_found(error):
+    return error.error.is_path() and error.error.get_path().is_not_found()
@@ -0,0 +1,260 @@
+"""
+Resumable chunked uploads of large files to Dropbox.
+
+The upload session id and the chunks already sent are persisted next to the file (in a hidden
+`.<name>.upload-session.json`), so an interrupted upload resumes where it stopped instead of
+starting over. With max_workers > 1 a concurrent upload session is used and chunks are appended
+in parallel. Only max_workers chunks are held in memory at a time, and the content hash reported
+by Dropbox is checked against the local one when the session is committed.
+"""
+
+import os
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import dropbox
+from dropbox.files import WriteMode, UploadSessionCursor, CommitInfo, UploadSessionType
+from tqdm import tqdm
+
+DROPBOX_HASH_BLOCK_SIZE = 4 * 1024 * 1024
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024 # must be a multiple of DROPBOX_HASH_BLOCK_SIZE
+
+
+def upload_large_file(dbx, file_path: str, dropbox_file_path: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                      max_workers: int = 1, mode=WriteMode.overwrite, client_modified=None, state_path: str = None):
+    """
+    Uploads file_path to dropbox_file_path, resuming a previously interrupted session if one exists.
+
+    Args:
+        dbx: Dropbox client (or a fake with the same interface).
+        chunk_size (int): Bytes per request; a multiple of 4 MB.
+        max_workers (int): Chunks appended concurrently. 1 uses a sequential session.
+        mode (WriteMode): Write mode for the committed file.
+        state_path (str): Where the session state is persisted; defaults to a hidden file next to file_path.
+
+    Returns:
+        FileMetadata: Metadata of the committed file.
+    """
+    if chunk_size <= 0 or chunk_size % DROPBOX_HASH_BLOCK_SIZE:
+        raise ValueError("chunk_size must be a positive multiple of 4 MB.")
+
+    file_size = os.path.getsize(file_path)
+    if file_size <= chunk_size:
+        with open(file_path, "rb") as f:
+            data = f.read()
+        metadata = dbx.files_upload(data, dropbox_file_path, mode=mode, client_modified=client_modified)
+        _verify_content_hash(metadata, _block_digests(data))
+        return metadata
+
+    state_path = state_path or _default_state_path(file_path)
+    state = _UploadState.load(state_path, file_path, dropbox_file_path, chunk_size, concurrent=max_workers > 1)
+    commit = CommitInfo(path=dropbox_file_path, mode=mode, client_modified=client_modified)
+
+    try:
+        if max_workers > 1:
+            metadata = _upload_concurrent(dbx, file_path, file_size, state, commit, max_workers)
+        else:
+            metadata = _upload_sequential(dbx, file_path, file_size, state, commit)
+    except dropbox.exceptions.ApiError as e:
+        if not _is_session_gone(e):
+            raise
+        # The server forgot the session (expired after ~48h or already committed): start over once
+        print(f"Upload session for {file_path} is no longer valid, restarting upload")
+        state.reset()
+        return upload_large_file(dbx, file_path, dropbox_file_path, chunk_size, max_workers, mode,
+                                 client_modified, state_path)
+
+    _verify_content_hash(metadata, state.all_digests())
+    state.remove()
+    return metadata
+
+
+def _upload_sequential(dbx, file_path, file_size, state, commit):
+    with open(file_path, "rb") as f, tqdm(total=file_size, initial=state.offset, unit='B', unit_scale=True,
+                                          desc="Uploading") as pbar:
+        if state.session_id is None:
+            chunk = f.read(state.chunk_size)
+            state.start(dbx.files_upload_session_start(chunk).session_id)
+            state.chunk_done(0, chunk)
+            pbar.update(len(chunk))
+
+        while True:
+            f.seek(state.offset)
+            chunk = f.read(state.chunk_size)
+            cursor = UploadSessionCursor(session_id=state.session_id, offset=state.offset)
+            try:
+                if state.offset + len(chunk) >= file_size:
+                    metadata = dbx.files_upload_session_finish(chunk, cursor, commit)
+                    state.chunk_done(state.offset, chunk)
+                    pbar.update(len(chunk))
+                    return metadata
+                dbx.files_upload_session_append_v2(chunk, cursor)
+            except dropbox.exceptions.ApiError as e:
+                correct_offset = _correct_offset(e)
+                if correct_offset is None:
+                    raise
+                # The server received more (or less) than we recorded, e.g. the reply to an append was lost
+                f.seek(0)
+                state.rewind(correct_offset, f)
+                pbar.reset(total=file_size)
+                pbar.update(state.offset)
+                continue
+            state.chunk_done(state.offset, chunk)
+            pbar.update(len(chunk))
+
+
+def _upload_concurrent(dbx, file_path, file_size, state, commit, max_workers):
+    if state.session_id is None:
+        result = dbx.files_upload_session_start(b'', session_type=UploadSessionType.concurrent)
+        state.start(result.session_id)
+
+    offsets = [offset for offset in range(0, file_size, state.chunk_size) if offset not in state.done]
+    last_offset = (file_size - 1) // state.chunk_size * state.chunk_size
+
+    def append(offset, chunk):
+        cursor = UploadSessionCursor(session_id=state.session_id, offset=offset)
+        dbx.files_upload_session_append_v2(chunk, cursor, close=offset == last_offset)
+        state.chunk_done(offset, chunk)
+        return len(chunk)
+
+    with open(file_path, "rb") as f, ThreadPoolExecutor(max_workers=max_workers) as pool, \
+            tqdm(total=file_size, initial=file_size - _remaining_bytes(offsets, file_size, state.chunk_size),
+                 unit='B', unit_scale=True, desc="Uploading") as pbar:
+        in_flight = set()
+        for offset in offsets:
+            if offset == last_offset:
+                continue
+            # Keep at most max_workers chunks in memory
+            if len(in_flight) >= max_workers:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    pbar.update(future.result())
+            f.seek(offset)
+            in_flight.add(pool.submit(append, offset, f.read(state.chunk_size)))
+        for future in in_flight:
+            pbar.update(future.result())
+
+        # The closing chunk goes last: a closed session accepts no further appends
+        if last_offset in offsets:
+            f.seek(last_offset)
+            pbar.update(append(last_offset, f.read(state.chunk_size)))
+
+    cursor = UploadSessionCursor(session_id=state.session_id, offset=file_size)
+    return dbx.files_upload_session_finish(b'', cursor, commit)
+
+
+class _UploadState:
+    """Upload session progress persisted as JSON so an interrupted upload can resume."""
+    def __init__(self, path, fingerprint):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.chunk_size = fingerprint['chunk_size']
+        self.session_id = None
+        self.digests = {} # chunk offset -> SHA-256 hex digests of its 4 MB blocks
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, file_path, dropbox_file_path, chunk_size, concurrent):
+        stat = os.stat(file_path)
+        fingerprint = {'file_size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'dropbox_path': dropbox_file_path,
+                       'chunk_size': chunk_size, 'concurrent': concurrent}
+        state = cls(path, fingerprint)
+        if os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            # Only resume a session for the same, unmodified file uploaded the same way
+            if saved.get('fingerprint') == fingerprint:
+                state.session_id = saved['session_id']
+                state.digests = {int(offset): digests for offset, digests in saved['digests'].items()}
+                print(f"Resuming upload of {file_path}: {len(state.digests)} chunks already sent")
+        return state
+
+    @property
+    def done(self):
+        return set(self.digests)
+
+    @property
+    def offset(self):
+        """Bytes sent so far in a sequential session (chunks are always contiguous from 0)."""
+        return len(self.digests) * self.chunk_size
+
+    def start(self, session_id):
+        self.session_id = session_id
+        self.digests = {}
+        self._save()
+
+    def chunk_done(self, offset, chunk):
+        with self._lock:
+            self.digests[offset] = [digest.hex() for digest in _block_digests(chunk)]
+            self._save()
+
+    def rewind(self, correct_offset, f):
+        """Re-aligns a sequential session with the server's offset (always a chunk boundary here)."""
+        with self._lock:
+            self.digests = {offset: digests for offset, digests in self.digests.items() if offset < correct_offset}
+            for offset in range(self.offset, correct_offset, self.chunk_size):
+                f.seek(offset)
+                self.digests[offset] = [digest.hex() for digest in _block_digests(f.read(self.chunk_size))]
+            self._save()
+
+    def all_digests(self):
+        return [bytes.fromhex(digest) for offset in sorted(self.digests) for digest in self.digests[offset]]
+
+    def reset(self):
+        self.session_id = None
+        self.digests = {}
+        self.remove()
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'fingerprint': self.fingerprint, 'session_id': self.session_id,
+                       'digests': {str(offset): digests for offset, digests in self.digests.items()}}, f)
+        os.replace(tmp_path, self.path)
+
+
+def _block_digests(data: bytes):
+    return [hashlib.sha256(data[i:i + DROPBOX_HASH_BLOCK_SIZE]).digest()
+            for i in range(0, len(data), DROPBOX_HASH_BLOCK_SIZE)]
+
+
+def _verify_content_hash(metadata, block_digests):
+    local_hash = hashlib.sha256(b''.join(block_digests)).hexdigest()
+    remote_hash = getattr(metadata, 'content_hash', None)
+    if remote_hash and remote_hash != local_hash:
+        raise ValueError(f"Content hash mismatch for {metadata.path_display}: local {local_hash}, remote {remote_hash}")
+
+
+def _remaining_bytes(offsets, file_size, chunk_size):
+    return sum(min(chunk_size, file_size - offset) for offset in offsets)
+
+
+def _default_state_path(file_path):
+    directory, name = os.path.split(os.path.abspath(file_path))
+    return os.path.join(directory, f".{name}.upload-session.json")
+
+
+def _lookup_error(error):
+    """Extracts the UploadSessionLookupError from an append/finish ApiError, if there is one."""
+    lookup = error.error
+    if hasattr(lookup, 'is_lookup_failed') and lookup.is_lookup_failed():
+        lookup = lookup.get_lookup_failed()
+    return lookup if hasattr(lookup, 'is_incorrect_offset') else None
+
+
+def _correct_offset(error):
+    lookup = _lookup_error(error)
+    if lookup is not None and lookup.is_incorrect_offset():
+        return lookup.get_incorrect_offset().correct_offset
+    return None
+
+
+def _is_session_gone(error):
+    lookup = _lookup_error(error)
+    return lookup is not None and (lookup.is_not_found() or lookup.is_closed())
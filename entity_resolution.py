@@ -0,0 +1,250 @@
+"""
+Entity resolution of new master-file rows against the records already in complete.
+
+id_text is "first last university" as typed in the master file, so the same person comes back with
+different spacing, casing, punctuation, middle initials or university spellings (e.g. "louisiana state
+university" and "louisiana state university and agricultural & mechanical college"), and every
+variant used to cost a new search.
+
+- `canonicalize` splits an id_text into a canonical first name, last name and the ordered tokens of
+  the university (accents, punctuation, middle initials, name suffixes and filler words such as "of"
+  or "the" removed; words such as "university" or "college" are kept, in place).
+- The complete records are kept in a SQLite index blocked on the Soundex codes of the first distinctive
+  university token and of the last name, so each new row is only compared with the few records in
+  its block instead of with every record.
+- `link` returns, for each new id_text, the existing record that is the same person, or None when
+  nothing matches or the match is ambiguous. Matching is conservative, since a wrong link files
+  someone else's search results:
+  - first names must be equal or known forms of the same name (NICKNAMES: "bob" and "robert", but
+    not "robert" and "roberta"), and a bare first initial ("j smith") never links;
+  - universities must have the same tokens in the same order, be near-identical spellings or be
+    listed in UNIVERSITY_ALIASES ("university of washington" and "washington university", or
+    "university of michigan" and "michigan state university", are different institutions).
+  Unlinked rows are searched as before.
+
+Like id_index, the index records the fingerprint of the complete dataset it was synced with and is
+re-synced (only the added and removed ids) when the dataset changed elsewhere. It also records the
+CANONICAL_VERSION it was built with and is rebuilt when canonicalization changes.
+"""
+
+import re
+import sqlite3
+import unicodedata
+from difflib import SequenceMatcher
+import config
+
+# Paths derived from the environment, resolved when first used (see __getattr__)
+_ENV_PATHS = {
+    'INDEX_FILE_PATH': lambda: config.storage_path('entity_index.sqlite'),
+}
+NAME_SUFFIXES = {'jr', 'sr', 'ii', 'iii', 'iv', 'phd', 'md', 'dr', 'prof'}
+UNIVERSITY_ABBREVIATIONS = {'univ': 'university', 'u': 'university', 'coll': 'college', 'inst': 'institute'}
+INSTITUTION_WORDS = {'university', 'college', 'institute', 'school'} # kept in place: "X university" is not "university of X"
+FILLER_WORDS = {'campus', 'main', 'the', 'of', 'at', 'and', 'in'}
+# University tokens (see canonicalize) of other names of the same institution -> its tokens
+UNIVERSITY_ALIASES = {
+    ('louisiana', 'state', 'university', 'agricultural', 'mechanical', 'college'): ('louisiana', 'state', 'university'),
+    ('texas', 'a', 'm', 'university'): ('texas', 'agricultural', 'mechanical', 'university'),
+    ('ucla',): ('university', 'california', 'los', 'angeles'),
+    ('uc', 'berkeley'): ('university', 'california', 'berkeley'),
+    ('mit',): ('massachusetts', 'institute', 'technology'),
+}
+# Short forms of first names -> the full name. Two first names match only if equal or mapped to the same name.
+NICKNAMES = {
+    'abe': 'abraham', 'al': 'albert', 'alex': 'alexander', 'andy': 'andrew', 'drew': 'andrew', 'ben': 'benjamin',
+    'bill': 'william', 'will': 'william', 'billy': 'william', 'bob': 'robert', 'rob': 'robert', 'bobby': 'robert',
+    'chris': 'christopher', 'dan': 'daniel', 'danny': 'daniel', 'dave': 'david', 'ed': 'edward', 'eddie': 'edward',
+    'fred': 'frederick', 'greg': 'gregory', 'jim': 'james', 'jimmy': 'james', 'joe': 'joseph', 'jon': 'jonathan',
+    'ken': 'kenneth', 'larry': 'lawrence', 'liz': 'elizabeth', 'beth': 'elizabeth', 'matt': 'matthew',
+    'mike': 'michael', 'nick': 'nicholas', 'pat': 'patrick', 'pete': 'peter', 'rich': 'richard', 'rick': 'richard',
+    'dick': 'richard', 'ron': 'ronald', 'sam': 'samuel', 'steve': 'steven', 'stephen': 'steven', 'sue': 'susan',
+    'ted': 'edward', 'tim': 'timothy', 'tom': 'thomas', 'tony': 'anthony', 'kate': 'katherine', 'kathy': 'katherine',
+    'cathy': 'catherine', 'jen': 'jennifer', 'jenny': 'jennifer', 'meg': 'margaret', 'peggy': 'margaret',
+    'vicky': 'victoria', 'zach': 'zachary',
+}
+CANONICAL_VERSION = 2 # bump when canonicalize changes, so existing indexes are rebuilt
+SIMILARITY_THRESHOLD = 0.9 # SequenceMatcher ratio above which two spellings are the same name/university
+_PROBE_BATCH_SIZE = 50_000
+
+
+def __getattr__(name):
+    if name in _ENV_PATHS:
+        return _ENV_PATHS[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _path(name):
+    return __getattr__(name)
+
+
+def canonicalize(id_text: str):
+    """
+    Canonical (first, last, university tokens) of an id_text, or None if it doesn't have at least a
+    first and a last name. The first token is the first name, single letters after it are middle
+    initials, the next token is the last name and the rest is the university (without filler words,
+    mapped through UNIVERSITY_ALIASES).
+    """
+    tokens = _tokens(id_text)
+    if not tokens:
+        return None
+    first, rest = tokens[0], tokens[1:]
+    while rest and len(rest[0]) == 1:
+        rest = rest[1:]
+    if not rest:
+        return None
+    last, university = rest[0], rest[1:]
+    while university and university[0] in NAME_SUFFIXES:
+        university = university[1:]
+    university = [UNIVERSITY_ABBREVIATIONS.get(token, token) for token in university]
+    university = tuple(token for token in university if token not in FILLER_WORDS)
+    return first, last, UNIVERSITY_ALIASES.get(university, university)
+
+def block_key(entity) -> str:
+    """Blocking key of a canonical entity: Soundex of its first distinctive university token and of its last name."""
+    _, last, university = entity
+    distinctive = [token for token in university if token not in INSTITUTION_WORDS]
+    return f"{soundex(distinctive[0]) if distinctive else ''}:{soundex(last)}"
+
+def soundex(word: str) -> str:
+    """American Soundex code of word (e.g. 'pittsburg' and 'pittsburgh' are both P321)."""
+    codes = {**dict.fromkeys('bfpv', '1'), **dict.fromkeys('cgjkqsxz', '2'), **dict.fromkeys('dt', '3'),
+             'l': '4', **dict.fromkeys('mn', '5'), 'r': '6'}
+    word = re.sub(r'[^a-z]', '', word.lower())
+    if not word:
+        return ''
+    encoded, previous = word[0].upper(), codes.get(word[0], '')
+    for char in word[1:]:
+        code = codes.get(char, '')
+        if code and code != previous:
+            encoded += code
+        if char not in 'hw': # h and w don't separate letters with the same code
+            previous = code
+    return (encoded + '000')[:4]
+
+def is_same_entity(a, b) -> bool:
+    """Whether two canonical entities are the same person: similar last names, the same first name (or
+    forms of it listed in NICKNAMES) and the same university."""
+    return (_similar(a[1], b[1]) and _first_names_match(a[0], b[0]) and _universities_match(a[2], b[2]))
+
+
+def open_index(index_path: str = None) -> sqlite3.Connection:
+    """Opens (creating if needed) the entity index; INDEX_FILE_PATH by default."""
+    conn = sqlite3.connect(index_path or _path('INDEX_FILE_PATH'))
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""CREATE TABLE IF NOT EXISTS entities (
+                        id_text TEXT PRIMARY KEY,
+                        block TEXT NOT NULL,
+                        first TEXT NOT NULL,
+                        last TEXT NOT NULL,
+                        university TEXT NOT NULL
+                    ) WITHOUT ROWID""")
+    conn.execute("CREATE INDEX IF NOT EXISTS entities_by_block ON entities (block)")
+    conn.execute("CREATE TABLE IF NOT EXISTS synced_dataset (fingerprint TEXT NOT NULL)")
+    if conn.execute("PRAGMA user_version").fetchone()[0] != CANONICAL_VERSION:
+        # Built with another canonicalization: empty it, so the next sync re-adds every record
+        conn.execute("DELETE FROM entities")
+        conn.execute("DELETE FROM synced_dataset")
+        conn.execute(f"PRAGMA user_version = {CANONICAL_VERSION}")
+    conn.commit()
+    return conn
+
+
+def get_fingerprint(conn: sqlite3.Connection):
+    """Returns the fingerprint of the complete dataset at the last sync, or None."""
+    row = conn.execute("SELECT fingerprint FROM synced_dataset").fetchone()
+    return row[0] if row else None
+
+
+def sync(conn: sqlite3.Connection, ids, fingerprint: str):
+    """Makes the indexed records exactly ids (adding the new ones, dropping the missing ones), in one transaction."""
+    ids = {str(id_text) for id_text in ids}
+    with conn:
+        indexed = {row[0] for row in conn.execute("SELECT id_text FROM entities")}
+        conn.executemany("DELETE FROM entities WHERE id_text = ?", ((id_text,) for id_text in indexed - ids))
+        _insert(conn, ids - indexed)
+        _set_fingerprint(conn, fingerprint)
+
+
+def link(conn: sqlite3.Connection, ids) -> list:
+    """
+    Returns, for each id in ids, the id_text of the indexed record that is the same person, or None.
+
+    A record matches if is_same_entity holds. If the matches are more than one person, only an exact
+    canonical match is used; if there is none (or several), the id is left unlinked.
+    """
+    ids = [str(id_text) for id_text in ids]
+    entities = [canonicalize(id_text) for id_text in ids]
+    blocks = [block_key(entity) if entity else None for entity in entities]
+    candidates = _records_in_blocks(conn, set(blocks) - {None})
+
+    links = []
+    for id_text, entity, block in zip(ids, entities, blocks):
+        if not entity:
+            links.append(None)
+            continue
+        matches = [(record, entity_id) for record, entity_id in candidates.get(block, [])
+                   if entity_id != id_text and is_same_entity(entity, record)]
+        people = {record for record, _ in matches}
+        if len(people) > 1:
+            matches = [(record, entity_id) for record, entity_id in matches if record == entity]
+            people = {record for record, _ in matches}
+        links.append(min(entity_id for _, entity_id in matches) if len(people) == 1 else None)
+    return links
+
+
+def count_entities(conn: sqlite3.Connection) -> int:
+    return conn.execute("SELECT COUNT(*) FROM entities").fetchone()[0]
+
+
+def _tokens(text):
+    """Lower-cased ASCII word tokens of text; '&' reads as 'and', apostrophes and periods join letters."""
+    text = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode('ascii').lower()
+    text = re.sub(r"['.]", '', text.replace('&', ' and '))
+    return re.findall(r'[a-z0-9]+', text)
+
+def _similar(a, b):
+    if a == b:
+        return True
+    # the quick upper bounds rule out most pairs before the full comparison
+    matcher = SequenceMatcher(None, a, b)
+    return (matcher.real_quick_ratio() >= SIMILARITY_THRESHOLD and matcher.quick_ratio() >= SIMILARITY_THRESHOLD
+            and matcher.ratio() >= SIMILARITY_THRESHOLD)
+
+def _first_names_match(a, b):
+    # spelling similarity is not enough (daniel / danielle, paul / paula are different people)
+    return a == b or NICKNAMES.get(a, a) == NICKNAMES.get(b, b)
+
+def _universities_match(a, b):
+    if not a or not b: # without a university there is nothing to tell two namesakes apart
+        return False
+    # compared in order, so "washington university" is not "university washington"; typos still match
+    return a == b or _similar(' '.join(a), ' '.join(b))
+
+def _records_in_blocks(conn, blocks):
+    """Indexed records of the given blocks, as {block: [((first, last, university), id_text), ...]}."""
+    records = {}
+    blocks = list(blocks)
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS probe (block TEXT)")
+    try:
+        for start in range(0, len(blocks), _PROBE_BATCH_SIZE):
+            conn.execute("DELETE FROM probe")
+            conn.executemany("INSERT INTO probe (block) VALUES (?)", ((block,) for block in blocks[start:start + _PROBE_BATCH_SIZE]))
+            for id_text, block, first, last, university in conn.execute(
+                    "SELECT e.id_text, e.block, e.first, e.last, e.university FROM entities e "
+                    "WHERE e.block IN (SELECT block FROM probe)"):
+                records.setdefault(block, []).append(((first, last, tuple(university.split())), id_text))
+    finally:
+        conn.execute("DROP TABLE IF EXISTS probe")
+        conn.commit()
+    return records
+
+def _insert(conn, ids):
+    rows = []
+    for id_text in ids:
+        entity = canonicalize(id_text)
+        if entity: # ids without a first and last name are never linked to
+            rows.append((str(id_text), block_key(entity), entity[0], entity[1], ' '.join(entity[2])))
+    conn.executemany("INSERT OR REPLACE INTO entities (id_text, block, first, last, university) VALUES (?, ?, ?, ?, ?)", rows)
+
+def _set_fingerprint(conn, fingerprint):
+    conn.execute("DELETE FROM synced_dataset")
+    conn.execute("INSERT INTO synced_dataset (fingerprint) VALUES (?)", (fingerprint,))
@@ -0,0 +1,227 @@
+"""
+In-memory stand-in for the subset of the Dropbox client used by DESS, for exercising sync and
+upload code offline. Returns the real `dropbox.files` metadata types and raises the same
+`ApiError`s as the SDK, so calling code can't tell the difference.
+
+Usage:
+    dbx = FakeDropbox(page_size=2)
+    dbx.put('/DESS/data-files/a.parquet', b'...')
+    dbx.inject_failure('files_upload', times=1)   # next upload raises ConnectionError
+"""
+
+import os
+import uuid
+import hashlib
+import datetime
+import threading
+from collections import Counter
+
+from dropbox.exceptions import ApiError
+from dropbox.files import (WriteMode, FileMetadata, FolderMetadata, ListFolderResult, UploadSessionStartResult,
+                           GetMetadataError, LookupError, ListFolderError, DownloadError, UploadError, DeleteError, DeleteResult,
+                           UploadWriteFailed, WriteError, WriteConflictError, UploadSessionFinishError,
+                           UploadSessionLookupError, UploadSessionOffsetError, UploadSessionType)
+
+DROPBOX_HASH_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def content_hash_of_bytes(data: bytes) -> str:
+    """Dropbox content hash of an in-memory payload."""
+    block_hashes = b''.join(hashlib.sha256(data[i:i + DROPBOX_HASH_BLOCK_SIZE]).digest()
+                            for i in range(0, len(data), DROPBOX_HASH_BLOCK_SIZE))
+    return hashlib.sha256(block_hashes).hexdigest()
+
+
+class FakeDropbox:
+    """Dropbox client double that keeps files in memory, paginates listings and can inject failures."""
+    def __init__(self, page_size: int = 100):
+        self.page_size = page_size
+        self.files = {}      # path_lower -> (path_display, bytes, client_modified)
+        self.sessions = {}   # session_id -> upload session state
+        self.calls = Counter()
+        self._failures = Counter()
+        self._cursors = {}
+        self._lock = threading.Lock()
+
+    # ---- test helpers -------------------------------------------------------------------------
+    def put(self, path: str, data: bytes, client_modified: datetime.datetime = None):
+        """Seeds a remote file without counting as an API call."""
+        with self._lock:
+            self.files[path.lower()] = (path, bytes(data), client_modified or _now())
+
+    def get(self, path: str) -> bytes:
+        return self.files[path.lower()][1]
+
+    def inject_failure(self, method_name: str, times: int = 1):
+        """Makes the next `times` calls to method_name raise ConnectionError."""
+        self._failures[method_name] += times
+
+    # ---- SDK surface --------------------------------------------------------------------------
+    def users_get_current_account(self):
+        self._record('users_get_current_account')
+        return {'account_id': 'dbid:fake'}
+
+    def files_get_metadata(self, path):
+        self._record('files_get_metadata')
+        with self._lock:
+            if path.lower() not in self.files:
+                raise ApiError(_request_id(), GetMetadataError.path(LookupError.not_found), None, None)
+            return self._metadata(path.lower())
+
+    def files_list_folder(self, path, recursive=False, limit=None):
+        self._record('files_list_folder')
+        prefix = path.rstrip('/').lower() + '/'
+        with self._lock:
+            names = sorted(p for p in self.files if p.startswith(prefix))
+            if not names:
+                raise ApiError(_request_id(), ListFolderError.path(LookupError.not_found), None, None)
+            entries, folders = [], set()
+            for path_lower in names:
+                relative = path_lower[len(prefix):]
+                if '/' in relative:
+                    folder = prefix + relative.split('/')[0]
+                    if folder not in folders:
+                        folders.add(folder)
+                        entries.append(FolderMetadata(name=os.path.basename(folder), id=f"id:{folder}",
+                                                      path_lower=folder, path_display=folder))
+                    if not recursive:
+                        continue
+                entries.append(self._metadata(path_lower))
+        return self._page(entries, limit or self.page_size)
+
+    def files_list_folder_continue(self, cursor):
+        self._record('files_list_folder_continue')
+        entries, page_size = self._cursors.pop(cursor)
+        return self._page(entries, page_size)
+
+    def files_upload(self, f, path, mode=WriteMode.add, autorename=False, client_modified=None, mute=False,
+                     property_groups=None, strict_conflict=False, content_hash=None):
+        self._record('files_upload')
+        return self._write(path, bytes(f), mode, autorename, client_modified)
+
+    def files_download_to_file(self, download_path, path, rev=None):
+        self._record('files_download_to_file')
+        with self._lock:
+            if path.lower() not in self.files:
+                raise ApiError(_request_id(), DownloadError.path(LookupError.not_found), None, None)
+            data = self.files[path.lower()][1]
+            metadata = self._metadata(path.lower())
+        with open(download_path, 'wb') as out:
+            out.write(data)
+        return metadata
+
+    def files_delete_v2(self, path, parent_rev=None):
+        self._record('files_delete_v2')
+        with self._lock:
+            if path.lower() not in self.files:
+                raise ApiError(_request_id(), DeleteError.path_lookup(LookupError.not_found), None, None)
+            metadata = self._metadata(path.lower())
+            del self.files[path.lower()]
+        return DeleteResult(metadata=metadata)
+
+    def files_upload_session_start(self, f, close=False, session_type=None, content_hash=None):
+        self._record('files_upload_session_start')
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self.sessions[session_id] = {'data': bytearray(f), 'chunks': {}, 'closed': close,
+                                         'concurrent': session_type == UploadSessionType.concurrent}
+        return UploadSessionStartResult(session_id=session_id)
+
+    def files_upload_session_append(self, f, session_id, offset):
+        self._record('files_upload_session_append')
+        self._append(session_id, offset, bytes(f), close=False)
+
+    def files_upload_session_append_v2(self, f, cursor, close=False, content_hash=None):
+        self._record('files_upload_session_append_v2')
+        self._append(cursor.session_id, cursor.offset, bytes(f), close)
+
+    def files_upload_session_finish(self, f, cursor, commit, content_hash=None):
+        self._record('files_upload_session_finish')
+        wrap = UploadSessionFinishError.lookup_failed
+        with self._lock:
+            session = self._session(cursor.session_id, wrap)
+            if session['concurrent']:
+                data = b''.join(session['chunks'][offset] for offset in sorted(session['chunks']))
+                if bytes(f) or cursor.offset != len(data) or not session['closed']:
+                    error = UploadSessionLookupError.incorrect_offset(UploadSessionOffsetError(correct_offset=len(data)))
+                    raise ApiError(_request_id(), wrap(error), None, None)
+            else:
+                self._append_sequential(session, cursor.offset, bytes(f), wrap)
+                data = bytes(session['data'])
+            del self.sessions[cursor.session_id]
+        return self._write(commit.path, data, commit.mode, commit.autorename, commit.client_modified)
+
+    # ---- internals ----------------------------------------------------------------------------
+    def _record(self, method_name):
+        with self._lock:
+            self.calls[method_name] += 1
+            if self._failures[method_name]:
+                self._failures[method_name] -= 1
+                raise ConnectionError(f"Injected failure in {method_name}")
+
+    def _append(self, session_id, offset, data, close):
+        with self._lock:
+            session = self._session(session_id)
+            if session['concurrent']:
+                # Concurrent sessions accept chunks in any order, but every chunk except the last must be 4 MB aligned
+                if offset % DROPBOX_HASH_BLOCK_SIZE or (not close and len(data) % DROPBOX_HASH_BLOCK_SIZE):
+                    raise ApiError(_request_id(), UploadSessionLookupError.concurrent_session_invalid_offset, None, None)
+                session['chunks'][offset] = data
+            else:
+                self._append_sequential(session, offset, data)
+            session['closed'] = session['closed'] or close
+
+    def _session(self, session_id, wrap=None):
+        session = self.sessions.get(session_id)
+        error = None
+        if session is None:
+            error = UploadSessionLookupError.not_found
+        elif session['closed'] and not (wrap and session['concurrent']):
+            error = UploadSessionLookupError.closed
+        if error is not None:
+            raise ApiError(_request_id(), wrap(error) if wrap else error, None, None)
+        return session
+
+    def _append_sequential(self, session, offset, data, wrap=None):
+        buffer = session['data']
+        if offset != len(buffer):
+            error = UploadSessionLookupError.incorrect_offset(UploadSessionOffsetError(correct_offset=len(buffer)))
+            raise ApiError(_request_id(), wrap(error) if wrap else error, None, None)
+        buffer.extend(data)
+
+    def _write(self, path, data, mode, autorename, client_modified):
+        with self._lock:
+            path_lower = path.lower()
+            existing = self.files.get(path_lower)
+            if existing and mode == WriteMode.add and existing[1] != data:
+                if not autorename:
+                    error = UploadError.path(UploadWriteFailed(reason=WriteError.conflict(WriteConflictError.file),
+                                                               upload_session_id=''))
+                    raise ApiError(_request_id(), error, None, None)
+                stem, ext = os.path.splitext(path)
+                path, path_lower = f"{stem} (1){ext}", f"{stem} (1){ext}".lower()
+            self.files[path_lower] = (path, data, client_modified or _now())
+            return self._metadata(path_lower)
+
+    def _metadata(self, path_lower):
+        path_display, data, client_modified = self.files[path_lower]
+        return FileMetadata(name=os.path.basename(path_display), id=f"id:{path_lower}",
+                            client_modified=client_modified, server_modified=_now(),
+                            rev=hashlib.sha1(data).hexdigest()[:16], size=len(data),
+                            path_lower=path_lower, path_display=path_display,
+                            content_hash=content_hash_of_bytes(data))
+
+    def _page(self, entries, page_size):
+        page, rest = entries[:page_size], entries[page_size:]
+        cursor = uuid.uuid4().hex
+        if rest:
+            self._cursors[cursor] = (rest, page_size)
+        return ListFolderResult(entries=page, cursor=cursor, has_more=bool(rest))
+
+
+def _now():
+    return datetime.datetime.utcnow().replace(microsecond=0)
+
+
+def _request_id():
+    return uuid.uuid4().hex
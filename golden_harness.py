@@ -0,0 +1,331 @@
+"""
+Golden-set regression harness for the department extraction engines.
+
+Every registered engine (regex, keyword, rules, llm, cascade; see ENGINES) is run on a versioned,
+labeled sample (fixtures/golden/golden_set_v<N>.jsonl). For each engine it reports
+- precision: correct answers / rows it answered,
+- recall: correct answers / rows with a department label,
+- coverage: rows it answered / all rows,
+- rows/sec (best of --repeat runs) and peak traced memory (tracemalloc, separate run); engines
+  calling an LLM run once, and their throughput is reported but not checked,
+and compares them with a baseline saved by an earlier run (--update-baseline). It exits with status
+1 when precision, recall or coverage drop by more than --accuracy-tolerance, when throughput drops
+by more than --throughput-tolerance, when peak memory grows by more than --memory-tolerance, or when
+an engine of the baseline is unavailable or no longer registered. Answers that changed since the
+baseline are listed; --strict also fails on them.
+
+golden_set_v1.jsonl is synthetic: 40 short search results written to exercise the regex patterns, the
+keyword whitelist and the professor flags, labeled by construction. It catches changed answers but
+says little about accuracy on real results. `--sample N` draws N rows of complete (searched, not in
+a golden set yet) into a file to be labeled by hand, the intended source of the next version.
+
+Golden-set format, one JSON object per line:
+    {"id": "golden-001", "rawText": ["title snippet", ...], "isProfessor": true,
+     "department": "economics", "accept": ["econ"]}
+`department` is the lower-case department name, or "MISSING" when the text doesn't name one;
+`accept` optionally lists other answers that count as correct (e.g. the first word of a two-word
+department, which is all the regex patterns capture). Add rows in a new golden_set_v<N+1>.jsonl
+rather than editing a released version, so baselines stay comparable. Every row must be labeled:
+sampled rows have "department": null until someone fills it in, and load_golden_set refuses them.
+
+The baseline is machine-specific (throughput), so it lives in STORAGE_DIR, not in the repository.
+
+Usage:
+    python3 golden_harness.py [--engines regex keyword] [--llm stub] [--update-baseline]
+    python3 golden_harness.py --sample 100 [--sample-out fixtures/golden/to_label.jsonl]
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import random
+import argparse
+import tracemalloc
+import config
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'golden')
+GOLDEN_SET_PATH = os.path.join(GOLDEN_DIR, 'golden_set_v1.jsonl')
+SAMPLE_PATH = os.path.join(GOLDEN_DIR, 'to_label.jsonl')
+MISSING = "MISSING"
+ACCURACY_TOLERANCE = 0.005  # absolute drop in precision/recall/coverage
+THROUGHPUT_TOLERANCE = 0.3  # relative drop in rows/sec
+MEMORY_TOLERANCE = 0.5      # relative growth of peak memory
+MIN_TIMED_SECONDS = 0.2     # each timed run repeats the golden set until it took at least this long
+
+# name -> (function(records, options) -> list of answers, costly). Costly engines (LLM calls) run once.
+ENGINES = {}
+
+
+def register_engine(name: str, costly: bool = False):
+    """Decorator adding an extraction path to the harness."""
+    def register(function):
+        ENGINES[name] = (function, costly)
+        return function
+    return register
+
+
+@register_engine('regex')
+def _regex_engine(records, options):
+    import dess.nlp as nlp
+    return [nlp._extract_department_regex(record['rawText'])[0] for record in records]
+
+
+@register_engine('keyword')
+def _keyword_engine(records, options):
+    import dess.nlp as nlp
+    return [nlp._extract_department_fuzzy_match(record['rawText'])[0] for record in records]
+
+
+@register_engine('rules')
+def _rules_engine(records, options):
+    """The rules part of the cascade: regex and keyword answers combined by precedence, no LLM."""
+    return _cascade(records, options, use_llm=False)
+
+
+@register_engine('llm', costly=True)
+def _llm_engine(records, options):
+    """Single-record prompts, uncached, through the InferenceEngine (rate limits off for the stub)."""
+    from dess.llms.llm_factory import LLMFactory
+    from dess.llms.inference_engine import InferenceEngine
+    llm = LLMFactory.get_llm(options['llm'], use_cache=False)
+    limits = {'requests_per_minute': 0, 'tokens_per_minute': 0} if options['llm'] == 'stub' else {}
+    engine = InferenceEngine(llm, **limits)
+    return engine.run([llm.department_prompt("\n".join(record['rawText'])) for record in records])
+
+
+@register_engine('cascade', costly=True)
+def _cascade_engine(records, options):
+    """dess.cascade.resolve_departments, rows the rules can't resolve go to the LLM (response cache on)."""
+    return _cascade(records, options, use_llm=True)
+
+
+def _cascade(records, options, use_llm):
+    import pandas as pd
+    import dess.nlp as nlp
+    import dess.cascade as cascade
+    df = pd.DataFrame({'rawText': [record['rawText'] for record in records]})
+    nlp.extract_department_information(df)
+    # Route by the labeled isProfessor, so departments are scored independently of the rules' professor flag
+    df['isProfessor'] = [record.get('isProfessor') for record in records]
+    if use_llm:
+        cascade.resolve_departments(df, run_rules=False, llm_type=options['llm'])
+    else:
+        df['department_llm'] = None
+        cascade._choose_department(df, cascade.MAX_KEYWORD_PRECISION)
+    return df['department'].tolist()
+
+
+def load_golden_set(path: str = GOLDEN_SET_PATH) -> list:
+    """The records of a golden-set file; raises ValueError if any of them isn't labeled yet."""
+    with open(path, encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    unlabeled = [record['id'] for record in records if record.get('department') is None]
+    if unlabeled:
+        raise ValueError(f"{path} has {len(unlabeled)} unlabeled rows (e.g. {unlabeled[0]}); label them first.")
+    return records
+
+
+def sample_for_labeling(n_rows: int, out_path: str = SAMPLE_PATH, seed: int = None) -> int:
+    """
+    Writes n_rows random rows of the complete dataset that have rawText and aren't in any golden set
+    yet to out_path, in the golden-set format with isProfessor and department left null for a person
+    to fill in (from the snippets alone, without looking at the pipeline's answers). Returns the
+    number of rows written.
+    """
+    import data_pipeline_manager as dpm
+    import parquet_schema
+    df = dpm.read_dataset(dpm.COMPLETE_FILE_PATH, columns=['rawText'])
+    df = df[parquet_schema.has_raw_text(df['rawText'])]
+
+    labeled = set()
+    for file_name in os.listdir(GOLDEN_DIR):
+        if file_name.startswith('golden_set_v') and file_name.endswith('.jsonl'):
+            with open(os.path.join(GOLDEN_DIR, file_name), encoding='utf-8') as f:
+                labeled.update(json.loads(line)['id'] for line in f if line.strip())
+    # Ids are hashes of id_text, so the fixtures don't carry people's names
+    ids = [f"complete-{hashlib.sha1(str(id_text).encode('utf-8')).hexdigest()[:12]}" for id_text in df['id_text']]
+    candidates = [i for i, record_id in enumerate(ids) if record_id not in labeled]
+    chosen = sorted(random.Random(seed).sample(candidates, min(n_rows, len(candidates))))
+
+    with open(out_path, 'w', encoding='utf-8') as f:
+        for i in chosen:
+            record = {'id': ids[i], 'rawText': [str(text) for text in df['rawText'].iloc[i]],
+                      'isProfessor': None, 'department': None}
+            f.write(json.dumps(record) + '\n')
+    print(f"Wrote {len(chosen)} rows to label to {out_path}")
+    return len(chosen)
+
+
+def normalize(answer) -> str:
+    """Lower-case answer, MISSING for no answer (None, empty, failed request)."""
+    if answer is None:
+        return MISSING
+    answer = str(answer).strip().strip('."\'').lower()
+    return MISSING if not answer or answer == MISSING.lower() else answer
+
+
+def score(records: list, answers: list) -> dict:
+    """Precision, recall and coverage of answers against the labels."""
+    answered = correct = labeled = 0
+    for record, answer in zip(records, answers):
+        label = normalize(record['department'])
+        accepted = {label} | {normalize(alternative) for alternative in record.get('accept', [])}
+        labeled += label != MISSING
+        if answer != MISSING:
+            answered += 1
+            correct += answer in accepted and label != MISSING
+    return {'precision': correct / answered if answered else 0.0,
+            'recall': correct / labeled if labeled else 0.0,
+            'coverage': answered / len(records) if records else 0.0}
+
+
+def run_engine(name: str, records: list, options: dict, repeat: int = 5) -> dict:
+    """Runs an engine on records; returns its scores, rows/sec, peak memory (MB) and answers by id."""
+    function, costly = ENGINES[name]
+    start = time.perf_counter()
+    answers = function(records, options) # also warms up caches (whitelist, compiled patterns)
+    rows_per_sec = len(records) / (time.perf_counter() - start)
+    peak_mb = None
+
+    if not costly:
+        # The golden set is small: each timed run loops over it until MIN_TIMED_SECONDS passed
+        for _ in range(repeat):
+            rows, start = 0, time.perf_counter()
+            while time.perf_counter() - start < MIN_TIMED_SECONDS:
+                function(records, options)
+                rows += len(records)
+            rows_per_sec = max(rows_per_sec, rows / (time.perf_counter() - start))
+
+        # Memory in its own run: tracemalloc slows allocation-heavy code down too much to time it
+        tracemalloc.start()
+        try:
+            function(records, options)
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        finally:
+            tracemalloc.stop()
+
+    answers = [normalize(answer) for answer in answers]
+    return dict(score(records, answers), rows_per_sec=rows_per_sec, peak_mb=peak_mb, costly=costly,
+                answers={record['id']: answer for record, answer in zip(records, answers)})
+
+
+def compare(result: dict, baseline: dict, accuracy_tolerance: float = ACCURACY_TOLERANCE,
+            throughput_tolerance: float = THROUGHPUT_TOLERANCE, memory_tolerance: float = MEMORY_TOLERANCE) -> list:
+    """Regressions of one engine's result against its baseline, as messages."""
+    regressions = []
+    for metric in ('precision', 'recall', 'coverage'):
+        if result[metric] < baseline[metric] - accuracy_tolerance:
+            regressions.append(f"{metric} {baseline[metric]:.3f} -> {result[metric]:.3f}")
+    # Costly engines are bound by the backend and its rate limits, not by this code
+    if not result['costly'] and result['rows_per_sec'] < baseline['rows_per_sec'] * (1 - throughput_tolerance):
+        regressions.append(f"rows/sec {baseline['rows_per_sec']:.1f} -> {result['rows_per_sec']:.1f}")
+    if result['peak_mb'] is not None and baseline.get('peak_mb') \
+            and result['peak_mb'] > baseline['peak_mb'] * (1 + memory_tolerance):
+        regressions.append(f"peak memory {baseline['peak_mb']:.2f} MB -> {result['peak_mb']:.2f} MB")
+    return regressions
+
+
+def changed_answers(result: dict, baseline: dict) -> dict:
+    """{id: (baseline answer, new answer)} for the rows whose answer changed."""
+    return {record_id: (baseline['answers'].get(record_id), answer) for record_id, answer in result['answers'].items()
+            if baseline['answers'].get(record_id) != answer}
+
+
+def _file_sha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scores the extraction engines on the golden set and checks for regressions.")
+    parser.add_argument("--golden", default=GOLDEN_SET_PATH, help="Golden-set file (JSON lines)")
+    parser.add_argument("--engines", nargs='+', default=None, help=f"Engines to run (default: all of {', '.join(ENGINES)})")
+    parser.add_argument("--llm", default="stub", help="LLM backend of the llm/cascade engines ('stub' or 'gemini')")
+    parser.add_argument("--whitelist", default=None, help="Keyword whitelist (.pkl) instead of the one in STORAGE_DIR")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per engine (the best is kept)")
+    parser.add_argument("--baseline", default=None, help="Baseline file (default: STORAGE_DIR/golden_baseline.json)")
+    parser.add_argument("--update-baseline", action="store_true", help="Save this run as the new baseline")
+    parser.add_argument("--strict", action="store_true", help="Also fail when any answer changed")
+    parser.add_argument("--accuracy-tolerance", type=float, default=ACCURACY_TOLERANCE)
+    parser.add_argument("--throughput-tolerance", type=float, default=THROUGHPUT_TOLERANCE)
+    parser.add_argument("--memory-tolerance", type=float, default=MEMORY_TOLERANCE)
+    parser.add_argument("--sample", type=int, default=None, metavar="N",
+                        help="Only write N unlabeled rows of complete to --sample-out, for hand labeling")
+    parser.add_argument("--sample-out", default=SAMPLE_PATH)
+    parser.add_argument("--seed", type=int, default=None, help="Random seed of --sample")
+    args = parser.parse_args(argv)
+
+    if args.sample is not None:
+        sample_for_labeling(args.sample, args.sample_out, args.seed)
+        return 0
+    unknown = [name for name in args.engines or [] if name not in ENGINES]
+    if unknown:
+        parser.error(f"unknown engines: {', '.join(unknown)} (registered: {', '.join(ENGINES)})")
+
+    if args.whitelist:
+        import dess.nlp as nlp
+        nlp.KEYWORD_WHITELIST_FILE_PATH = args.whitelist
+    records = load_golden_set(args.golden)
+    golden_version = {'file': os.path.basename(args.golden), 'sha256': _file_sha256(args.golden)}
+    baseline_path = args.baseline or config.storage_path('golden_baseline.json')
+    baseline = None
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        if baseline['golden'] != golden_version:
+            print(f"Baseline {baseline_path} is for {baseline['golden']['file']} (different content); "
+                  f"not comparing. Run with --update-baseline.")
+            baseline = None
+
+    options = {'llm': args.llm}
+    results, failed = {}, False
+    print(f"{len(records)} rows from {golden_version['file']}")
+    print(f"{'engine':<10} {'precision':>9} {'recall':>7} {'coverage':>9} {'rows/sec':>10} {'peak MB':>8}")
+    for name in args.engines or ENGINES:
+        try:
+            result = run_engine(name, records, options, args.repeat)
+        except FileNotFoundError as e: # e.g. no keyword whitelist on this machine
+            print(f"{name:<10} unavailable: {e}")
+            if baseline and name in baseline['engines']:
+                print(f"    REGRESSION: {name} is in the baseline but could not run")
+                failed = True
+            continue
+        results[name] = result
+        peak = f"{result['peak_mb']:8.2f}" if result['peak_mb'] is not None else f"{'-':>8}"
+        print(f"{name:<10} {result['precision']:9.3f} {result['recall']:7.3f} {result['coverage']:9.3f} "
+              f"{result['rows_per_sec']:10.1f} {peak}")
+
+        engine_baseline = baseline['engines'].get(name) if baseline else None
+        if engine_baseline is None:
+            continue
+        regressions = compare(result, engine_baseline, args.accuracy_tolerance, args.throughput_tolerance,
+                              args.memory_tolerance)
+        changes = changed_answers(result, engine_baseline)
+        for message in regressions:
+            print(f"    REGRESSION: {message}")
+        if changes:
+            print(f"    {len(changes)} answers changed:")
+            for record_id, (before, after) in list(changes.items())[:20]:
+                print(f"      {record_id}: {before} -> {after}")
+        failed |= bool(regressions) or (args.strict and bool(changes))
+
+    # Engines of the baseline that are no longer registered (e.g. renamed) can't silently drop out
+    for name in (baseline['engines'] if baseline and not args.engines else []):
+        if name not in ENGINES:
+            print(f"{name:<10} REGRESSION: in the baseline but no longer registered")
+            failed = True
+
+    if baseline is None and not args.update_baseline:
+        print(f"No baseline to compare with; run with --update-baseline to save one to {baseline_path}")
+    if args.update_baseline:
+        saved = {'golden': golden_version, 'engines': dict(baseline['engines'] if baseline else {}, **results)}
+        with open(baseline_path, 'w') as f:
+            json.dump(saved, f, indent=1)
+        print(f"Saved baseline to {baseline_path}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,78 +1,297 @@
 import os
-import pandas as pd
-import dess.nlp as nlp
-import data_pipeline_manager as dpm
-import cse
-from dotenv import load_dotenv
 import logging
+import argparse
+import queue
+import threading
+import config
+
+# pandas, the extraction rules (dess.nlp), the API client (cse) and data_pipeline_manager (and through
+# it the Dropbox SDK) are imported by the functions that need them: a dry run never loads most of them.
 
 # ========================================
 # CONFIG
-load_dotenv()
-STORAGE_DIR = os.getenv('STORAGE_DIR')
-ERROR_FILE = f'{STORAGE_DIR}/errors.csv'
-FILE_PATH = f'{STORAGE_DIR}/dataset/shishir-toSearch-2025-02-11.parquet'
-LOG_FILE = f'{STORAGE_DIR}/API_WORKFLOW_shishir.LOG'
-logging.basicConfig(filename=LOG_FILE, level=logging.INFO, 
-                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-                    force=True)
+# Paths derived from the environment, resolved when first used (see __getattr__)
+_ENV_PATHS = {
+    'STORAGE_DIR': lambda: config.storage_path(),
+    'ERROR_FILE': lambda: config.storage_path('errors.csv'),
+    'FILE_PATH': lambda: config.storage_path('dataset/shishir-toSearch-2025-02-11.parquet'),
+    'LOG_FILE': lambda: config.storage_path('API_WORKFLOW_shishir.LOG'),
+}
+ROWS_PER_DAY = 100      # rows selected per run, at most what is left of the Custom Search API quota (cse.acquire)
+FETCH_WORKERS = 4       # concurrent API calls
+COMMIT_BATCH_SIZE = 25  # rows per committed batch (a delta part of FILE_PATH, see update_parquet_file)
+QUEUE_SIZE = 50         # items buffered between stages
+_DONE = object()
 logger = logging.getLogger(__name__)
 # ========================================
 
+def __getattr__(name):
+    if name in _ENV_PATHS:
+        return _ENV_PATHS[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _path(name):
+    return __getattr__(name)
+
+def _configure_logging():
+    """Sends the log to LOG_FILE. Called by main, so importing the module leaves logging alone."""
+    logging.basicConfig(filename=_path('LOG_FILE'), level=logging.INFO, 
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                        force=True)
+
 def _get_next_chunk_for_api_call():
-    df = pd.read_parquet(FILE_PATH)
-    unprocessed_df = df[df['isProcessed'] == False]
-    
-    # Limit rows per day based on rate limits
-    rows_per_day = min(len(unprocessed_df), 100)
-    today_df = unprocessed_df.iloc[:rows_per_day]
+    """Selects the next unprocessed rows, reading only id_text/isProcessed from the row groups whose
+    statistics show unprocessed rows (fold_parquet_updates keeps those clustered at the start of the
+    file). Rows marked processed by a committed batch that is not folded into the file yet are skipped.
+    rawText holds the snippets already stored for a row (fetched by a run whose extraction failed), else None."""
+    import pyarrow.parquet as pq
+    import parquet_schema
+    import data_pipeline_manager as dpm
+    import cse
+    # Limit rows per day based on rate limits (the quota is shared with rescrape.py)
+    quota = cse.remaining_quota()
+    limit = ROWS_PER_DAY if quota is None else min(ROWS_PER_DAY, quota)
+    pending = dpm.pending_updates(_path('FILE_PATH'))
+    snippet_columns = [col for col in parquet_schema.SNIPPET_COLUMNS if col in pq.read_schema(_path('FILE_PATH')).names]
+    table = parquet_schema.read_where(_path('FILE_PATH'), 'isProcessed', False, columns=['id_text'] + snippet_columns,
+                                      limit=limit + len(pending))
+    today_df = table.to_pandas()
+    today_df = today_df[~today_df['id_text'].isin(pending)].head(limit).reset_index(drop=True)
+    snippets = today_df[snippet_columns].to_numpy() if snippet_columns else [[]] * len(today_df)
+    today_df = today_df.drop(columns=snippet_columns)
+    today_df['rawText'] = [[s for s in row if isinstance(s, str)] or None for row in snippets]
     
     logging.info(f"Selected {len(today_df)} rows for processing")
     return today_df
 
-def end_to_end_workflow():
+def end_to_end_workflow(fetch_workers: int = FETCH_WORKERS, batch_size: int = COMMIT_BATCH_SIZE):
+    """
+    Runs today's chunk through three overlapping stages connected by bounded queues:
+    API calls (fetch_workers threads) -> department extraction -> persistence, which commits every
+    batch_size rows as a delta part of the parquet file (update_parquet_file). The file is rewritten
+    once, when the committed batches are folded into it at the end of the run (or of the next one, after
+    a crash). Rows committed before a failure stay committed (and marked processed); rows already
+    fetched when a stage fails are still extracted and committed before the run stops, and fetched
+    CSVs are kept for the Dropbox push of the next run. The rawText of a batch whose extraction
+    failed is committed without extraction and without marking the rows processed, so the next run
+    only redoes the extraction (it doesn't search rows that already have rawText).
+    """
+    import pandas as pd
+    import dess.nlp as nlp
+    import data_pipeline_manager as dpm
+    import cse
+
     # 1. Get today's chunk [constrained by rate limits and remaning count]
     df = _get_next_chunk_for_api_call()
-    processed_ids = df['id_text'].tolist()
-    
-    # 2. Make API Calls
-    logging.info("Starting Phase 1: Custom Search Engine API calls...")
-    cse.populate_rawText_col(df)
-    
-    # Identify errors for logging purposes
-    df_errors = df[df['rawText'].isna()]
-    if not df_errors.empty:
-        logging.info(f"Encountered {len(df_errors)} errors during API calls")
-    
-    write_header_error = not os.path.exists(ERROR_FILE)
-    df_errors[['id_text']].to_csv(ERROR_FILE, mode='a', index=False, header=write_header_error)
-    
-    logging.info("[COMPLETE] Phase 1: API Calls")
-    logging.info("Starting Phase 2: Department Extraction...")
 
-    # 3. Run department extraction methodology
-    df_non_errors = df.dropna(subset=['rawText']).copy().reset_index(drop=True) # Create a copy with reset index to avoid index mismatch issues
-    nlp.extract_department_information(df_non_errors)
+    todo = queue.Queue()
+    for record in df.to_dict('records'):
+        todo.put(record)
+    fetched = _Channel(QUEUE_SIZE)
+    extracted = _Channel(QUEUE_SIZE)
+    stop = threading.Event()
+    failures = []
+    totals = {'rows': 0, 'errors': 0, 'unextracted': 0, 'batches': 0}
+    unextracted = [] # fetched records of the batch whose extraction failed
 
-        logging.info("[COMPLETE] Phase 2: Populate Department Variables")
+    def fetch():
+        # 2. Make API Calls
+        while not stop.is_set():
+            try:
+                record = todo.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                if record['rawText'] is None:
+                    record['rawText'] = cse.fetch_rawText(record['id_text'])
+            except cse.QuotaExceeded as e: # the row stays unprocessed for the next run
+                logging.warning(f"Stopping fetch worker: {e}")
+                return
+            fetched.put(record, stop)
 
-    # 4. Update out files
-    dpm.update_parquet_file(df_non_errors, FILE_PATH, processed_ids)
+    def extract_batch(records):
+        found = [record for record in records if record['rawText'] is not None]
+        if found:
+            df_found = pd.DataFrame(found)
+            nlp.extract_department_information(df_found)
+            found = df_found.to_dict('records')
+        return found + [record for record in records if record['rawText'] is None]
 
-        # 5. Cloud Sync and local cleanup
-        logging.info("Starting Phase 3: Uploading to dropbox...")
+    def extract():
+        # 3. Run department extraction methodology, on whatever has been fetched so far
+        for records in _drain(fetched, fetch_workers, max_items=batch_size):
+            try:
+                batch = extract_batch(records)
+            except Exception:
+                unextracted.extend(records)
+                raise
+            extracted.put(batch, stop)
+
+    def persist():
+        # 4. Update out files, one committed batch at a time
+        pending = []
+        for records in _drain(extracted, 1):
+            pending.extend(record for batch in records for record in batch)
+            while len(pending) >= batch_size:
+                _commit_batch(pending[:batch_size], totals)
+                pending = pending[batch_size:]
+        if pending:
+            _commit_batch(pending, totals)
+
+    logging.info(f"Starting pipeline: {fetch_workers} fetch workers, commits every {batch_size} rows")
+    threads = [_stage(fetch, fetched, stop, failures) for _ in range(fetch_workers)]
+    threads.append(_stage(extract, extracted, stop, failures))
+    threads.append(_stage(persist, None, stop, failures))
+    for thread in threads:
+        thread.join()
+    if failures:
+        # A stage failed: commit what was fetched (the API calls are spent) but not yet persisted
+        _commit_leftovers(fetched, extracted, extract_batch, unextracted, totals)
+    folded = dpm.fold_parquet_updates(_path('FILE_PATH'))
+    logging.info(f"Folded {folded} committed updates into {_path('FILE_PATH')}")
+    logging.info(f"Committed {totals['batches']} batches: processed {totals['rows']} rows. Error {totals['errors']} rows. "
+                 f"Not extracted {totals['unextracted']} rows.")
+
+    # 5. Cloud Sync and local cleanup (also after a failure, so committed batches are backed up)
+    if totals['batches']:
+        logging.info("Starting Dropbox sync...")
         dbx = dpm.dropbox_oauth()
         dpm.push_new_dataset_files_to_dropbox(dbx)
-        logging.info("[COMPLETE] Phase 3: Dropbox sync")
-        
-        # 6. Logging & Metrics
-        processed_count = len(df_non_errors)
-        logging.info(f"Processed {processed_count} rows. Error {len(df) - processed_count} rows.")
-    except:
-        folder = f'{STORAGE_DIR}/dataset'
-        for file in os.listdir(folder):
-            if file.endswith('.csv'):
-                os.remove(os.path.join(folder, file))
+        logging.info("[COMPLETE] Dropbox sync")
+
+    if failures:
+        logging.error(f"Pipeline stopped early: {failures[0]!r}")
+        raise failures[0]
+
+def _commit_batch(records, totals, extracted: bool = True):
+    """Persists a batch as a delta part of the parquet file (no existing file is rewritten): the rows with
+    rawText are filed and marked processed, unless they were not extracted. Failed rows (no rawText) are
+    marked processed and logged to ERROR_FILE."""
+    import pandas as pd
+    import data_pipeline_manager as dpm
+    error_file = _path('ERROR_FILE')
+    batch = pd.DataFrame(records)
+    df_errors = batch[batch['rawText'].isna()]
+    if not df_errors.empty:
+        logging.info(f"Encountered {len(df_errors)} errors during API calls")
+    write_header_error = not os.path.exists(error_file)
+    df_errors[['id_text']].to_csv(error_file, mode='a', index=False, header=write_header_error)
+
+    df_non_errors = batch[batch['rawText'].notna()].reset_index(drop=True)
+    processed_ids = batch['id_text'] if extracted else df_errors['id_text']
+    dpm.update_parquet_file(df_non_errors, _path('FILE_PATH'), processed_ids.tolist())
+
+    totals['rows' if extracted else 'unextracted'] += len(batch) - len(df_errors)
+    totals['errors'] += len(df_errors)
+    totals['batches'] += 1
+    logging.info(f"Committed batch of {len(batch)} rows")
+
+def _commit_leftovers(fetched, extracted, extract_batch, unextracted, totals):
+    """Commits the records still queued between the stages after the pipeline stopped. Fetched records
+    are extracted first; the ones whose extraction failed (and the unextracted batch of the failed stage)
+    are committed with their rawText only. If committing fails too they are only kept as fetched CSVs."""
+    leftovers = [record for batch in _queued(extracted) for record in batch]
+    try:
+        fetched_records = _queued(fetched)
+        try:
+            if fetched_records:
+                leftovers.extend(extract_batch(fetched_records))
+        except Exception:
+            logging.exception(f"Could not extract the {len(fetched_records)} rows left in the pipeline when it stopped")
+            unextracted.extend(fetched_records)
+        if leftovers:
+            _commit_batch(leftovers, totals)
+            logging.info(f"Committed {len(leftovers)} rows left in the pipeline when it stopped")
+        if unextracted:
+            _commit_batch(unextracted, totals, extracted=False)
+            logging.info(f"Committed the rawText of {len(unextracted)} rows whose extraction failed")
+    except Exception:
+        logging.exception(f"Could not commit the rows left in the pipeline when it stopped")
+
+def _queued(channel):
+    """The items left on a channel whose producers have all finished."""
+    items = []
+    while True:
+        try:
+            item = channel.get(block=False)
+        except queue.Empty:
+            return items
+        if item is not _DONE:
+            items.append(item)
+
+def _stage(target, downstream, stop, failures):
+    """Starts target on a thread. A failure stops the other stages; the downstream channel is always closed."""
+    def run():
+        try:
+            target()
+        except Exception as e:
+            logging.exception(f"Stage {target.__name__} failed")
+            failures.append(e)
+            stop.set()
+        finally:
+            if downstream is not None:
+                downstream.close()
+    thread = threading.Thread(target=run, name=target.__name__, daemon=True)
+    thread.start()
+    return thread
+
+class _Channel:
+    """Queue between two stages holding at most size items. Closing it never blocks, so a stage can
+    always signal the end of its output, even to a stage that stopped reading after a failure."""
+    def __init__(self, size: int):
+        self._queue = queue.Queue()
+        self._slots = threading.Semaphore(size)
+
+    def put(self, item, stop: threading.Event):
+        """Waits for room for item. Once the pipeline is stopping, item is queued without waiting, so
+        nothing fetched is dropped (_commit_leftovers picks it up)."""
+        while not stop.is_set():
+            if self._slots.acquire(timeout=0.5):
+                self._queue.put(item)
+                return
+        self._queue.put(item)
+
+    def close(self):
+        self._queue.put(_DONE)
+
+    def get(self, block: bool = True):
+        item = self._queue.get(block)
+        if item is not _DONE:
+            self._slots.release()
+        return item
+
+def _drain(channel, n_producers, max_items=None):
+    """Yields lists of the items available on channel (blocking for the first one) until every producer closed it."""
+    done = 0
+    while done < n_producers:
+        items = []
+        item = channel.get()
+        while True:
+            if item is _DONE:
+                done += 1
+            else:
+                items.append(item)
+            if done == n_producers or (max_items and len(items) >= max_items):
+                break
+            try:
+                item = channel.get(block=False)
+            except queue.Empty:
+                break
+        if items:
+            yield items
     
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Runs today's chunk through the Custom Search API workflow.")
+    parser.add_argument("--dry-run", action="store_true", help="Only print the rows that would be processed")
+    parser.add_argument("--fetch-workers", type=int, default=FETCH_WORKERS, help="Concurrent API calls")
+    parser.add_argument("--batch-size", type=int, default=COMMIT_BATCH_SIZE, help="Rows per committed update")
+    args = parser.parse_args(argv)
+
+    _configure_logging()
+    if args.dry_run:
+        print(_get_next_chunk_for_api_call())
+        return
+    end_to_end_workflow(args.fetch_workers, args.batch_size)
+
 if __name__== "__main__":
-    end_to_end_workflow()
\ No newline at end of file
+    main()
\ No newline at end of file
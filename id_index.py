@@ -0,0 +1,153 @@
+"""
+Persistent index of the id_text keys already stored in the complete/reprocess datasets, so
+new-row detection at intake doesn't have to load those datasets.
+
+The index is a single SQLite file with one row per id_text and state it is filed under, plus
+the fingerprint of each dataset at the time it was last synced. A dataset whose current
+fingerprint differs from the stored one (e.g. it was rewritten from the notebook) is re-indexed
+from its id_text column before the index is trusted again. An id_text found in both datasets
+keeps a row for each, so neither sync hides the other; claim_ids treats it as a conflict.
+"""
+
+import sqlite3
+import config
+
+# Paths derived from the environment, resolved when first used (see __getattr__)
+_ENV_PATHS = {
+    'INDEX_FILE_PATH': lambda: config.storage_path('id_index.sqlite'),
+}
+_PROBE_BATCH_SIZE = 50_000
+SCHEMA_VERSION = 2 # bumped when the table layout changes; an older index is dropped and re-synced
+
+def __getattr__(name):
+    if name in _ENV_PATHS:
+        return _ENV_PATHS[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _path(name):
+    return __getattr__(name)
+
+
+def open_index(index_path: str = None) -> sqlite3.Connection:
+    """Opens (creating if needed) the id_text index; INDEX_FILE_PATH by default."""
+    conn = sqlite3.connect(index_path or _path('INDEX_FILE_PATH'))
+    conn.execute("PRAGMA journal_mode=WAL")
+    if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+        conn.execute("DROP TABLE IF EXISTS processed_ids")
+        conn.execute("DROP TABLE IF EXISTS synced_datasets")
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.execute("""CREATE TABLE IF NOT EXISTS processed_ids (
+                        id_text TEXT NOT NULL,
+                        state TEXT NOT NULL,
+                        PRIMARY KEY (id_text, state)
+                    ) WITHOUT ROWID""")
+    conn.execute("CREATE INDEX IF NOT EXISTS processed_ids_by_state ON processed_ids (state)")
+    conn.execute("""CREATE TABLE IF NOT EXISTS synced_datasets (
+                        state TEXT PRIMARY KEY,
+                        fingerprint TEXT NOT NULL
+                    )""")
+    conn.commit()
+    return conn
+
+
+def get_fingerprint(conn: sqlite3.Connection, state: str):
+    """Returns the dataset fingerprint recorded at the last sync of state, or None."""
+    row = conn.execute("SELECT fingerprint FROM synced_datasets WHERE state = ?", (state,)).fetchone()
+    return row[0] if row else None
+
+
+def rebuild_state(conn: sqlite3.Connection, state: str, ids, fingerprint: str):
+    """Replaces all keys filed under state with ids, in one transaction. Keys filed under other states stay."""
+    with conn:
+        conn.execute("DELETE FROM processed_ids WHERE state = ?", (state,))
+        conn.executemany("INSERT OR IGNORE INTO processed_ids (id_text, state) VALUES (?, ?)",
+                         ((str(id_text), state) for id_text in ids))
+        set_fingerprint(conn, state, fingerprint)
+
+
+def add_ids(conn: sqlite3.Connection, state: str, ids, expected_fingerprint: str, new_fingerprint: str):
+    """
+    Files ids under state after rows were appended to its dataset.
+
+    The new fingerprint is only recorded if the index was in sync with the dataset before the
+    append (expected_fingerprint); otherwise the index is left stale and gets rebuilt on next use.
+
+    Returns:
+        bool: True if the index is in sync with the dataset after the call.
+    """
+    with conn:
+        in_sync = get_fingerprint(conn, state) == expected_fingerprint
+        conn.executemany("INSERT OR IGNORE INTO processed_ids (id_text, state) VALUES (?, ?)",
+                         ((str(id_text), state) for id_text in ids))
+        if in_sync:
+            set_fingerprint(conn, state, new_fingerprint)
+    return in_sync
+
+
+def claim_ids(conn: sqlite3.Connection, state: str, ids, moving_from: str = None) -> list[bool]:
+    """
+    Files each id under state unless it is already filed: under state (or earlier in ids), or under
+    any state other than moving_from. An id filed under moving_from is moved, i.e. no longer filed
+    there; with moving_from == state, ids already filed under state are accepted (new versions of
+    their rows). Runs inside the caller's transaction, so the claims can be rolled back together with
+    the writes they guard.
+
+    Returns:
+        list[bool]: For each id, whether it was filed (False: it is a conflict).
+    """
+    claimed = []
+    for id_text in ids:
+        id_text = str(id_text)
+        filed = {row[0] for row in conn.execute("SELECT state FROM processed_ids WHERE id_text = ?", (id_text,))}
+        if filed - {moving_from} or (state in filed and moving_from != state):
+            claimed.append(False)
+            continue
+        if moving_from not in (None, state):
+            conn.execute("DELETE FROM processed_ids WHERE id_text = ? AND state = ?", (id_text, moving_from))
+        conn.execute("INSERT OR IGNORE INTO processed_ids (id_text, state) VALUES (?, ?)", (id_text, state))
+        claimed.append(True)
+    return claimed
+
+
+def get_states(conn: sqlite3.Connection, ids) -> dict:
+    """Returns {id_text: state} for the ids that are indexed; an id filed under several states maps to
+    them all, comma-separated."""
+    ids = [str(id_text) for id_text in ids]
+    states = {}
+    for start in range(0, len(ids), 900): # stay under SQLite's bound-parameter limit
+        batch = ids[start:start + 900]
+        states.update(conn.execute(f"""SELECT id_text, group_concat(state, ',') FROM
+                                           (SELECT id_text, state FROM processed_ids WHERE id_text IN ({','.join('?' * len(batch))})
+                                            ORDER BY state)
+                                       GROUP BY id_text""", batch).fetchall())
+    return states
+
+
+def find_new(conn: sqlite3.Connection, ids) -> list[bool]:
+    """Returns, for each id in ids, whether it is absent from the index."""
+    ids = [str(id_text) for id_text in ids]
+    known = set()
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS probe (id_text TEXT)")
+    try:
+        for start in range(0, len(ids), _PROBE_BATCH_SIZE):
+            conn.execute("DELETE FROM probe")
+            conn.executemany("INSERT INTO probe (id_text) VALUES (?)",
+                             ((id_text,) for id_text in ids[start:start + _PROBE_BATCH_SIZE]))
+            known.update(row[0] for row in conn.execute(
+                "SELECT p.id_text FROM probe p JOIN processed_ids i ON i.id_text = p.id_text"))
+    finally:
+        conn.execute("DROP TABLE IF EXISTS probe")
+        conn.commit()
+    return [id_text not in known for id_text in ids]
+
+
+def count_ids(conn: sqlite3.Connection, state: str = None) -> int:
+    """Returns the number of indexed keys, optionally only those filed under state."""
+    if state is None:
+        return conn.execute("SELECT COUNT(DISTINCT id_text) FROM processed_ids").fetchone()[0]
+    return conn.execute("SELECT COUNT(*) FROM processed_ids WHERE state = ?", (state,)).fetchone()[0]
+
+
+def set_fingerprint(conn: sqlite3.Connection, state: str, fingerprint: str):
+    """Records that the index is in sync with state's dataset at fingerprint."""
+    conn.execute("INSERT OR REPLACE INTO synced_datasets (state, fingerprint) VALUES (?, ?)", (state, fingerprint))
@@ -0,0 +1,380 @@
+"""
+Local stand-in for the Google Custom Search JSON API and the Google results page, so the
+search pipeline can be run and load-tested offline.
+
+Responses are replayed from fixtures recorded with the `record` command (`<query>.json` for the
+Custom Search API and, with --serp, `<query>.html` for the results page) into fixtures/search/.
+Queries without a fixture get a deterministic synthetic response, so benchmarks run without any
+recorded fixture. Latency, server errors and 429s can be injected at configurable rates.
+
+Benchmarks run in a throwaway STORAGE_DIR holding a synthetic toSearch file, with Dropbox replaced
+by fake_dropbox.FakeDropbox, so they never touch the real datasets, errors.csv or Dropbox folder.
+
+Usage:
+    python3 mock_search_server.py serve --port 8765 --latency 0.2 --error-rate 0.02
+    python3 mock_search_server.py bench --target cse --rows 500 --latency 0.1
+    python3 mock_search_server.py record "Ngoyi Bukonda northern illinois university"
+    python3 mock_search_server.py record --serp "Ngoyi Bukonda northern illinois university"
+"""
+
+import os
+import json
+import time
+import random
+import hashlib
+import logging
+import argparse
+import tempfile
+import threading
+from contextlib import contextmanager
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import requests
+
+import config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'search')
+CSE_PATH = '/customsearch/v1'
+SERP_PATH = '/search'
+# Fixtures are always recorded from Google itself, never from a CSE_BASE_URL/GOOGLE_SEARCH_URL override
+LIVE_CSE_URL = 'https://www.googleapis.com/customsearch/v1'
+LIVE_SERP_URL = 'https://www.google.com/search'
+
+_SYNTHETIC_DEPARTMENTS = ['economics', 'history', 'chemistry', 'sociology', 'psychology',
+                          'mathematics', 'philosophy', 'biology', 'physics', 'linguistics']
+
+
+def fixture_name(search_query: str) -> str:
+    """Returns the fixture base name for a query (lower-cased form of the CSV naming in `cse.make_API_CALL`)."""
+    file_name = '_'.join(search_query.lower().split(" "))
+    return file_name.replace('/', '_').replace('\\', '_')
+
+
+def _synthetic_items(search_query: str, n_items: int = 4):
+    """Builds deterministic Custom Search style items for a query without a recorded fixture."""
+    seed = int(hashlib.sha1(search_query.encode('utf-8')).hexdigest(), 16)
+    department = _SYNTHETIC_DEPARTMENTS[seed % len(_SYNTHETIC_DEPARTMENTS)]
+    name = ' '.join(search_query.split()[:2]).title()
+    templates = [
+        (f"{name} - Faculty Profile", f"{name} is a professor in the department of {department}."),
+        (f"{name} | Research", f"Research interests: {department}, teaching and mentoring students."),
+        (f"{name} - Google Scholar", f"Cited by 1,204. {department.title()} professor."),
+        (f"{name} | LinkedIn", f"Associate professor of {department} with ten years of experience."),
+    ]
+    return [
+        {'title': title, 'snippet': snippet, 'link': f"https://example.edu/{fixture_name(search_query)}/{i}"}
+        for i, (title, snippet) in enumerate(templates[:n_items])
+    ]
+
+
+def _render_serp_html(items) -> str:
+    """Renders items with the same markup (class names) the Selenium scraper looks for."""
+    blocks = []
+    for item in items:
+        blocks.append(
+            '<div class="MjjYud"><div class="sATSHe">'
+            f'<div><span class="VuuXrf">{escape(item["link"])}</span></div>'
+            f'<span><a href="{escape(item["link"])}"><h3 class="LC20lb MBeuO DKV0Md">{escape(item["title"])}</h3></a></span>'
+            f'<div>{escape(item["snippet"])}</div>'
+            '</div></div>'
+        )
+    return f"<html><body><div id=\"search\">{''.join(blocks)}</div></body></html>"
+
+
+class MockSearchConfig:
+    """Fault-injection and fixture settings shared by all request handler threads."""
+    def __init__(self, fixtures_dir=DEFAULT_FIXTURES_DIR, latency=0.0, latency_jitter=0.0,
+                 error_rate=0.0, rate_limit_rate=0.0, seed=None):
+        self.fixtures_dir = fixtures_dir
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.status_counts = {}
+
+    def record_status(self, status: int):
+        with self.lock:
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+    def draw(self) -> float:
+        with self.lock:
+            return self.random.random()
+
+    def sleep(self):
+        if self.latency or self.latency_jitter:
+            with self.lock:
+                jitter = self.random.uniform(-self.latency_jitter, self.latency_jitter)
+            time.sleep(max(0.0, self.latency + jitter))
+
+
+class _MockSearchHandler(BaseHTTPRequestHandler):
+    config: MockSearchConfig = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        search_query = parse_qs(url.query).get('q', [''])[0]
+        config = self.config
+        config.sleep()
+
+        # Fault injection happens before fixture lookup so failures are spread evenly across queries
+        roll = config.draw()
+        if roll < config.rate_limit_rate:
+            return self._send(429, 'application/json', json.dumps({'error': {'code': 429, 'message': 'Rate Limit Exceeded'}}))
+        if roll < config.rate_limit_rate + config.error_rate:
+            return self._send(500, 'application/json', json.dumps({'error': {'code': 500, 'message': 'Backend Error'}}))
+
+        if url.path == CSE_PATH:
+            body = self._load_fixture(search_query, '.json')
+            if body is None:
+                body = json.dumps({'items': _synthetic_items(search_query)})
+            return self._send(200, 'application/json', body)
+        if url.path == SERP_PATH:
+            body = self._load_fixture(search_query, '.html')
+            if body is None:
+                body = _render_serp_html(_synthetic_items(search_query))
+            return self._send(200, 'text/html; charset=utf-8', body)
+        return self._send(404, 'text/plain', 'Not Found')
+
+    def _load_fixture(self, search_query, extension):
+        path = os.path.join(self.config.fixtures_dir, fixture_name(search_query) + extension)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def _send(self, status, content_type, body):
+        payload = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        self.config.record_status(status)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def start_server(host='127.0.0.1', port=0, **config_kwargs):
+    """Starts the mock server on a background thread. Returns the server; call `shutdown()` when done."""
+    config = MockSearchConfig(**config_kwargs)
+    handler = type('MockSearchHandler', (_MockSearchHandler,), {'config': config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.config = config
+    server.base_url = f"http://{host}:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Mock search server listening on {server.base_url}")
+    return server
+
+
+@contextmanager
+def replay_mode(base_url: str):
+    """Points `cse.BASE_URL` and the scraper's search URL at the mock server for the duration of the block."""
+    import cse
+    try:
+        import dess.search as search
+    except ImportError: # selenium not installed; only the Custom Search API path can be replayed
+        search = None
+
+    original_cse = cse.BASE_URL
+    cse.BASE_URL = base_url + CSE_PATH
+    if search is not None:
+        original_serp = search.GOOGLE_SEARCH_URL
+        search.GOOGLE_SEARCH_URL = base_url + SERP_PATH
+    try:
+        yield
+    finally:
+        cse.BASE_URL = original_cse
+        if search is not None:
+            search.GOOGLE_SEARCH_URL = original_serp
+
+
+def record_cse_fixture(search_query: str, fixtures_dir=DEFAULT_FIXTURES_DIR):
+    """Calls the real Custom Search API once and saves the JSON response as a replay fixture."""
+    import cse
+
+    response = requests.get(LIVE_CSE_URL, params=cse._build_payload(search_query, None))
+    if response.status_code != 200:
+        raise Exception(f"API call failed with status code: {response.status_code}")
+    os.makedirs(fixtures_dir, exist_ok=True)
+    path = os.path.join(fixtures_dir, fixture_name(search_query) + '.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(response.text)
+    return path
+
+
+def record_serp_fixture(driver, search_query: str, fixtures_dir=DEFAULT_FIXTURES_DIR):
+    """Loads the live Google results page with a Selenium driver and saves its HTML as a replay fixture."""
+    driver.get(f"{LIVE_SERP_URL}?q={search_query.replace(' ', '+')}")
+    os.makedirs(fixtures_dir, exist_ok=True)
+    path = os.path.join(fixtures_dir, fixture_name(search_query) + '.html')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(driver.page_source)
+    return path
+
+
+def _synthetic_frame(n_rows: int):
+    import pandas as pd
+
+    return pd.DataFrame({'id_text': [f"Test{i} Person{i} university of testing" for i in range(n_rows)]})
+
+
+@contextmanager
+def sandbox(n_rows: int):
+    """
+    Points STORAGE_DIR at a temporary directory (with a dataset/ folder, a toSearch file of n_rows
+    synthetic unprocessed rows and a copy of the department whitelist) and replaces the Dropbox client with a FakeDropbox for the duration
+    of the block. Yields the FakeDropbox, so callers can check what would have been uploaded.
+    """
+    import pickle
+    import shutil
+    import data_pipeline_manager as dpm
+    import google_api_workflow
+    import parquet_schema
+    import dess.nlp as nlp
+    from fake_dropbox import FakeDropbox
+
+    dbx = FakeDropbox()
+    whitelist = nlp.whitelist_path() if config.get('STORAGE_DIR') or nlp.KEYWORD_WHITELIST_FILE_PATH else None
+    # No daily quota or request rate: the mock server's latency and 429s are what is being measured
+    overrides = {'STORAGE_DIR': None, 'DROPBOX_FOLDER': '/DESS-benchmark', 'CSE_DAILY_QUOTA': '0',
+                 'CSE_REQUESTS_PER_MINUTE': '0'}
+    original_env = {name: os.environ.get(name) for name in overrides}
+    original_oauth = dpm.dropbox_oauth
+    with tempfile.TemporaryDirectory(prefix='dess-bench-') as storage_dir:
+        overrides['STORAGE_DIR'] = storage_dir
+        os.environ.update(overrides)
+        dpm.dropbox_oauth = lambda: dbx
+        try:
+            os.makedirs(os.path.join(storage_dir, 'dataset'))
+            to_search = _synthetic_frame(n_rows)
+            to_search['isProcessed'] = False
+            parquet_schema.write_table(to_search, google_api_workflow.FILE_PATH)
+            if nlp.KEYWORD_WHITELIST_FILE_PATH is None:
+                if whitelist and os.path.exists(whitelist):
+                    shutil.copy(whitelist, nlp.whitelist_path())
+                else: # no whitelist to copy: one that knows the synthetic responses' departments
+                    with open(nlp.whitelist_path(), 'wb') as f:
+                        pickle.dump({1: list(_SYNTHETIC_DEPARTMENTS), 2: [], 3: []}, f)
+            yield dbx
+        finally:
+            dpm.dropbox_oauth = original_oauth
+            for name, value in original_env.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+
+def benchmark(target: str = 'cse', n_rows: int = 100, driver_type: str = 'firefox', **config_kwargs):
+    """
+    Runs one pipeline stage against the mock server and reports throughput.
+
+    Args:
+        target (str): 'cse' (`cse.populate_rawText_col`), 'scraper' (`search.populate_raw_text`)
+            or 'workflow' (`google_api_workflow.end_to_end_workflow`, on the sandbox's toSearch file).
+        n_rows (int): Number of synthetic rows (the workflow processes at most ROWS_PER_DAY of them).
+
+    Returns:
+        dict: rows processed, elapsed seconds, rows/sec and response status counts.
+    """
+    server = start_server(**config_kwargs)
+    try:
+        with sandbox(n_rows), replay_mode(server.base_url):
+            start = time.time()
+            if target == 'cse':
+                import cse
+                df = cse.populate_rawText_col(_synthetic_frame(n_rows))
+            elif target == 'scraper':
+                import dess.search as search
+                df = _synthetic_frame(n_rows)
+                driver = search.setup_driver(driver_type)
+                try:
+                    df['rawText'] = search.populate_raw_text(df, driver, 4)
+                finally:
+                    driver.quit()
+            elif target == 'workflow':
+                import google_api_workflow
+                google_api_workflow.end_to_end_workflow()
+                df = None
+            else:
+                raise ValueError("Invalid benchmark target. Use 'cse', 'scraper' or 'workflow'.")
+            elapsed = time.time() - start
+    finally:
+        server.shutdown()
+
+    rows = len(df) if df is not None else sum(server.config.status_counts.values())
+    result = {
+        'target': target,
+        'rows': rows,
+        'elapsed_s': round(elapsed, 3),
+        'rows_per_s': round(rows / elapsed, 2) if elapsed else float('inf'),
+        'status_counts': dict(server.config.status_counts),
+    }
+    if df is not None:
+        result['failed_rows'] = int(df['rawText'].isna().sum())
+    return result
+
+
+def _add_fault_args(parser):
+    parser.add_argument("--fixtures-dir", default=DEFAULT_FIXTURES_DIR, help="Directory of recorded fixtures")
+    parser.add_argument("--latency", type=float, default=0.0, help="Mean response latency in seconds")
+    parser.add_argument("--latency-jitter", type=float, default=0.0, help="Uniform +/- jitter on latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 429")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducible fault injection")
+
+
+def _fault_kwargs(args):
+    return {'fixtures_dir': args.fixtures_dir, 'latency': args.latency, 'latency_jitter': args.latency_jitter,
+            'error_rate': args.error_rate, 'rate_limit_rate': args.rate_limit_rate, 'seed': args.seed}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Mock Custom Search / Google results server.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Run the mock server in the foreground")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    _add_fault_args(serve_parser)
+
+    bench_parser = subparsers.add_parser("bench", help="Benchmark a pipeline stage against the mock server")
+    bench_parser.add_argument("--target", choices=['cse', 'scraper', 'workflow'], default='cse')
+    bench_parser.add_argument("--rows", type=int, default=100)
+    bench_parser.add_argument("--driver", default='firefox')
+    _add_fault_args(bench_parser)
+
+    record_parser = subparsers.add_parser("record", help="Record a live Custom Search API response as a fixture")
+    record_parser.add_argument("query")
+    record_parser.add_argument("--fixtures-dir", default=DEFAULT_FIXTURES_DIR)
+    record_parser.add_argument("--serp", action="store_true", help="Record the Google results page (with Selenium) instead")
+    record_parser.add_argument("--driver", default='firefox')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "serve":
+        server = start_server(port=args.port, **_fault_kwargs(args))
+        print(f"Serving on {server.base_url} (CSE: {server.base_url}{CSE_PATH}, results page: {server.base_url}{SERP_PATH})")
+        print(f"Export CSE_BASE_URL={server.base_url}{CSE_PATH} GOOGLE_SEARCH_URL={server.base_url}{SERP_PATH} to replay")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+    elif args.command == "bench":
+        print(json.dumps(benchmark(args.target, args.rows, args.driver, **_fault_kwargs(args)), indent=2))
+    elif args.command == "record" and args.serp:
+        import dess.search as search
+        driver = search.setup_driver(args.driver)
+        try:
+            print(f"Saved {record_serp_fixture(driver, args.query, args.fixtures_dir)}")
+        finally:
+            driver.quit()
+    elif args.command == "record":
+        print(f"Saved {record_cse_fixture(args.query, args.fixtures_dir)}")
@@ -0,0 +1,143 @@
+"""
+On-disk schema for DESS Parquet files.
+
+- `rawText` is stored as an Arrow `list<string>` (not nested object arrays), and the fixed-width
+  `snippet_1..snippet_4` projections are derived from it in one place (`split_snippets`).
+- Low-cardinality text columns (university, department fields) are dictionary-encoded.
+- Files are zstd-compressed with bounded row groups.
+- Rows with `_deleted` set are tombstones: they remove their key from a partitioned dataset
+  (see data_pipeline_manager.remove_from_dataset).
+
+Usage (one-time migration of existing files or partitioned datasets):
+    python3 parquet_schema.py storage/complete.parquet storage/reprocess.parquet
+"""
+
+import os
+import sys
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+RAW_TEXT_TYPE = pa.list_(pa.string())
+SNIPPET_COUNT = 4
+SNIPPET_COLUMNS = [f'snippet_{i}' for i in range(1, SNIPPET_COUNT + 1)]
+DICTIONARY_COLUMNS = ['university', 'department', 'department_textual', 'department_keyword']
+COMPRESSION = 'zstd'
+ROW_GROUP_SIZE = 50_000
+DELETED_COLUMN = '_deleted'
+
+
+def to_table(df: pd.DataFrame) -> pa.Table:
+    """Converts a DataFrame to an Arrow table that follows the DESS schema."""
+    columns = {}
+    for col in df.columns:
+        if col == 'rawText':
+            columns[col] = raw_text_array(df[col])
+        else:
+            columns[col] = pa.array(df[col], from_pandas=True)
+    return conform_table(pa.table(columns))
+
+
+def conform_table(table: pa.Table) -> pa.Table:
+    """Casts rawText to list<string> and dictionary-encodes the dictionary columns of an Arrow table."""
+    for i, field in enumerate(table.schema):
+        column = table.column(i)
+        if field.name == 'rawText' and field.type != RAW_TEXT_TYPE:
+            table = table.set_column(i, field.name, column.cast(RAW_TEXT_TYPE))
+        elif field.name in DICTIONARY_COLUMNS and (pa.types.is_string(field.type) or pa.types.is_null(field.type)):
+            table = table.set_column(i, field.name, pc.dictionary_encode(column.cast(pa.string())))
+    return table
+
+
+def raw_text_array(raw_text: pd.Series) -> pa.Array:
+    """Converts a rawText column (lists, numpy arrays or None) to a list<string> array."""
+    return pa.array([None if value is None or (not hasattr(value, '__len__') and pd.isna(value)) else list(value)
+                     for value in raw_text], type=RAW_TEXT_TYPE)
+
+
+def write_table(df, file_path: str):
+    """Writes a DataFrame (or Arrow table) to Parquet with the DESS schema and storage settings."""
+    table = df if isinstance(df, pa.Table) else to_table(df)
+    pq.write_table(table, file_path, compression=COMPRESSION, row_group_size=ROW_GROUP_SIZE)
+
+
+def read_table(file_path: str, columns: list = None, filters=None) -> pa.Table:
+    """Reads a Parquet file as an Arrow table (memory-mapped; no pandas conversion)."""
+    return conform_table(pq.read_table(file_path, columns=columns, filters=filters, memory_map=True))
+
+
+def iter_batches(file_path: str, columns: list = None, batch_size: int = ROW_GROUP_SIZE):
+    """Yields Arrow record batches of a Parquet file, one row group's worth at a time."""
+    parquet_file = pq.ParquetFile(file_path, memory_map=True)
+    yield from parquet_file.iter_batches(batch_size=batch_size, columns=columns)
+
+
+def read_where(file_path: str, column: str, value, columns: list = None, limit: int = None) -> pa.Table:
+    """
+    Reads the rows where column == value, in file order. Row groups whose min/max statistics rule
+    the value out are skipped without being read, and reading stops once limit rows were found.
+    """
+    parquet_file = pq.ParquetFile(file_path, memory_map=True)
+    schema = parquet_file.metadata.schema
+    leaf = next(i for i in range(len(schema)) if schema.column(i).path == column)
+    read_columns = None if columns is None else list(columns) + ([column] if column not in columns else [])
+
+    tables, n_rows = [], 0
+    for i in range(parquet_file.num_row_groups):
+        statistics = parquet_file.metadata.row_group(i).column(leaf).statistics
+        if statistics is not None and statistics.has_min_max and not statistics.min <= value <= statistics.max:
+            continue
+        table = parquet_file.read_row_group(i, columns=read_columns)
+        table = table.filter(pc.equal(table[column], value))
+        tables.append(table)
+        n_rows += table.num_rows
+        if limit is not None and n_rows >= limit:
+            break
+
+    if not tables:
+        return parquet_file.schema_arrow.empty_table().select(read_columns or parquet_file.schema_arrow.names)
+    table = pa.concat_tables(tables)
+    return table.slice(0, limit) if limit is not None else table
+
+
+def snippet_arrays(raw_text, n: int = SNIPPET_COUNT) -> list:
+    """Projects a list<string> rawText array onto n fixed-width snippet arrays (null-padded)."""
+    if not isinstance(raw_text, (pa.Array, pa.ChunkedArray)):
+        raw_text = raw_text_array(raw_text)
+    fixed = pc.list_slice(raw_text.cast(RAW_TEXT_TYPE), 0, n, return_fixed_size_list=True)
+    return [pc.list_element(fixed, i) for i in range(n)]
+
+
+def split_snippets(raw_text: pd.Series, n: int = SNIPPET_COUNT) -> pd.DataFrame:
+    """Splits a rawText column into snippet_1..snippet_n columns (None where a row has fewer snippets)."""
+    arrays = snippet_arrays(raw_text, n)
+    # numpy arrays, not Series: a Series would be aligned on its own RangeIndex instead of raw_text's index
+    return pd.DataFrame({f'snippet_{i + 1}': array.to_numpy(zero_copy_only=False) for i, array in enumerate(arrays)},
+                        index=raw_text.index)
+
+
+def has_raw_text(raw_text: pd.Series) -> pd.Series:
+    """True for rows whose rawText holds at least one snippet."""
+    lengths = pc.list_value_length(raw_text_array(raw_text)).fill_null(0)
+    return pd.Series(lengths.to_numpy(zero_copy_only=False) > 0, index=raw_text.index)
+
+
+def migrate(path: str):
+    """Rewrites a Parquet file, or every part of a partitioned dataset, in the DESS schema."""
+    if os.path.isdir(path):
+        files = sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith('.parquet'))
+    else:
+        files = [path]
+    for file_path in files:
+        before = os.path.getsize(file_path)
+        table = conform_table(pq.read_table(file_path))
+        tmp_path = f"{file_path}.tmp-{os.getpid()}"
+        write_table(table, tmp_path)
+        os.replace(tmp_path, file_path)
+        print(f"MIGRATED: {file_path} ({before / 1e6:.1f} MB -> {os.path.getsize(file_path) / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        migrate(path)
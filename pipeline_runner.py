@@ -0,0 +1,295 @@
+"""
+Stage runner for the notebook workflow, with content-hash caching.
+
+Each stage wraps the existing functions of a notebook step and declares the artifacts (files or
+partitioned datasets under STORAGE_DIR) it reads and writes:
+
+    intake -> [scrape, outside the runner] -> merge -> extract -> stata, sample -> upload
+
+A stage is skipped when its fingerprint matches the one recorded in `pipeline_state.json` when it
+last ran and its outputs exist. The fingerprint covers
+- the content of its input artifacts (SHA-256 of the bytes; datasets hash their part files in order),
+- its parameters, e.g. the extraction ruleset version (nlp.ruleset_version()),
+- its code: the source of the stage function and of the modules it declares.
+So editing IGNORE_TERMS only redoes extract and the stages after it. A stage runs as soon as the
+stages producing its inputs are done; independent stages (stata and sample) run in parallel.
+
+Stages that update an artifact in place (extract rewrites complete.parquet) fingerprint it as it is
+after the run, so they don't invalidate themselves.
+
+Scraping is long-running and is done in a separate console (see README), so a run that had to redo
+intake stops there: the stages after it are held until the next run, and merge stays held until the
+scraper has marked uncomplete.parquet as scraped (dpm.is_scraped), so a partly scraped dataset is
+never filed.
+"""
+
+import os
+import sys
+import json
+import inspect
+import hashlib
+import datetime
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import config
+import data_pipeline_manager as dpm
+import dess.nlp as nlp
+
+# Paths derived from the environment, resolved when first used (see __getattr__)
+_ENV_PATHS = {
+    'STORAGE_DIR': lambda: config.storage_path(),
+    'STATE_FILE_PATH': lambda: config.storage_path('pipeline_state.json'),
+}
+STATA_FILE_NAME = "completed_DepartmenttoSearch_Dec2024.dta"
+SAMPLE_FILE_NAME = "sample.xlsx"
+_HASH_BLOCK_SIZE = 1 << 20
+
+
+def __getattr__(name):
+    if name in _ENV_PATHS:
+        return _ENV_PATHS[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _path(name):
+    return __getattr__(name)
+
+
+class Stage:
+    """
+    A pipeline step.
+
+    Args:
+        name (str): Stage name, used in the state file and by run(only=..., skip=..., force=...).
+        run (callable): Runs the step; takes no arguments and reads/writes its artifacts.
+        inputs (list): Paths of the artifacts it reads.
+        outputs (list): Paths of the artifacts it writes.
+        code (list): Names of the modules whose source is part of the fingerprint (they are not imported).
+        params (callable): Returns a JSON-serializable dict that is part of the fingerprint.
+        pause_after (str): If set, stages depending on this one don't run in a run where it ran;
+            the message says what has to happen in between.
+        waiting_for (callable): Returns None when the stage can run, or what it is still waiting for;
+            a waiting stage is held (with the stages depending on it) instead of run.
+    """
+    def __init__(self, name, run, inputs=(), outputs=(), code=(), params=None, pause_after=None, waiting_for=None):
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.code = list(code)
+        self.params = params
+        self.pause_after = pause_after
+        self.waiting_for = waiting_for
+
+
+def _intake():
+    df_u = dpm.get_new_rows()
+    if not len(df_u):
+        print("No new rows in input.dta")
+        return
+    dpm.write_to_file(dpm.UNCOMPLETE_FILE_PATH, dpm.prepare_dess_data_structure(df_u), overwrite=True)
+
+def _merge():
+    # complete/reprocess are not loaded: conflicts are caught by the id_text index. Filed rows are
+    # removed from uncomplete, so a row is never in two datasets
+    dpm.file_scraped_rows(dpm.read_dataset(dpm.UNCOMPLETE_FILE_PATH), source=dpm.UNCOMPLETE_FILE_PATH)
+
+def _unscraped():
+    if not dpm.is_scraped(dpm.UNCOMPLETE_FILE_PATH):
+        return "uncomplete.parquet is not fully scraped (python3 dess/search.py 0 --dataset <STORAGE_DIR>/uncomplete.parquet)"
+    return None
+
+def _extract():
+    df_c = dpm.read_dataset(dpm.COMPLETE_FILE_PATH)
+    nlp.extract_department_information(df_c)
+    dpm.write_to_file(dpm.COMPLETE_FILE_PATH, df_c, overwrite=True)
+
+def _stata():
+    dpm.create_stata_output_file(dpm.read_dataset(dpm.COMPLETE_FILE_PATH), STATA_FILE_NAME)
+
+def _sample():
+    dpm.generate_sample_output_file(SAMPLE_FILE_NAME)
+
+def _upload():
+    dpm.orchestrate_upload_workflow(overwrite=True)
+
+
+def build_stages() -> list:
+    """The workflow's stages, with their artifact paths resolved from the current environment."""
+    storage_dir = _path('STORAGE_DIR')
+    complete, reprocess, uncomplete = dpm.COMPLETE_FILE_PATH, dpm.REPROCESS_FILE_PATH, dpm.UNCOMPLETE_FILE_PATH
+    return [
+        # complete/reprocess are not inputs: merge rewrites them, and rows already filed there are
+        # excluded through the id_text index anyway
+        Stage('intake', _intake, inputs=[f"{storage_dir}/input.dta"], outputs=[uncomplete],
+              code=['data_pipeline_manager', 'entity_resolution'], pause_after="scrape uncomplete.parquet (python3 dess/search.py), then run the pipeline again"),
+        Stage('merge', _merge, inputs=[uncomplete], outputs=[complete, reprocess],
+              code=['data_pipeline_manager'], waiting_for=_unscraped),
+        Stage('extract', _extract, inputs=[complete, nlp.whitelist_path()],
+              outputs=[complete], code=['dess.nlp'], params=lambda: {'ruleset': nlp.ruleset_version()}),
+        Stage('stata', _stata, inputs=[complete], outputs=[f"{storage_dir}/{STATA_FILE_NAME}"],
+              code=['stata_writer', 'parquet_schema']),
+        Stage('sample', _sample, inputs=[complete], outputs=[f"{storage_dir}/{SAMPLE_FILE_NAME}"]),
+        Stage('upload', _upload, inputs=[f"{storage_dir}/{STATA_FILE_NAME}", f"{storage_dir}/{SAMPLE_FILE_NAME}",
+                                         complete, reprocess],
+              code=['dropbox_sync']),
+    ]
+
+
+def run(only=None, skip=(), force=(), max_workers: int = 4, stages=None, state_path: str = None) -> dict:
+    """
+    Runs the stages whose fingerprint changed, in dependency order.
+
+    Args:
+        only (list): Names of the stages to consider; all stages if None.
+        skip (list): Names of stages not to run (e.g. ['upload']). A skipped stage that is out of
+            date blocks the stages depending on it.
+        force (list): Names of stages to run even if their cached outputs are valid.
+        max_workers (int): Stages run at the same time at most.
+        stages (list): Stage definitions; build_stages() by default.
+        state_path (str): Fingerprint file; STATE_FILE_PATH by default.
+
+    Returns:
+        dict: Status per stage: 'ran', 'cached', 'skipped', 'stale' (skipped but out of date),
+        'held' (waiting for a pause_after step or its waiting_for condition), 'blocked' (a dependency failed or is stale) or 'failed'.
+        The first failure is re-raised once the running stages have finished.
+    """
+    stages = stages or build_stages()
+    state_path = state_path or _path('STATE_FILE_PATH')
+    selected = {stage.name for stage in stages if (only is None or stage.name in only) and stage.name not in skip}
+    dependencies = _dependencies(stages)
+    state = _load_state(state_path)
+    status, fingerprints, running, errors = {}, {}, {}, []
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while len(status) < len(stages):
+            for stage in stages:
+                if stage.name in status or stage.name in running.values() \
+                        or any(dep not in status for dep in dependencies[stage.name]):
+                    continue
+                upstream = {status[dep] for dep in dependencies[stage.name]}
+                if upstream & {'failed', 'blocked', 'stale'}:
+                    status[stage.name] = 'blocked'
+                    continue
+                if 'held' in upstream or any(status[dep] == 'ran' and _stage(stages, dep).pause_after
+                                             for dep in dependencies[stage.name]):
+                    status[stage.name] = 'held'
+                    continue
+
+                fingerprints[stage.name] = _fingerprint(stage, state['file_hashes'])
+                previous = state['stages'].get(stage.name, {}).get('fingerprint')
+                up_to_date = previous == fingerprints[stage.name] and all(os.path.exists(p) for p in stage.outputs)
+                if stage.name not in selected:
+                    status[stage.name] = 'skipped' if up_to_date else 'stale'
+                elif up_to_date and stage.name not in force:
+                    status[stage.name] = 'cached'
+                elif stage.waiting_for and (reason := stage.waiting_for()):
+                    print(f"HELD: {stage.name}: {reason}")
+                    status[stage.name] = 'held'
+                else:
+                    print(f"RUNNING: {stage.name} ({_stale_reason(state['stages'].get(stage.name), fingerprints[stage.name])})")
+                    running[executor.submit(stage.run)] = stage.name
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = _stage(stages, running.pop(future))
+                if future.exception() is not None:
+                    print(f"FAILED: {stage.name}: {future.exception()!r}")
+                    status[stage.name] = 'failed'
+                    errors.append(future.exception())
+                    continue
+                status[stage.name] = 'ran'
+                state['stages'][stage.name] = {'fingerprint': _after_run(stage, fingerprints[stage.name], state['file_hashes']),
+                                               'ran_at': datetime.datetime.now().isoformat(timespec='seconds')}
+                _save_state(state, state_path)
+                if stage.pause_after:
+                    print(f"PAUSED after {stage.name}: {stage.pause_after}")
+
+    print(status)
+    if errors:
+        raise errors[0]
+    return status
+
+
+def _dependencies(stages):
+    """A stage depends on the earlier stages that write one of its inputs."""
+    dependencies = {}
+    for i, stage in enumerate(stages):
+        dependencies[stage.name] = [earlier.name for earlier in stages[:i]
+                                    if set(earlier.outputs) & set(stage.inputs)]
+    return dependencies
+
+def _stage(stages, name):
+    return next(stage for stage in stages if stage.name == name)
+
+def _fingerprint(stage, file_hashes) -> dict:
+    """The components of a stage's fingerprint: input hashes, parameters and code hashes."""
+    code = {'run': _sha256(inspect.getsource(stage.run).encode('utf-8'))}
+    for module in stage.code:
+        with open(importlib.util.find_spec(module).origin, 'rb') as f:
+            code[module] = _sha256(f.read())
+    return {'inputs': {path: _artifact_hash(path, file_hashes) for path in stage.inputs},
+            'params': stage.params() if stage.params else {},
+            'code': code}
+
+def _after_run(stage, fingerprint, file_hashes):
+    """Re-hashes the inputs the stage updated in place, so its own write doesn't make it stale."""
+    fingerprint = dict(fingerprint, inputs=dict(fingerprint['inputs']))
+    for path in set(stage.inputs) & set(stage.outputs):
+        fingerprint['inputs'][path] = _artifact_hash(path, file_hashes)
+    return fingerprint
+
+def _stale_reason(previous, fingerprint):
+    """Short description of what changed since the stage last ran."""
+    if previous is None:
+        return "never ran"
+    previous = previous['fingerprint']
+    changed = [f"{kind} {name}" for kind in ('inputs', 'params', 'code')
+               for name in sorted(set(previous[kind]) | set(fingerprint[kind]))
+               if previous[kind].get(name) != fingerprint[kind].get(name)]
+    return ", ".join(os.path.basename(name) for name in changed) + " changed" if changed else "outputs missing or forced"
+
+def _artifact_hash(path, file_hashes):
+    """Content hash of a file or partitioned dataset (its part files in order); None if missing."""
+    if os.path.isdir(path):
+        parts = [_file_hash(part, file_hashes) for part in dpm.list_parts(path)]
+        return _sha256('|'.join(parts).encode('utf-8'))
+    if os.path.isfile(path):
+        return _file_hash(path, file_hashes)
+    return None
+
+def _file_hash(path, file_hashes):
+    """SHA-256 of a file, remembered by size and mtime so unchanged files are not read again."""
+    stat = os.stat(path)
+    stamp = f"{stat.st_size}:{stat.st_mtime_ns}"
+    cached = file_hashes.get(path)
+    if cached and cached['stamp'] == stamp:
+        return cached['sha256']
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    file_hashes[path] = {'stamp': stamp, 'sha256': digest.hexdigest()}
+    return digest.hexdigest()
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def _load_state(state_path):
+    if not os.path.exists(state_path):
+        return {'stages': {}, 'file_hashes': {}}
+    with open(state_path) as f:
+        return json.load(f)
+
+def _save_state(state, state_path):
+    tmp_path = f"{state_path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp_path, state_path)
+
+
+if __name__ == "__main__":
+    # python3 pipeline_runner.py [stage ...]: runs the given stages (all but upload by default)
+    run(only=sys.argv[1:] or None, skip=() if sys.argv[1:] else ('upload',))
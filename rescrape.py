@@ -0,0 +1,343 @@
+"""
+Staleness-aware re-scrape scheduler.
+
+Rows used to be scraped once: complete rows were never refreshed, and reprocess rows were retried
+by hand, all at once. A SQLite scrape log (`scrape_log.sqlite` in STORAGE_DIR) now keeps, per id_text,
+when its rawText was last fetched, when it was last attempted, its consecutive failures and a hash
+of its snippets, plus the number of re-scrapes made per day. Each run spends a daily capacity of
+searches on:
+- reprocess rows whose failure backoff has expired (BASE_BACKOFF_DAYS, doubling with every failure
+  up to MAX_BACKOFF_DAYS), fewest failures first, up to half of the capacity;
+- complete rows fetched at least MIN_AGE_DAYS ago, ranked by age times their observed change rate
+  ((changes + 1) / (re-scrapes + 2)), so rows whose results keep changing come back sooner than rows
+  that never change;
+with whatever one group doesn't use going to the other.
+
+Searches go through cse.fetch_rawText and so through the Custom Search API's shared daily quota and
+request rate (cse.acquire): a run never selects more rows than the quota has left, and rows it
+couldn't search because the quota ran out are not counted as attempts.
+
+Fresh snippets are compared with the stored ones by hash. Unchanged rows only update the log:
+no extraction and no dataset write. Changed rows (and reprocess rows that now have results) are
+re-extracted and filed in complete with data_pipeline_manager.file_scraped_rows (which removes
+recovered rows from reprocess), and only then logged as complete. Failed re-scrapes of complete
+rows keep their data.
+
+Rows the log hasn't seen yet are added when complete/reprocess change (tracked by fingerprint, as
+in id_index) and dated by the part file they are in: an upper bound on when they were fetched.
+
+Usage:
+    python3 rescrape.py [--capacity 20] [--fetch-workers 4] [--dry-run]
+"""
+
+import os
+import json
+import sqlite3
+import hashlib
+import argparse
+import datetime
+import config
+
+# pandas, data_pipeline_manager, the extraction rules and the search client are imported by the
+# functions that need them, so importing the module (e.g. from cron) stays cheap.
+
+DAILY_CAPACITY = 20      # searches per day; they share the Custom Search API quota with google_api_workflow
+FETCH_WORKERS = 4
+MIN_AGE_DAYS = 90        # complete rows younger than this are never re-scraped
+BASE_BACKOFF_DAYS = 7    # wait after the first failure, doubled after every further one
+MAX_BACKOFF_DAYS = 180
+STATES = ('complete', 'reprocess')
+_SKIPPED = object()
+
+
+def log_path() -> str:
+    return config.storage_path('scrape_log.sqlite')
+
+
+def open_log(path: str = None) -> sqlite3.Connection:
+    """Opens (creating if needed) the scrape log."""
+    conn = sqlite3.connect(path or log_path())
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"""CREATE TABLE IF NOT EXISTS scrape_log (
+                         id_text TEXT PRIMARY KEY,
+                         state TEXT NOT NULL CHECK (state IN {STATES}),
+                         fetched_at TEXT,
+                         last_attempt_at TEXT,
+                         retry_after TEXT,
+                         failures INTEGER NOT NULL DEFAULT 0,
+                         checks INTEGER NOT NULL DEFAULT 0,
+                         changes INTEGER NOT NULL DEFAULT 0,
+                         snippet_hash TEXT
+                     ) WITHOUT ROWID""")
+    conn.execute("CREATE INDEX IF NOT EXISTS scrape_log_by_state ON scrape_log (state, retry_after)")
+    conn.execute("""CREATE TABLE IF NOT EXISTS daily_attempts (
+                        day TEXT PRIMARY KEY,
+                        attempts INTEGER NOT NULL
+                    )""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS synced_datasets (
+                        state TEXT PRIMARY KEY,
+                        fingerprint TEXT NOT NULL
+                    )""")
+    conn.commit()
+    return conn
+
+
+def snippet_hash(raw_text) -> str:
+    """Hash of a rawText list, insensitive to case and whitespace but not to snippet order (extraction
+    reads snippets in order). None if raw_text has no snippets."""
+    if raw_text is None or len(raw_text) == 0:
+        return None
+    snippets = [' '.join(str(snippet).split()).lower() for snippet in raw_text]
+    return hashlib.sha1(json.dumps(snippets).encode('utf-8')).hexdigest()
+
+
+def sync(conn: sqlite3.Connection):
+    """Adds the complete/reprocess rows the log hasn't seen, for each dataset that changed since the last sync.
+    A logged reprocess row found in complete is moved there (it was scraped successfully elsewhere)."""
+    import data_pipeline_manager as dpm
+    for state, dataset_path in (('reprocess', dpm.REPROCESS_FILE_PATH), ('complete', dpm.COMPLETE_FILE_PATH)):
+        fingerprint = dpm.dataset_fingerprint(dataset_path)
+        if _get_fingerprint(conn, state) == fingerprint:
+            continue
+        print(f"SYNCING SCRAPE LOG: {dataset_path}")
+        parts = dpm.list_parts(dataset_path)
+        with conn:
+            for part in parts:
+                written_at = _part_time(part)
+                ids = dpm.read_part(part, ['id_text']).to_pandas()
+                if dpm.DELETED_COLUMN in ids: # tombstones of rows removed from the dataset
+                    ids = ids[~ids[dpm.DELETED_COLUMN].eq(True)]
+                ids = ids['id_text'].tolist()
+                if state == 'complete':
+                    conn.executemany("""INSERT INTO scrape_log (id_text, state, fetched_at) VALUES (?, 'complete', ?)
+                                        ON CONFLICT (id_text) DO UPDATE SET state = 'complete', fetched_at = excluded.fetched_at,
+                                            failures = 0, retry_after = NULL
+                                        WHERE scrape_log.state != 'complete'""",
+                                     ((str(id_text), written_at) for id_text in ids))
+                else:
+                    retry_after = _retry_after(datetime.datetime.fromisoformat(written_at), 1)
+                    conn.executemany("""INSERT OR IGNORE INTO scrape_log (id_text, state, last_attempt_at, retry_after, failures)
+                                        VALUES (?, 'reprocess', ?, ?, 1)""",
+                                     ((str(id_text), written_at, retry_after) for id_text in ids))
+            _set_fingerprint(conn, state, fingerprint)
+
+
+def select_candidates(conn: sqlite3.Connection, capacity: int = DAILY_CAPACITY, now: datetime.datetime = None) -> list:
+    """
+    The rows to re-scrape now, as (id_text, state), within what is left of today's capacity.
+
+    Returns:
+        list[tuple[str, str]]: Overdue reprocess rows (up to half of the capacity) and stale complete
+            rows, highest priority first.
+    """
+    now = now or _now()
+    # Only re-scrapes count (see _count_attempt), not the rows sync dated today
+    row = conn.execute("SELECT attempts FROM daily_attempts WHERE day = ?", (now.date().isoformat(),)).fetchone()
+    remaining = max(capacity - (row[0] if row else 0), 0)
+    if not remaining:
+        return []
+
+    retries = conn.execute("""SELECT id_text FROM scrape_log
+                              WHERE state = 'reprocess' AND (retry_after IS NULL OR retry_after <= ?)
+                              ORDER BY failures, last_attempt_at LIMIT ?""", (now.isoformat(), remaining)).fetchall()
+    stale_before = (now - datetime.timedelta(days=MIN_AGE_DAYS)).isoformat()
+    refreshes = conn.execute("""SELECT id_text FROM scrape_log
+                                WHERE state = 'complete' AND fetched_at <= ? AND (retry_after IS NULL OR retry_after <= ?)
+                                ORDER BY (julianday(?) - julianday(fetched_at)) * (changes + 1.0) / (checks + 2.0) DESC
+                                LIMIT ?""", (stale_before, now.isoformat(), now.isoformat(), remaining)).fetchall()
+
+    n_retries = min(len(retries), max(remaining // 2, remaining - len(refreshes)))
+    n_refreshes = min(len(refreshes), remaining - n_retries)
+    return ([(row[0], 'reprocess') for row in retries[:n_retries]]
+            + [(row[0], 'complete') for row in refreshes[:n_refreshes]])
+
+
+def scrape_outcome(conn: sqlite3.Connection, id_text: str, state: str, new_hash: str, old_hash: str = None) -> str:
+    """The outcome of a scrape of id_text (see record_attempt), without logging it."""
+    if new_hash is None:
+        return 'failed'
+    if state == 'reprocess':
+        return 'recovered'
+    row = conn.execute("SELECT snippet_hash FROM scrape_log WHERE id_text = ?", (id_text,)).fetchone()
+    return 'unchanged' if new_hash == ((row[0] if row else None) or old_hash) else 'changed'
+
+
+def record_attempt(conn: sqlite3.Connection, id_text: str, state: str, new_hash: str, old_hash: str = None,
+                   now: datetime.datetime = None) -> str:
+    """
+    Logs one scrape of id_text. new_hash is the snippet_hash of the fresh results (None if the scrape
+    failed), old_hash that of the stored ones if the log doesn't have it yet. A 'changed' or 'recovered'
+    row is logged as complete, so call this for it only once it was filed in complete (see run).
+
+    Returns:
+        str: 'failed', 'unchanged', 'changed', or 'recovered' (a reprocess row that now has results).
+    """
+    now = now or _now()
+    outcome = scrape_outcome(conn, id_text, state, new_hash, old_hash)
+    row = conn.execute("SELECT failures FROM scrape_log WHERE id_text = ?", (id_text,)).fetchone()
+    failures = row[0] if row else 0
+    with conn:
+        _count_attempt(conn, now)
+        if new_hash is None:
+            conn.execute("""INSERT INTO scrape_log (id_text, state, last_attempt_at, retry_after, failures) VALUES (?, ?, ?, ?, ?)
+                            ON CONFLICT (id_text) DO UPDATE SET last_attempt_at = excluded.last_attempt_at,
+                                retry_after = excluded.retry_after, failures = excluded.failures""",
+                         (id_text, state, now.isoformat(), _retry_after(now, failures + 1), failures + 1))
+            return 'failed'
+
+        conn.execute("""INSERT INTO scrape_log (id_text, state, fetched_at, last_attempt_at, snippet_hash) VALUES (?, 'complete', ?, ?, ?)
+                        ON CONFLICT (id_text) DO UPDATE SET state = 'complete', fetched_at = excluded.fetched_at,
+                            last_attempt_at = excluded.last_attempt_at, retry_after = NULL, failures = 0,
+                            snippet_hash = excluded.snippet_hash,
+                            checks = checks + (scrape_log.state = 'complete'), changes = changes + ?""",
+                     (id_text, now.isoformat(), now.isoformat(), new_hash, int(outcome == 'changed')))
+    return outcome
+
+
+def record_unfiled(conn: sqlite3.Connection, id_text: str, now: datetime.datetime = None):
+    """Logs a successful scrape of a row that could not be filed (it is no longer in its dataset): its state
+    and data stay as they are, and it isn't selected again before BASE_BACKOFF_DAYS."""
+    now = now or _now()
+    with conn:
+        _count_attempt(conn, now)
+        conn.execute("UPDATE scrape_log SET last_attempt_at = ?, retry_after = ? WHERE id_text = ?",
+                     (now.isoformat(), _retry_after(now, 1), id_text))
+
+
+def run(capacity: int = DAILY_CAPACITY, fetch=None, fetch_workers: int = FETCH_WORKERS, dry_run: bool = False) -> dict:
+    """
+    Re-scrapes today's candidates with fetch (id_text -> rawText or None; cse.fetch_rawText by default,
+    which may raise cse.QuotaExceeded) and files the rows whose results changed.
+
+    Returns:
+        dict: Number of rows per outcome (see record_attempt, plus 'unfiled' for rows that were no longer
+            in their dataset and 'skipped' for rows left unsearched by the quota), or the candidates if dry_run.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import cse
+    conn = open_log()
+    try:
+        sync(conn)
+        candidates = select_candidates(conn, capacity)
+        quota = cse.remaining_quota()
+        if quota is not None and len(candidates) > quota:
+            print(f"Custom Search API quota: {quota} searches left today for {len(candidates)} candidates")
+            candidates = candidates[:quota]
+        if dry_run:
+            for id_text, state in candidates:
+                print(f"{state:<10} {id_text}")
+            return {'candidates': len(candidates)}
+        if not candidates:
+            print("Nothing to re-scrape today")
+            return {}
+
+        fetch = fetch or cse.fetch_rawText
+        records = _read_records(candidates)
+
+        def search(id_text):
+            try:
+                return fetch(id_text)
+            except cse.QuotaExceeded: # used up by another job since the candidates were chosen
+                return _SKIPPED
+        with ThreadPoolExecutor(max_workers=fetch_workers) as pool:
+            results = list(pool.map(search, [id_text for id_text, _ in candidates]))
+
+        outcomes, refreshed = {}, []
+        for (id_text, state), raw_text in zip(candidates, results):
+            if raw_text is _SKIPPED:
+                outcome = 'skipped'
+            else:
+                stored = records.get(id_text)
+                old_hash = snippet_hash(stored['rawText']) if stored is not None and state == 'complete' else None
+                new_hash = snippet_hash(raw_text)
+                outcome = scrape_outcome(conn, id_text, state, new_hash, old_hash)
+                if outcome in ('failed', 'unchanged'):
+                    record_attempt(conn, id_text, state, new_hash, old_hash)
+                elif stored is None:
+                    outcome = 'unfiled'
+                    record_unfiled(conn, id_text)
+                else: # logged once filed
+                    refreshed.append(({**stored, 'id_text': id_text, 'rawText': list(raw_text)}, state, new_hash, old_hash))
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+        if refreshed:
+            _file_refreshed_rows(conn, [row for row, *_ in refreshed], [state for _, state, *_ in refreshed])
+            for row, state, new_hash, old_hash in refreshed:
+                record_attempt(conn, row['id_text'], state, new_hash, old_hash)
+    finally:
+        conn.close()
+
+    print(f"Re-scraped {len(candidates)} rows: {outcomes}")
+    return outcomes
+
+
+def _read_records(candidates):
+    """Stored rows of the candidates, by id_text."""
+    import data_pipeline_manager as dpm
+    records = {}
+    for state, dataset_path in (('reprocess', dpm.REPROCESS_FILE_PATH), ('complete', dpm.COMPLETE_FILE_PATH)):
+        ids = [id_text for id_text, candidate_state in candidates if candidate_state == state]
+        if ids and os.path.exists(dataset_path):
+            df = dpm.read_rows(dataset_path, ids)
+            records.update((id_text, row) for id_text, row in zip(df.index, df.to_dict('records')))
+    return records
+
+
+def _file_refreshed_rows(conn, refreshed, states):
+    """Re-extracts the rows with new results and files them in complete: changed rows as new versions
+    (the latest version of a row wins), recovered rows moved out of reprocess."""
+    import pandas as pd
+    import dess.nlp as nlp
+    import data_pipeline_manager as dpm
+    df = pd.DataFrame(refreshed)
+    nlp.extract_department_information(df)
+
+    paths = {'complete': dpm.COMPLETE_FILE_PATH, 'reprocess': dpm.REPROCESS_FILE_PATH}
+    in_sync = {state: _get_fingerprint(conn, state) == dpm.dataset_fingerprint(path) for state, path in paths.items()}
+    states = pd.Series(states, index=df.index)
+    for state in ('reprocess', 'complete'):
+        if (states == state).any():
+            dpm.file_scraped_rows(df[states == state], source=paths[state])
+    with conn: # the log already has these rows
+        for state, path in paths.items():
+            if in_sync[state]:
+                _set_fingerprint(conn, state, dpm.dataset_fingerprint(path))
+
+
+def _retry_after(attempted_at, failures):
+    days = min(BASE_BACKOFF_DAYS * 2 ** (failures - 1), MAX_BACKOFF_DAYS)
+    return (attempted_at + datetime.timedelta(days=days)).isoformat()
+
+def _part_time(part_path):
+    """When a part was written: the nanosecond timestamp in its name, or the file's mtime."""
+    name = os.path.basename(part_path)
+    stamp = name.split('-')[1] if name.startswith('part-') else ''
+    ns = int(stamp) if stamp.isdigit() else os.stat(part_path).st_mtime_ns
+    return datetime.datetime.fromtimestamp(ns / 1e9, datetime.timezone.utc).isoformat()
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+def _count_attempt(conn, now):
+    """Adds a re-scrape to now's day in daily_attempts (inside the caller's transaction)."""
+    conn.execute("""INSERT INTO daily_attempts (day, attempts) VALUES (?, 1)
+                    ON CONFLICT (day) DO UPDATE SET attempts = attempts + 1""", (now.date().isoformat(),))
+
+def _get_fingerprint(conn, state):
+    row = conn.execute("SELECT fingerprint FROM synced_datasets WHERE state = ?", (state,)).fetchone()
+    return row[0] if row else None
+
+def _set_fingerprint(conn, state, fingerprint):
+    conn.execute("INSERT OR REPLACE INTO synced_datasets (state, fingerprint) VALUES (?, ?)", (state, fingerprint))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-scrapes the stale complete rows and the reprocess rows due for a retry.")
+    parser.add_argument("--capacity", type=int, default=DAILY_CAPACITY, help="Searches per day")
+    parser.add_argument("--fetch-workers", type=int, default=FETCH_WORKERS, help="Concurrent searches")
+    parser.add_argument("--dry-run", action="store_true", help="Only print today's candidates")
+    args = parser.parse_args(argv)
+    run(args.capacity, fetch_workers=args.fetch_workers, dry_run=args.dry_run)
+
+if __name__ == "__main__":
+    main()
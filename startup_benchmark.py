@@ -0,0 +1,88 @@
+"""
+Startup-time benchmark for the CLI entry points.
+
+Each entry point is imported in a fresh interpreter (as cron and the short-lived workers start it)
+and two things are checked:
+- none of the heavy backends it is not supposed to load at import time shows up in sys.modules
+  (pandas, pyarrow, the Dropbox SDK, Selenium, requests, the Gemini SDK, ...);
+- the median import time stays within its budget.
+
+Usage:
+    python3 startup_benchmark.py [--runs 5] [--budget-scale 1.0]
+
+Exits with status 1 if an entry point loads a forbidden module or exceeds its budget, and prints
+the slowest imports (from `python -X importtime`) of the offending entry point.
+"""
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+# entry point -> (modules it must not load at import time, import-time budget in ms)
+ENTRY_POINTS = {
+    'google_api_workflow': (['pandas', 'pyarrow', 'numpy', 'dropbox', 'requests', 'tqdm'], 100),
+    'stata_conversion': (['pandas', 'pyarrow', 'numpy', 'dropbox', 'requests', 'tqdm'], 100),
+    'rescrape': (['pandas', 'pyarrow', 'numpy', 'dropbox', 'requests', 'tqdm'], 100),
+    'dess.search': (['pandas', 'pyarrow', 'selenium', 'dropbox'], 100),
+    'dess.llms.llm_factory': (['google.generativeai', 'pandas', 'dropbox'], 150),
+}
+_PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+print(json.dumps({{'ms': (time.perf_counter() - start) * 1000, 'modules': sorted(sys.modules)}}))
+"""
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def measure(module: str, runs: int = 5) -> dict:
+    """Imports module in runs fresh interpreters; returns the median time (ms) and the modules loaded."""
+    timings, modules = [], set()
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-c', _PROBE.format(module=module)], cwd=ROOT_DIR,
+                                capture_output=True, text=True, check=True)
+        probe = json.loads(result.stdout.strip().splitlines()[-1])
+        timings.append(probe['ms'])
+        modules.update(probe['modules'])
+    return {'ms': statistics.median(timings), 'modules': modules}
+
+
+def slowest_imports(module: str, n: int = 10) -> list:
+    """The n imports with the highest cumulative time, from `python -X importtime`."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=ROOT_DIR,
+                            capture_output=True, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative) / 1000, name.rstrip()))
+    return sorted(rows, reverse=True)[:n]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Checks the import time and footprint of the CLI entry points.")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per entry point")
+    parser.add_argument("--budget-scale", type=float, default=1.0, help="Multiplier for the budgets (slow machines)")
+    args = parser.parse_args(argv)
+
+    failed = False
+    for module, (forbidden, budget_ms) in ENTRY_POINTS.items():
+        result = measure(module, args.runs)
+        loaded = [name for name in forbidden if name in result['modules']]
+        over_budget = result['ms'] > budget_ms * args.budget_scale
+        ok = not loaded and not over_budget
+        print(f"{'OK  ' if ok else 'FAIL'} {module:<25} {result['ms']:7.1f} ms (budget {budget_ms * args.budget_scale:.0f} ms)"
+              + (f", loads {', '.join(loaded)}" if loaded else ""))
+        if not ok:
+            failed = True
+            for ms, name in slowest_imports(module):
+                print(f"       {ms:7.1f} ms {name}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,377 @@
+"""
+Streaming export of Parquet data to Stata 118 (.dta) files.
+
+The Stata schema (variable types and fixed string widths) is computed first, in a pass that
+reads only the string and integer columns. Then the rows are written one record batch at a time,
+so memory stays flat no matter how large the dataset is. String columns are sanitized with Arrow
+kernels, one vectorized pass per column: ASCII-fold (NFKD, drop non-ASCII), collapse whitespace,
+truncate to 244 characters.
+
+Type mapping: bool/int8 -> byte, int16 -> int, int32 -> long, int64 -> long (double if a value
+doesn't fit), floats and decimals -> double, strings -> strN, timestamps -> double in %tc
+(milliseconds since 1960, wall-clock time for time zone aware columns), dates -> long in %td (days
+since 1960). Columns of other types (lists, structs, binary, ...) are left out with a warning. Nulls
+are written as Stata missing (. or "").
+
+Column names that aren't valid Stata names are renamed the way pandas.DataFrame.to_stata does:
+invalid characters become '_', names starting with a digit or that are reserved words get a '_'
+prefix, names are cut to 32 characters and clashes get a '_<n>' prefix.
+
+Usage:
+    stata_writer.export_parquet(['a.parquet', 'b.parquet'], 'out.dta', required_columns=['snippet_1'])
+"""
+
+import os
+import re
+import struct
+import datetime
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+STATA_STR_MAX = 244
+BATCH_SIZE = 50_000
+
+# Stata 118 type codes, missing values and valid ranges
+_BYTE, _INT, _LONG, _DOUBLE = 65530, 65529, 65528, 65526
+_NUMERIC = {
+    _BYTE: ('<i1', 101, (-127, 100), '%8.0g'),
+    _INT: ('<i2', 32741, (-32767, 32740), '%8.0g'),
+    _LONG: ('<i4', 2147483621, (-2147483647, 2147483620), '%12.0g'),
+    _DOUBLE: ('<f8', 2.0 ** 1023, None, '%10.0g'),
+}
+_VALID_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]{0,31}$')
+_RESERVED_WORDS = {'aggregate', 'array', 'boolean', 'break', 'byte', 'case', 'catch', 'class', 'colvector',
+                   'complex', 'const', 'continue', 'default', 'delegate', 'delete', 'do', 'double', 'else',
+                   'eltypedef', 'end', 'enum', 'explicit', 'export', 'external', 'float', 'for', 'friend',
+                   'function', 'global', 'goto', 'if', 'inline', 'int', 'local', 'long', 'NULL', 'pragma',
+                   'protected', 'quad', 'rowvector', 'short', 'typedef', 'typename', 'virtual', '_all', '_N',
+                   '_skip', '_b', '_pi', 'str#', 'in', '_pred', 'strL', '_coef', '_rc', 'using', '_cons', '_se',
+                   'with', '_n'}
+_STATA_EPOCH_MS = 315_619_200_000 # 1970-01-01 - 1960-01-01, in milliseconds
+_STATA_EPOCH_DAYS = 3_653
+
+
+def sanitize_strings(array) -> pa.Array:
+    """ASCII-folds, collapses whitespace and truncates a string array to 244 characters. Nulls become ''."""
+    array = pc.cast(array, pa.string()) if not pa.types.is_string(array.type) else array
+    array = pc.utf8_normalize(array, form='NFKD')
+    array = pc.replace_substring_regex(array, pattern=r'[^\x20-\x7E\t\n\r\f\v]+', replacement='')
+    array = pc.replace_substring_regex(array, pattern=r'\s+', replacement=' ')
+    array = pc.utf8_slice_codeunits(array, 0, STATA_STR_MAX)
+    return pc.fill_null(array, '')
+
+
+def stata_names(names: list) -> list:
+    """Valid, distinct Stata variable names for names (renamed as pandas.DataFrame.to_stata does)."""
+    names = [str(name) for name in names]
+    taken = {name for name in names if _VALID_NAME.match(name) and name not in _RESERVED_WORDS}
+    renamed = []
+    for name in names:
+        if name in taken:
+            renamed.append(name)
+            continue
+        new = re.sub(r'[^A-Za-z0-9_]', '_', name) or '_'
+        if new in _RESERVED_WORDS or new[0].isdigit():
+            new = '_' + new
+        base, new, duplicate = new, new[:32], 0
+        while new in taken:  # valid names keep theirs; a renamed column that clashes gets a '_<n>' prefix
+            new = f'_{duplicate}{base}'[:32]
+            duplicate += 1
+        taken.add(new)
+        renamed.append(new)
+    return renamed
+
+
+def export_parquet(parquet_files: list, stata_file_path: str, columns: list = None, required_columns: list = (),
+                   batch_size: int = BATCH_SIZE) -> int:
+    """
+    Streams Parquet files into one Stata file.
+
+    Args:
+        parquet_files (list): Source files; their schemas are unified (missing columns become missing values).
+        columns (list): Columns to export, in order. All columns of the unified schema if None.
+        required_columns (list): Rows with a null in any of these columns are skipped.
+        batch_size (int): Rows held in memory at a time.
+
+    Returns:
+        int: Number of rows written.
+    """
+    schema = _unified_schema(parquet_files, columns)
+
+    def batches(columns):
+        for file_path in parquet_files:
+            parquet_file = pq.ParquetFile(file_path, memory_map=True)
+            available = set(parquet_file.schema_arrow.names)
+            read_columns = [col for col in set(columns) | set(required_columns) if col in available]
+            for batch in parquet_file.iter_batches(batch_size=batch_size, columns=read_columns):
+                yield _select_rows(batch, schema, columns, required_columns)
+
+    return _export(batches, schema, stata_file_path)
+
+
+def export_table(table: pa.Table, stata_file_path: str, batch_size: int = BATCH_SIZE) -> int:
+    """Writes an in-memory Arrow table to a Stata file, batch by batch. Returns the number of rows written."""
+    schema = _plain_schema(table.schema)
+
+    def batches(columns):
+        for batch in table.select(columns).to_batches(max_chunksize=batch_size):
+            yield _select_rows(batch, schema, columns, ())
+
+    return _export(batches, schema, stata_file_path)
+
+
+def _export(batches, schema, stata_file_path):
+    """Plans the Stata variables from a scan of the data, then writes every batch."""
+    schema = _exportable_schema(schema)
+    scanned = [field.name for field in schema if _is_string(field.type) or pa.types.is_integer(field.type)]
+    widths, ranges = {}, {}
+    for batch in batches(scanned):
+        for name in scanned:
+            column = batch.column(name)
+            if _is_string(column.type):
+                width = pc.max(pc.binary_length(sanitize_strings(column))).as_py() or 0
+                widths[name] = max(widths.get(name, 1), width)
+            else:
+                low, high = pc.min_max(column).values()
+                if low.is_valid:
+                    previous = ranges.get(name, (low.as_py(), high.as_py()))
+                    ranges[name] = (min(previous[0], low.as_py()), max(previous[1], high.as_py()))
+
+    names = stata_names(schema.names)
+    for old, new in zip(schema.names, names):
+        if old != new:
+            print(f"Renamed column {old} to {new} (not a valid Stata variable name)")
+    variables = [(new, *_plan_variable(field, widths, ranges)) for new, field in zip(names, schema)]
+    # Write next to the destination and rename, so a failed export never leaves a truncated .dta file
+    tmp_path = f"{stata_file_path}.tmp-{os.getpid()}"
+    try:
+        with StataWriter(tmp_path, variables) as writer:
+            for batch in batches(schema.names):
+                writer.write_batch(batch)
+        os.replace(tmp_path, stata_file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    print(f"Wrote {writer.n_rows} rows to {stata_file_path}")
+    return writer.n_rows
+
+
+def _plan_variable(field, widths, ranges):
+    """Picks the Stata type and display format of a column: (type code, format)."""
+    if _is_string(field.type) or pa.types.is_null(field.type):
+        code = max(1, widths.get(field.name, 1))
+        return code, _format(code)
+    if pa.types.is_boolean(field.type):
+        return _BYTE, _format(_BYTE)
+    if pa.types.is_integer(field.type):
+        low, high = ranges.get(field.name, (0, 0))
+        for code in (_BYTE, _INT, _LONG):
+            valid = _NUMERIC[code][2]
+            if valid[0] <= low and high <= valid[1]:
+                return code, _format(code)
+        return _DOUBLE, _format(_DOUBLE)
+    if pa.types.is_timestamp(field.type):
+        return _DOUBLE, '%tc'
+    if pa.types.is_date(field.type):
+        return _LONG, '%td'
+    return _DOUBLE, _format(_DOUBLE) # floats and decimals (see _exportable_schema)
+
+
+def _exportable_schema(schema):
+    """schema without the columns whose type has no Stata counterpart (printing a warning for each)."""
+    fields = []
+    for field in schema:
+        if (_is_string(field.type) or pa.types.is_null(field.type) or pa.types.is_boolean(field.type)
+                or pa.types.is_integer(field.type) or pa.types.is_floating(field.type)
+                or pa.types.is_decimal(field.type) or pa.types.is_timestamp(field.type) or pa.types.is_date(field.type)):
+            fields.append(field)
+        else:
+            print(f"Skipping column {field.name}: type {field.type} cannot be exported to Stata")
+    return pa.schema(fields)
+
+
+class StataWriter:
+    """
+    Writes a Stata 118 file incrementally. The header is written with a row count of 0 and the
+    section map is left blank; both are patched in when the writer is closed.
+
+    Args:
+        variables (list[tuple]): (name, Stata type code) or (name, type code, display format) per
+            variable. String variables use their width (1-2045) as the type code. Names must be valid
+            Stata names (see stata_names).
+    """
+    def __init__(self, file_path: str, variables: list, data_label: str = ''):
+        for name, *_ in variables:
+            if not _VALID_NAME.match(name):
+                raise ValueError(f"Invalid Stata variable name: {name}")
+        self.file_path = file_path
+        self.variables = [(name, code) for name, code, *_ in variables]
+        self._formats = [fmt[0] if fmt else _format(code) for _, code, *fmt in variables]
+        self.n_rows = 0
+        self._dtype = np.dtype([(f'v{i}', f'S{code}' if code <= 2045 else _NUMERIC[code][0])
+                                for i, (_, code) in enumerate(self.variables)])
+        self._file = open(file_path, 'wb')
+        self._offsets = {'stata_data': 0}
+        self._write_header(data_label)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write_batch(self, batch: pa.RecordBatch):
+        """Appends the rows of batch; its columns must be in the order of the writer's variables."""
+        records = np.zeros(batch.num_rows, dtype=self._dtype)
+        for i, (_, code) in enumerate(self.variables):
+            records[f'v{i}'] = _encode(batch.column(i), code)
+        self._file.write(records.tobytes())
+        self.n_rows += batch.num_rows
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.write(b'</data>')
+        self._section('strls', b'')
+        self._section('value_labels', b'')
+        self._offsets['stata_data_close'] = self._file.tell()
+        self._file.write(b'</stata_dta>')
+        self._offsets['end_of_file'] = self._file.tell()
+
+        self._file.seek(self._n_position)
+        self._file.write(struct.pack('<Q', self.n_rows))
+        self._file.seek(self._offsets['map'] + len(b'<map>'))
+        self._file.write(struct.pack('<14Q', *(self._offsets[name] for name in _MAP_SECTIONS)))
+        self._file.close()
+
+    def _write_header(self, data_label):
+        k = len(self.variables)
+        label = data_label.encode('utf-8')[:80]
+        timestamp = datetime.datetime.now().strftime('%d %b %Y %H:%M').encode('ascii')
+        f = self._file
+        f.write(b'<stata_dta><header><release>118</release><byteorder>LSF</byteorder>')
+        f.write(b'<K>' + struct.pack('<H', k) + b'</K><N>')
+        self._n_position = f.tell()
+        f.write(struct.pack('<Q', 0) + b'</N>')
+        f.write(b'<label>' + struct.pack('<H', len(label)) + label + b'</label>')
+        f.write(b'<timestamp>' + struct.pack('<B', len(timestamp)) + timestamp + b'</timestamp></header>')
+        self._section('map', struct.pack('<14Q', *([0] * 14)))
+        self._section('variable_types', b''.join(struct.pack('<H', code) for _, code in self.variables))
+        self._section('varnames', b''.join(_padded(name, 129) for name, _ in self.variables))
+        self._section('sortlist', struct.pack(f'<{k + 1}H', *([0] * (k + 1))))
+        self._section('formats', b''.join(_padded(fmt, 57) for fmt in self._formats))
+        self._section('value_label_names', _padded('', 129) * k)
+        self._section('variable_labels', _padded('', 321) * k)
+        self._section('characteristics', b'')
+        self._offsets['data'] = f.tell()
+        f.write(b'<data>')
+
+    def _section(self, name, payload):
+        self._offsets[name] = self._file.tell()
+        self._file.write(f'<{name}>'.encode('ascii') + payload + f'</{name}>'.encode('ascii'))
+
+
+_MAP_SECTIONS = ['stata_data', 'map', 'variable_types', 'varnames', 'sortlist', 'formats', 'value_label_names',
+                 'variable_labels', 'characteristics', 'data', 'strls', 'value_labels', 'stata_data_close',
+                 'end_of_file']
+
+
+def _encode(column, code):
+    """Converts an Arrow column to the numpy values of a Stata variable (missing values filled in)."""
+    if code <= 2045:
+        return _fixed_width_bytes(column, code)
+    numpy_type, missing, _, _ = _NUMERIC[code]
+    if code == _DOUBLE:
+        values = pc.cast(column, pa.float64()).to_numpy(zero_copy_only=False)
+        return np.where(np.isnan(values), missing, values)
+    return pc.fill_null(pc.cast(column, pa.int64()), missing).to_numpy().astype(numpy_type)
+
+
+def _fixed_width_bytes(column, width):
+    """Packs a string column into a (rows,) array of null-padded width-byte strings without Python loops."""
+    column = pc.fill_null(pc.cast(column, pa.string()), '')
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    n = len(column)
+    _, offsets_buffer, data_buffer = column.buffers()
+    offsets = np.frombuffer(offsets_buffer, dtype=np.int32)[column.offset:column.offset + n + 1]
+    lengths = np.diff(offsets)
+    if len(lengths) and lengths.max() > width:
+        raise ValueError(f"String longer than the planned width {width}")
+    out = np.zeros((n, width), dtype=np.uint8)
+    # Strings are contiguous in the data buffer, so the row-major mask of each row's first `length` bytes
+    # lines up with the buffer slice
+    if n and offsets[-1] > offsets[0]:
+        data = np.frombuffer(data_buffer, dtype=np.uint8)[offsets[0]:offsets[-1]]
+        out[np.arange(width) < lengths[:, None]] = data
+    return out.view(f'S{width}').ravel()
+
+
+def _select_rows(batch, schema, columns, required_columns):
+    """Drops rows missing a required column and conforms the batch's columns to schema (sanitizing strings)."""
+    if required_columns:
+        keep = None
+        for col in required_columns:
+            valid = pc.is_valid(batch.column(col)) if col in batch.schema.names else pa.scalar(False)
+            keep = valid if keep is None else pc.and_(keep, valid)
+        batch = batch.filter(keep)
+
+    arrays = []
+    for name in columns:
+        field = schema.field(name)
+        if name not in batch.schema.names:
+            arrays.append(pa.nulls(batch.num_rows, field.type))
+            continue
+        column = batch.column(name)
+        if _is_string(field.type):
+            column = sanitize_strings(column)
+        elif column.type != field.type:
+            column = pc.cast(column, field.type)
+        if pa.types.is_timestamp(field.type) or pa.types.is_date(field.type):
+            column = _stata_dates(column)
+        arrays.append(column)
+    return pa.RecordBatch.from_arrays(arrays, names=list(columns))
+
+
+def _stata_dates(column):
+    """Stata clock (%tc, milliseconds since 1960 as doubles) or date (%td, days since 1960) values of a
+    timestamp or date column. Time zone aware timestamps are written in their local wall-clock time."""
+    if pa.types.is_date(column.type):
+        days = pc.cast(pc.cast(column, pa.date32()), pa.int32())
+        return pc.add(pc.cast(days, pa.int64()), _STATA_EPOCH_DAYS)
+    if column.type.tz is not None:
+        column = pc.local_timestamp(column)
+    milliseconds = pc.cast(pc.cast(column, pa.timestamp('ms'), safe=False), pa.int64())
+    return pc.cast(pc.add(milliseconds, _STATA_EPOCH_MS), pa.float64())
+
+
+def _unified_schema(parquet_files, columns):
+    if not parquet_files:
+        raise FileNotFoundError("No Parquet files to export.")
+    schemas = [_plain_schema(pq.read_schema(file_path)) for file_path in parquet_files]
+    schema = pa.unify_schemas(schemas, promote_options='permissive')
+    if columns is not None:
+        schema = pa.schema([schema.field(col) for col in columns])
+    return schema
+
+
+def _plain_schema(schema):
+    """Replaces dictionary types with their value type and drops pandas index columns and metadata."""
+    fields = [pa.field(field.name, field.type.value_type if pa.types.is_dictionary(field.type) else field.type)
+              for field in schema if not field.name.startswith('__index_level_')]
+    return pa.schema(fields)
+
+
+def _is_string(arrow_type):
+    return pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type)
+
+
+def _padded(text, width):
+    return text.encode('utf-8')[:width - 1].ljust(width, b'\x00')
+
+
+def _format(code):
+    return f'%{code}s' if code <= 2045 else _NUMERIC[code][3]
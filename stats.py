@@ -1,4 +1,49 @@
+"""
+Progress and extraction statistics for the DESS datasets.
+
+- `get_dataset_stats` reads only the columns it needs from Parquet (or Excel) and computes every
+  count in one aggregation pass, optionally broken down by university or by extraction source.
+- `get_progress` answers "how far along am I / what is my conversion rate" from a small JSON
+  ledger (`progress_ledger.json`) holding per-part counts, keyed by the dataset's path relative to
+  STORAGE_DIR. data_pipeline_manager records each part it writes; parts written elsewhere (e.g.
+  synced from Dropbox) are counted once when first seen. A part's counts only cover its rows that
+  are the latest version of their id_text: when a part is recorded, the older versions of its ids
+  are subtracted from the parts holding them. Which part holds the latest version of each id_text
+  is kept in a SQLite table next to the ledger (`progress_ledger_ids.sqlite`), so recording a part
+  reads only the rows it supersedes, and get_progress reads no part it has already counted.
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from contextlib import closing
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import arrow_cache
+import config
+import parquet_schema
+
+# Paths derived from the environment, resolved when first used (see __getattr__)
+_ENV_PATHS = {
+    'STORAGE_DIR': lambda: config.storage_path(),
+    'LEDGER_FILE_PATH': lambda: config.storage_path('progress_ledger.json'),
+}
+STATS_COLUMNS = ['university', 'isProfessor', 'department_textual', 'department_keyword', 'department_source']
+_COUNTED_COLUMNS = STATS_COLUMNS + [parquet_schema.DELETED_COLUMN] # tombstone rows are not counted
+COUNTS = ['records', 'professors', 'dept_textual', 'dept_keyword', 'dept_either']
+LEDGER_VERSION = 2 # ledgers of another version are recounted from the part files
+_LEDGER_LOCK = threading.Lock()
+
+def __getattr__(name):
+    if name in _ENV_PATHS:
+        return _ENV_PATHS[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _path(name):
+    return __getattr__(name)
 
 def get_expected_file_split_stats(df_master, df_c, df_r):
     print(f"+{'-'*20}+")
@@ -10,66 +55,309 @@ def get_expected_file_split_stats(df_master, df_c, df_r):
     print(f"+{'-'*20}+")
 
 def get_chunk_processing_stats(df: pd.DataFrame, CHUNK_SIZE=200):
-    """Processes DataFrame in chunks, printing progress and conversion rate if a null-only chunk is found."""
+    """Finds the first chunk whose rawText is all null and prints progress and conversion rate up to it."""
     total_chunks = len(df) // CHUNK_SIZE + (1 if len(df) % CHUNK_SIZE != 0 else 0)
-    processed_chunks = 0
-    non_null_rows = 0
-    start_index, end_index = 0, len(df)
-    
-    for i in range(start_index, end_index, CHUNK_SIZE):
-        chunk = df.iloc[i:i+CHUNK_SIZE]
-
-        non_null_count = chunk['rawText'].notnull().sum()
-        non_null_rows += non_null_count
-
-        # Check if the entire chunk's rawText column is null
-        if chunk['rawText'].isnull().all():
-            processed_percentage = (processed_chunks / total_chunks) * 100
-            conversion_rate = (non_null_rows / (end_index - start_index)) * 100
-            
-            # Print results in a more readable format
-            print(f"\n{'Progress Summary':^80}")
-            print(f"{'Processed Chunks':<20}{'Total Chunks':<20}{'Percentage (%)':<20}{'Overall Conversion Rate (%)':<20}")
-            print(f"{processed_chunks:<20}{total_chunks:<20}{processed_percentage:<20.2f}{conversion_rate:<20.2f}")
-
-            preview = pd.concat([df.iloc[max(0, i-CHUNK_SIZE):i].tail(5), df.iloc[i:i+CHUNK_SIZE].head(5)])
-            return preview
-
-        processed_chunks += 1
-    return "COMPLETE"
-
-def get_dataset_stats(file_path:str):
-    df = pd.read_excel(file_path)
-    
-    total_records = len(df)
-    df_isProfessor = df[df['isProfessor'] == True]
-    df_professorWithDept_textual = df_isProfessor[df_isProfessor['department_textual'] != 'MISSING']
-    df_professorWithDept_keyword = df_isProfessor[df_isProfessor['department_keyword'] != 'MISSING']
-    df_professorWithDept_either = df_isProfessor[
-        (df_isProfessor['department_textual'] != 'MISSING') | 
-        (df_isProfessor['department_keyword'] != 'MISSING')
-    ]
-
-    # Calculating Stats
-    num_professors = len(df_isProfessor)
-    num_professors_with_dept_textual = len(df_professorWithDept_textual)
-    num_professors_with_dept_keyword = len(df_professorWithDept_keyword)
-    num_professors_with_dept_either = len(df_professorWithDept_either)
+    non_null = df['rawText'].notnull().to_numpy()
+
+    # Non-null rawText rows per chunk, in one pass
+    non_null_per_chunk = np.bincount(np.arange(len(df)) // CHUNK_SIZE, weights=non_null, minlength=total_chunks)
+    empty_chunks = np.flatnonzero(non_null_per_chunk == 0)
+    if not len(empty_chunks):
+        return "COMPLETE"
+
+    processed_chunks = int(empty_chunks[0])
+    i = processed_chunks * CHUNK_SIZE
+    processed_percentage = (processed_chunks / total_chunks) * 100
+    conversion_rate = (non_null_per_chunk[:processed_chunks].sum() / len(df)) * 100
+
+    # Print results in a more readable format
+    print(f"\n{'Progress Summary':^80}")
+    print(f"{'Processed Chunks':<20}{'Total Chunks':<20}{'Percentage (%)':<20}{'Overall Conversion Rate (%)':<20}")
+    print(f"{processed_chunks:<20}{total_chunks:<20}{processed_percentage:<20.2f}{conversion_rate:<20.2f}")
+
+    preview = pd.concat([df.iloc[max(0, i-CHUNK_SIZE):i].tail(5), df.iloc[i:i+CHUNK_SIZE].head(5)])
+    return preview
+
+def get_dataset_stats(file_path: str, by: str = None, use_cache: bool = False):
+    """
+    Prints professor and department coverage statistics for a Parquet file, partitioned dataset or
+    Excel sample, reading only the columns the statistics need.
+
+    Args:
+        by (str): Also break the counts down by 'university' or by extraction 'source' (the
+            department_source written by dess/cascade.py if present, else textual, keyword, both or none).
+        use_cache (bool): Read a dataset from its memory-mapped Arrow cache (see arrow_cache),
+            building the cache first if the dataset changed.
+
+    Returns:
+        dict | pd.DataFrame: The overall counts, or the breakdown if by is given.
+    """
+    df = _read_stats_columns(file_path, use_cache)
+    flags = _count_flags(df)
+    totals = flags.sum()
+
+    total_records = int(totals['records'])
+    num_professors = int(totals['professors'])
+    num_professors_with_dept_either = int(totals['dept_either'])
     percent_with_dept = (num_professors_with_dept_either / num_professors) * 100 if num_professors else 0
+    professor_rate = (num_professors / total_records) * 100 if total_records else 0
 
     # Output stats
     print(f"\n ________________________________________________ ")
-    print(f"|{'STATS FOR: ' + file_path:^48}|")
+    print(f"|{'STATS FOR: ' + os.path.basename(file_path):^48}|")
     print(f"|________________________________________________|")
     print(f"|============= Professor Statistics =============|")
     print(f"{'|Total Number of Records:':<41} {total_records:<7}|")
     print(f"{'|Number of Professors:':<41} {num_professors:<7}|")
-    print(f"{'|Professors with Department (textual):':<41} {num_professors_with_dept_textual:<7}|")
-    print(f"{'|Professors with Department (keyword):':<41} {(num_professors_with_dept_keyword):<7}|")
+    print(f"{'|Professors with Department (textual):':<41} {int(totals['dept_textual']):<7}|")
+    print(f"{'|Professors with Department (keyword):':<41} {int(totals['dept_keyword']):<7}|")
     print(f"{'|Number of Professors without:':<41} {(num_professors - num_professors_with_dept_either):<7}|")
     print(f"|________________________________________________|")
     print(f"|=============== Conversion Rates ===============|")
-    print(f"{'|Professor Identification Rate (%):':<41} {((num_professors / total_records) * 100):<7.2f}|")
+    print(f"{'|Professor Identification Rate (%):':<41} {professor_rate:<7.2f}|")
     print(f"{'|Department Extraction Rate (coverage %):':<41} {percent_with_dept:<7.2f}|")
     print(f"{'|Department Coverage Gap (slippage %):':<41} {(100 - percent_with_dept):<7.2f}|")
-    print(f"|________________________________________________|")
\ No newline at end of file
+    print(f"|________________________________________________|")
+
+    if by is None:
+        return {count: int(totals[count]) for count in COUNTS}
+    if by == 'university':
+        keys = df['university'] if 'university' in df else pd.Series(None, index=df.index, dtype=object)
+    elif by == 'source':
+        keys = df['department_source'] if 'department_source' in df else _extraction_source(flags)
+    else:
+        raise ValueError(f"Invalid breakdown: {by}. Use 'university' or 'source'.")
+    breakdown = flags.groupby(keys.to_numpy(), dropna=False).sum().rename_axis(by)
+    breakdown['coverage_pct'] = (breakdown['dept_either'] / breakdown['professors'].where(breakdown['professors'] > 0)
+                                 * 100).fillna(0).round(2)
+    return breakdown.sort_values('records', ascending=False)
+
+def get_progress(storage_dir: str = None, ledger_path: str = None):
+    """
+    Prints the complete/reprocess/to-do split and the conversion rate from the progress ledger,
+    without loading the datasets. storage_dir and ledger_path default to STORAGE_DIR and LEDGER_FILE_PATH.
+
+    Returns:
+        dict: Counts per dataset plus 'total', 'todo', 'conversion_rate' and 'coverage'.
+    """
+    storage_dir, ledger_path = storage_dir or _path('STORAGE_DIR'), ledger_path or _path('LEDGER_FILE_PATH')
+    with _LEDGER_LOCK, closing(_open_latest_parts(ledger_path)) as conn, conn:
+        ledger = _load_ledger(ledger_path)
+        progress = {name: _dataset_counts(ledger, conn, os.path.join(storage_dir, f"{name}.parquet"), storage_dir)
+                    for name in ('complete', 'reprocess', 'uncomplete')}
+        total = _master_rows(ledger, os.path.join(storage_dir, 'input.dta'))
+        _save_ledger(ledger, ledger_path)
+
+    n_complete, n_reprocess = progress['complete']['records'], progress['reprocess']['records']
+    professors = progress['complete']['professors']
+    progress['total'] = total
+    progress['todo'] = total - (n_complete + n_reprocess) if total is not None else None
+    progress['conversion_rate'] = n_complete / (n_complete + n_reprocess) * 100 if n_complete + n_reprocess else 0
+    progress['coverage'] = progress['complete']['dept_either'] / professors * 100 if professors else 0
+
+    print(f"+{'-'*30}+")
+    print(f"| {'Total':<15}: {total if total is not None else '?':<11} |")
+    print(f"| {'Complete':<15}: {n_complete:<11} |")
+    print(f"| {'Reprocess':<15}: {n_reprocess:<11} |")
+    print(f"|{'-'*30}|")
+    print(f"| {'ToDo':<15}: {progress['todo'] if total is not None else '?':<11} |")
+    print(f"| {'Conversion (%)':<15}: {progress['conversion_rate']:<11.2f} |")
+    print(f"| {'Coverage (%)':<15}: {progress['coverage']:<11.2f} |")
+    print(f"+{'-'*30}+")
+    return progress
+
+def record_part(dataset_path: str, part_path: str, df: pd.DataFrame, ledger_path: str = None, replaces=()):
+    """
+    Adds a freshly written part file (whose rows are df) to the progress ledger. Rows of older parts
+    that df has a newer version of are subtracted from those parts' counts (only those rows are read).
+
+    Args:
+        replaces (list): Part files that part_path was compacted from; their counts are dropped
+            instead, as df holds the latest version of every row they had.
+    """
+    ledger_path = ledger_path or _path('LEDGER_FILE_PATH')
+    with _LEDGER_LOCK, closing(_open_latest_parts(ledger_path)) as conn, conn:
+        ledger = _load_ledger(ledger_path)
+        parts = _ledger_parts(ledger, conn, _dataset_key(dataset_path))
+        for replaced in replaces:
+            parts.pop(os.path.basename(replaced), None)
+        _record(parts, conn, _dataset_key(dataset_path), part_path, df, replaced={os.path.basename(part) for part in replaces})
+        _save_ledger(ledger, ledger_path)
+
+def summarize(df: pd.DataFrame) -> dict:
+    """Counts records, professors and professors with a department in df (tombstone rows excluded)."""
+    if parquet_schema.DELETED_COLUMN in df:
+        df = df[~df[parquet_schema.DELETED_COLUMN].eq(True)]
+    totals = _count_flags(df).sum()
+    return {count: int(totals[count]) for count in COUNTS}
+
+def _count_flags(df):
+    """One boolean column per count; summing (or grouping and summing) it gives every statistic at once."""
+    n = len(df)
+    is_professor = df['isProfessor'].eq(True).to_numpy() if 'isProfessor' in df else np.zeros(n, dtype=bool)
+    textual = is_professor & _has_department(df, 'department_textual')
+    keyword = is_professor & _has_department(df, 'department_keyword')
+    return pd.DataFrame({'records': np.ones(n, dtype=np.int64), 'professors': is_professor,
+                         'dept_textual': textual, 'dept_keyword': keyword, 'dept_either': textual | keyword},
+                        index=df.index)
+
+def _has_department(df, col):
+    """True where a department was extracted (not null and not 'MISSING')."""
+    if col not in df:
+        return np.zeros(len(df), dtype=bool)
+    return (df[col].notna() & df[col].ne('MISSING')).to_numpy()
+
+def _extraction_source(flags):
+    textual, keyword = flags['dept_textual'].to_numpy(), flags['dept_keyword'].to_numpy()
+    source = np.select([textual & keyword, textual, keyword, flags['professors'].to_numpy()],
+                       ['both', 'textual', 'keyword', 'none'], default='not professor')
+    return pd.Series(source, index=flags.index)
+
+def _read_stats_columns(file_path, use_cache=False):
+    """Reads the statistics columns (and id_text, to keep the latest version of each row in a dataset)."""
+    if file_path.endswith(('.xlsx', '.xls')):
+        return pd.read_excel(file_path, usecols=lambda col: col in STATS_COLUMNS)
+    if use_cache and os.path.exists(file_path):
+        return arrow_cache.open_dataset(file_path).to_pandas(STATS_COLUMNS)
+    import data_pipeline_manager as dpm # imports this module
+    files = dpm.list_parts(file_path)
+    if not files:
+        return pd.DataFrame(columns=STATS_COLUMNS)
+    tables = [dpm.read_part(part, ['id_text'] + STATS_COLUMNS) for part in files]
+    df = pa.concat_tables(tables, promote_options="permissive").to_pandas()
+    if len(files) > 1 and 'id_text' in df:
+        df = dpm.keep_latest(df, 'id_text', [table.num_rows for table in tables])
+    return df
+
+def _dataset_counts(ledger, conn, dataset_path, storage_dir=None):
+    """Sums the ledger counts of a dataset's parts, counting parts the ledger hasn't seen (or that were
+    rewritten since) and forgetting parts that no longer exist (compacted or replaced)."""
+    import data_pipeline_manager as dpm # imports this module
+    key = _dataset_key(dataset_path, storage_dir)
+    parts = _ledger_parts(ledger, conn, key)
+    files = {os.path.basename(part): part for part in dpm.list_parts(dataset_path)}
+    gone = [name for name in parts if name not in files]
+    for name in gone:
+        del parts[name]
+    conn.executemany("DELETE FROM latest_parts WHERE dataset = ? AND part = ?", ((key, name) for name in gone))
+    for name, part in files.items(): # oldest first
+        if name not in parts or parts[name]['stamp'] != _part_stamp(part):
+            _record(parts, conn, key, part, _read_part(part, _COUNTED_COLUMNS))
+    return {count: sum(entry['counts'][count] for entry in parts.values()) for count in COUNTS}
+
+def _record(parts, conn, key, part_path, df, replaced=()):
+    """
+    Sets the ledger entry of a part (whose rows are df) to the counts of its rows that are the latest
+    version of their id_text, and moves the latest version of its ids to it in latest_parts: the
+    rows of an older part holding one of them are subtracted from that part's counts, while ids a
+    newer part already holds are subtracted from this part's own counts. Ids held by a part in
+    replaced, or by one that is no longer counted, are just moved.
+    """
+    name = os.path.basename(part_path)
+    counts = summarize(df)
+    if 'id_text' in df and len(df):
+        ids = df['id_text'].astype(str)
+        holders = _latest_parts(conn, key, ids.unique())
+        moved = [id_text for id_text in ids.unique() if id_text not in holders]
+        held_by = {}
+        for id_text, holder in holders.items():
+            held_by.setdefault(holder, []).append(id_text)
+        for holder, holder_ids in held_by.items():
+            holder_path = os.path.join(os.path.dirname(part_path), holder)
+            if holder == name or holder in replaced or holder not in parts or not os.path.exists(holder_path):
+                moved.extend(holder_ids)
+            elif holder < name: # part names sort in write order
+                _subtract(parts[holder]['counts'], summarize(_read_part(holder_path, _COUNTED_COLUMNS,
+                                                                        filters=[('id_text', 'in', holder_ids)])))
+                moved.extend(holder_ids)
+            else:
+                _subtract(counts, summarize(df[ids.isin(holder_ids).to_numpy()]))
+        conn.executemany("INSERT OR REPLACE INTO latest_parts (dataset, id_text, part) VALUES (?, ?, ?)",
+                         ((key, id_text, name) for id_text in moved))
+    parts[name] = {'stamp': _part_stamp(part_path), 'counts': counts}
+
+def _subtract(counts, superseded):
+    for count in COUNTS:
+        counts[count] -= superseded[count]
+
+def _latest_parts(conn, key, ids) -> dict:
+    """{id_text: part holding its latest version} for the ids of the dataset that latest_parts has."""
+    ids = list(ids)
+    holders = {}
+    for start in range(0, len(ids), 900): # stay under SQLite's bound-parameter limit
+        batch = ids[start:start + 900]
+        holders.update(conn.execute(f"SELECT id_text, part FROM latest_parts WHERE dataset = ? AND id_text IN ({','.join('?' * len(batch))})",
+                                    [key] + batch).fetchall())
+    return holders
+
+def _ledger_parts(ledger, conn, key) -> dict:
+    """The ledger entries of a dataset's parts; latest_parts is cleared for a dataset new to the ledger."""
+    if key not in ledger['datasets']:
+        conn.execute("DELETE FROM latest_parts WHERE dataset = ?", (key,))
+    return ledger['datasets'].setdefault(key, {})
+
+def _dataset_key(dataset_path, storage_dir=None):
+    """The ledger key of a dataset: its path relative to STORAGE_DIR (absolute if it is outside)."""
+    path = os.path.abspath(dataset_path)
+    relative = os.path.relpath(path, os.path.abspath(storage_dir or _path('STORAGE_DIR')))
+    return path if relative.startswith(os.pardir) else relative
+
+def _open_latest_parts(ledger_path):
+    """Opens the table of the part holding each dataset row's latest version, next to the ledger."""
+    conn = sqlite3.connect(f"{os.path.splitext(ledger_path)[0]}_ids.sqlite", timeout=30)
+    conn.execute("""CREATE TABLE IF NOT EXISTS latest_parts (
+                        dataset TEXT NOT NULL,
+                        id_text TEXT NOT NULL,
+                        part TEXT NOT NULL,
+                        PRIMARY KEY (dataset, id_text)
+                    ) WITHOUT ROWID""")
+    conn.execute("CREATE INDEX IF NOT EXISTS latest_parts_by_part ON latest_parts (dataset, part)")
+    return conn
+
+def _read_part(part, columns, filters=None):
+    """The given columns of a part file (and id_text), skipping the ones it doesn't have."""
+    available = pq.read_schema(part).names
+    columns = [col for col in ['id_text'] + list(columns) if col in available]
+    return parquet_schema.read_table(part, columns=list(dict.fromkeys(columns)), filters=filters).to_pandas()
+
+def _master_rows(ledger, master_path):
+    """Row count of the master Stata file, read from its header and cached by size/mtime."""
+    if not os.path.exists(master_path):
+        return None
+    key = _part_stamp(master_path)
+    if ledger['master'].get('key') != key:
+        ledger['master'] = {'key': key, 'rows': _stata_row_count(master_path)}
+    return ledger['master']['rows']
+
+def _stata_row_count(stata_path):
+    """Reads the number of observations from a .dta header (formats 113-119)."""
+    with open(stata_path, 'rb') as f:
+        header = f.read(128)
+    if header.startswith(b'<stata_dta>'):
+        release = int(header[header.index(b'<release>') + 9:header.index(b'</release>')])
+        byteorder = '<' if header[header.index(b'<byteorder>') + 11:].startswith(b'LSF') else '>'
+        n_start = header.index(b'<N>') + 3
+        return int(np.frombuffer(header[n_start:n_start + (4 if release == 117 else 8)],
+                                 dtype=f"{byteorder}u{4 if release == 117 else 8}")[0])
+    byteorder = '<' if header[1] == 2 else '>'
+    return int(np.frombuffer(header[6:10], dtype=f"{byteorder}u4")[0])
+
+def _part_stamp(part_path):
+    # Compaction rewrites a part under its existing name, so size and mtime tell the versions apart
+    stat = os.stat(part_path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+def _load_ledger(ledger_path):
+    ledger = None
+    if os.path.exists(ledger_path):
+        with open(ledger_path) as f:
+            ledger = json.load(f)
+    if ledger is None or ledger.get('version') != LEDGER_VERSION:
+        ledger = {'version': LEDGER_VERSION, 'datasets': {}, 'master': {}}
+    return ledger
+
+def _save_ledger(ledger, ledger_path):
+    tmp_path = f"{ledger_path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        json.dump(ledger, f, indent=1)
+    os.replace(tmp_path, ledger_path)
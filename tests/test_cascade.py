@@ -0,0 +1,51 @@
+import pandas as pd
+import pytest
+import dess.cascade as cascade
+
+MISSING = cascade.MISSING
+
+
+def _rows(*rows):
+    columns = ['department_textual', 'isPrimaryPattern', 'department_keyword', 'keyword_precision', 'isProfessor']
+    df = pd.DataFrame(list(rows), columns=columns)
+    df['rawText'] = [[f"snippet {i}"] for i in range(len(df))]
+    return df
+
+
+@pytest.fixture
+def llm_calls(monkeypatch):
+    calls = []
+
+    def infer(texts, **options):
+        calls.append(texts.tolist())
+        return pd.Series("Physics", index=texts.index)
+    monkeypatch.setattr(cascade, 'infer_departments_with_llm', infer)
+    return calls
+
+
+def test_rule_hits_never_call_the_llm(llm_calls):
+    df = _rows(('history', 1, MISSING, 0, True),      # primary pattern
+               (MISSING, 0, 'economics', 1, True),    # precise keyword
+               ('biology', 0, 'biology', 2, True))    # backup pattern backed by a precise keyword
+
+    summary = cascade.resolve_departments(df, run_rules=False)
+
+    assert llm_calls == []
+    assert df['department'].tolist() == ['history', 'economics', 'biology']
+    assert df['department_source'].tolist() == ['textual_primary', 'keyword', 'keyword']
+    assert summary['routed'] == {}
+
+
+def test_only_unresolved_professors_are_sent_to_the_llm(llm_calls):
+    df = _rows(('history', 1, MISSING, 0, True),      # resolved by the rules
+               (MISSING, 0, MISSING, 0, True),        # missing
+               ('chemistry', 0, MISSING, 0, True),    # backup pattern only
+               (MISSING, 0, 'art', 3, True),          # low-precision keyword only
+               (MISSING, 0, MISSING, 0, False))       # not a professor
+
+    summary = cascade.resolve_departments(df, run_rules=False)
+
+    assert llm_calls == [['snippet 1', 'snippet 2', 'snippet 3']]
+    assert summary['routed'] == {'missing': 1, 'backup_only': 1, 'low_precision': 1}
+    assert df['department'].tolist() == ['history', 'physics', 'physics', 'physics', MISSING]
+    assert df['department_source'].tolist() == ['textual_primary', 'llm', 'llm', 'llm', 'none']
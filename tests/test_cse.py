@@ -0,0 +1,53 @@
+import datetime
+import pandas as pd
+import pytest
+import cse
+
+UTC = datetime.timezone.utc
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    monkeypatch.setenv('STORAGE_DIR', str(tmp_path))
+    monkeypatch.setenv('CSE_REQUESTS_PER_MINUTE', '0')
+    return tmp_path
+
+
+def test_quota_day_rolls_over_at_midnight_pacific_time():
+    assert cse._today(datetime.datetime(2024, 1, 2, 7, 59, tzinfo=UTC)) == '2024-01-01'  # 23:59 PST
+    assert cse._today(datetime.datetime(2024, 1, 2, 8, 0, tzinfo=UTC)) == '2024-01-02'
+    assert cse._today(datetime.datetime(2024, 7, 2, 6, 59, tzinfo=UTC)) == '2024-07-01'  # 23:59 PDT
+    assert cse._today(datetime.datetime(2024, 7, 2, 7, 0, tzinfo=UTC)) == '2024-07-02'
+
+
+def test_used_up_quota_is_available_again_the_next_pacific_day(storage, monkeypatch):
+    monkeypatch.setenv('CSE_DAILY_QUOTA', '1')
+    now = {'utc': datetime.datetime(2024, 1, 2, 7, 30, tzinfo=UTC)}
+    today = cse._today
+    monkeypatch.setattr(cse, '_today', lambda: today(now['utc']))
+    cse.acquire()
+    assert cse.remaining_quota() == 0
+
+    now['utc'] += datetime.timedelta(minutes=30) # midnight in Los Angeles
+    assert cse.remaining_quota() == 1
+    cse.acquire()
+    with pytest.raises(cse.QuotaExceeded):
+        cse.acquire()
+
+
+def test_no_daily_cap_unless_configured(storage, monkeypatch):
+    monkeypatch.delenv('CSE_DAILY_QUOTA', raising=False)
+    assert cse.remaining_quota() is None
+    for _ in range(3):
+        cse.acquire()
+
+
+def test_populate_returns_the_rows_searched_before_the_quota_ran_out(storage, monkeypatch):
+    monkeypatch.setenv('CSE_DAILY_QUOTA', '2')
+    monkeypatch.setattr(cse, 'make_API_CALL', lambda query: (cse.acquire(), query)[1])
+    monkeypatch.setattr(cse, '_get_rawText', lambda file_name: [f"{file_name} snippet"])
+
+    df = cse.populate_rawText_col(pd.DataFrame({'id_text': ['a', 'b', 'c', 'd']}))
+
+    assert df['id_text'].tolist() == ['a', 'b']
+    assert df['rawText'].tolist() == [['a snippet'], ['b snippet']]
@@ -0,0 +1,44 @@
+import pandas as pd
+import arrow_cache
+import data_pipeline_manager as dpm
+
+
+def _rows(ids, version):
+    return pd.DataFrame({'id_text': ids, 'department': [f'{version}-{i}' for i in range(len(ids))]})
+
+
+def test_read_dataset_keeps_the_latest_part_and_duplicates_within_a_part(tmp_path, monkeypatch):
+    monkeypatch.setenv('STORAGE_DIR', str(tmp_path))
+    dataset = str(tmp_path / 'complete.parquet')
+    dpm.append_to_dataset(dataset, _rows(['a', 'b', 'b', 'c'], 'v1'))
+    dpm.append_to_dataset(dataset, _rows(['c', 'a'], 'v2'))
+
+    df = dpm.read_dataset(dataset)
+
+    # a and c come from the second part, at their first positions; b's two rows are both kept
+    assert df['id_text'].tolist() == ['a', 'b', 'b', 'c']
+    assert df['department'].tolist() == ['v2-1', 'v1-1', 'v1-2', 'v2-0']
+    assert arrow_cache.open_dataset(dataset).to_pandas()['department'].tolist() == df['department'].tolist()
+
+    dpm.compact_dataset(dataset)
+    assert dpm.read_dataset(dataset)['department'].tolist() == df['department'].tolist()
+
+
+def test_update_parquet_file_appends_a_delta_until_it_is_folded(tmp_path):
+    path = str(tmp_path / 'toSearch.parquet')
+    pd.DataFrame({'id_text': ['a', 'b', 'c'], 'isProcessed': False}).to_parquet(path)
+    before = open(path, 'rb').read()
+
+    dpm.update_parquet_file(pd.DataFrame({'id_text': ['b'], 'department': ['history']}), path, ['b', 'c'])
+    dpm.update_parquet_file(pd.DataFrame({'id_text': ['b'], 'department': ['physics']}), path, ['b'])
+
+    assert open(path, 'rb').read() == before
+    assert dpm.pending_updates(path) == {'b', 'c'}
+
+    assert dpm.fold_parquet_updates(path) == 3
+    df = pd.read_parquet(path)
+    # unprocessed rows first; the later update of b wins
+    assert df['id_text'].tolist() == ['a', 'b', 'c']
+    assert df['isProcessed'].tolist() == [False, True, True]
+    assert df['department'].iloc[1] == 'physics' and df['department'].iloc[[0, 2]].isna().all()
+    assert dpm.pending_updates(path) == set() and dpm.fold_parquet_updates(path) == 0
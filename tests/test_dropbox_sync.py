@@ -0,0 +1,82 @@
+import os
+import pandas as pd
+import dropbox_sync
+import data_pipeline_manager as dpm
+from fake_dropbox import FakeDropbox
+
+
+def _write(path, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def _files(root):
+    return [(os.path.join(dirpath, name), os.path.relpath(os.path.join(dirpath, name), root).replace(os.sep, '/'))
+            for dirpath, _, names in os.walk(root) for name in sorted(names)]
+
+
+def test_upload_transfers_only_changed_files(tmp_path):
+    dbx = FakeDropbox(page_size=2)
+    _write(tmp_path / 'a.csv', b'a')
+    _write(tmp_path / 'b.csv', b'b')
+    assert dropbox_sync.upload_changed_files(dbx, _files(tmp_path), '/DESS')['transferred'] == ['a.csv', 'b.csv']
+
+    _write(tmp_path / 'b.csv', b'b2')
+    report = dropbox_sync.upload_changed_files(dbx, _files(tmp_path), '/DESS', policy='overwrite')
+    assert report['transferred'] == ['b.csv'] and report['unchanged'] == ['a.csv']
+    assert dbx.get('/DESS/b.csv') == b'b2'
+
+
+def test_mirrored_folder_deletes_removed_parts(tmp_path):
+    dbx = FakeDropbox()
+    old_parts = [_write(tmp_path / 'complete.parquet' / f'part-{i}.parquet', bytes([i])) for i in range(3)]
+    _write(tmp_path / 'errors.csv', b'e')
+    dbx.put('/DESS/dataset/only-remote.csv', b'r')
+    dropbox_sync.upload_changed_files(dbx, _files(tmp_path), '/DESS', mirror_folders=['complete.parquet'])
+
+    # a compaction replaces the parts with one
+    for part in old_parts:
+        os.remove(part)
+    _write(tmp_path / 'complete.parquet' / 'part-3.parquet', b'merged')
+    os.remove(tmp_path / 'errors.csv')
+    report = dropbox_sync.upload_changed_files(dbx, _files(tmp_path), '/DESS', mirror_folders=['complete.parquet'])
+
+    assert report['transferred'] == ['complete.parquet/part-3.parquet']
+    assert report['deleted'] == [f'complete.parquet/part-{i}.parquet' for i in range(3)]
+    # files outside the mirrored folders are left alone
+    assert sorted(dbx.files) == ['/dess/complete.parquet/part-3.parquet', '/dess/dataset/only-remote.csv', '/dess/errors.csv']
+
+
+def test_mirrored_folder_is_kept_when_an_upload_fails(tmp_path):
+    dbx = FakeDropbox()
+    dbx.put('/DESS/complete.parquet/part-0.parquet', b'old')
+    _write(tmp_path / 'complete.parquet' / 'part-1.parquet', b'new')
+    dbx.inject_failure('files_upload', times=1)
+
+    report = dropbox_sync.upload_changed_files(dbx, _files(tmp_path), '/DESS', mirror_folders=['complete.parquet'])
+
+    assert report['failed'] == ['complete.parquet/part-1.parquet'] and report['deleted'] == []
+    assert dbx.get('/DESS/complete.parquet/part-0.parquet') == b'old'
+
+
+def test_upload_workflow_prunes_compacted_dataset_parts(tmp_path, monkeypatch):
+    monkeypatch.setenv('STORAGE_DIR', str(tmp_path))
+    monkeypatch.setenv('DROPBOX_FOLDER', 'DESS')
+    dbx = FakeDropbox()
+    dbx.put('/DESS/dataset/toSearch.parquet', b'remote only')
+    for i in range(3):
+        dpm.append_to_dataset(dpm.COMPLETE_FILE_PATH, pd.DataFrame({'id_text': [f'id {i}'], 'department': ['x']}))
+    dpm.orchestrate_upload_workflow(client=dbx)
+
+    # compaction reuses the newest part's name, so it is a conflict unless remote files are replaced
+    dpm.compact_dataset(dpm.COMPLETE_FILE_PATH)
+    assert dpm.orchestrate_upload_workflow(client=dbx)['deleted'] == []
+    report = dpm.orchestrate_upload_workflow(client=dbx, overwrite=True)
+
+    (part,) = dpm.list_parts(dpm.COMPLETE_FILE_PATH)
+    assert len(report['deleted']) == 2
+    assert sorted(path for path in dbx.files if path.startswith('/dess/complete.parquet/')) == \
+        [f"/dess/complete.parquet/{os.path.basename(part)}".lower()]
+    assert dbx.get('/DESS/dataset/toSearch.parquet') == b'remote only'
@@ -0,0 +1,38 @@
+import pytest
+import entity_resolution as er
+
+
+def _same(a, b):
+    a, b = er.canonicalize(a), er.canonicalize(b)
+    return er.block_key(a) == er.block_key(b) and er.is_same_entity(a, b)
+
+
+@pytest.mark.parametrize('first, other', [('daniel', 'danielle'), ('eric', 'erica'), ('paul', 'paula'),
+                                          ('ann', 'anna'), ('robert', 'roberta')])
+def test_similar_first_names_are_different_people(first, other):
+    assert not _same(f"{first} smith ohio state university", f"{other} smith ohio state university")
+
+
+@pytest.mark.parametrize('university, other', [('university of washington', 'washington university'),
+                                               ('university of michigan', 'michigan state university'),
+                                               ('university of washington', 'university of wisconsin')])
+def test_different_institutions_are_not_linked(university, other):
+    assert not _same(f"jane doe {university}", f"jane doe {other}")
+
+
+@pytest.mark.parametrize('a, b', [('Jane Q. Doe University of Washington', 'jane doe univ of washington'),
+                                  ('bob smith ohio state university', 'robert smith ohio state university'),
+                                  ('jane doe university of pittsburgh', 'jane doe university of pittsburg'),
+                                  ('jane doe louisiana state university', 'jane doe louisiana state university '
+                                   'and agricultural & mechanical college')])
+def test_variants_of_the_same_person_are_linked(a, b):
+    assert _same(a, b)
+
+
+def test_link_needs_the_same_first_name_not_an_initial_or_a_similar_one(tmp_path):
+    conn = er.open_index(str(tmp_path / 'entities.sqlite'))
+    er.sync(conn, ['john smith ohio state university', 'danielle roe ohio state university'], 'f1')
+
+    assert er.link(conn, ['j smith ohio state university', 'daniel roe ohio state university',
+                          'johnny smith ohio state university', 'john smith the ohio state university']) \
+        == [None, None, None, 'john smith ohio state university']
@@ -0,0 +1,51 @@
+import os
+import pandas as pd
+import pytest
+import cse
+import data_pipeline_manager as dpm
+import dess.nlp as nlp
+import google_api_workflow
+import parquet_schema
+from fake_dropbox import FakeDropbox
+
+
+def _to_search(tmp_path, monkeypatch, n_rows):
+    monkeypatch.setenv('STORAGE_DIR', str(tmp_path))
+    os.makedirs(tmp_path / 'dataset')
+    ids = [f"Test{i} Person{i} university of testing" for i in range(n_rows)]
+    parquet_schema.write_table(pd.DataFrame({'id_text': ids, 'isProcessed': False}), google_api_workflow.FILE_PATH)
+    monkeypatch.setenv('DROPBOX_FOLDER', '/DESS')
+    monkeypatch.setattr(dpm, 'dropbox_oauth', FakeDropbox)
+    monkeypatch.setattr(cse, 'fetch_rawText', lambda id_text: [f"{id_text} is a professor of history."])
+    return ids
+
+
+def test_fetched_rows_are_committed_when_extraction_fails(tmp_path, monkeypatch):
+    ids = _to_search(tmp_path, monkeypatch, 10)
+    calls = []
+
+    def extract(df):
+        calls.append(len(df))
+        if len(calls) == 1:
+            raise RuntimeError("extraction failed")
+        df['department'] = 'history'
+    monkeypatch.setattr(nlp, 'extract_department_information', extract)
+
+    with pytest.raises(RuntimeError):
+        google_api_workflow.end_to_end_workflow(fetch_workers=1, batch_size=4)
+
+    df = pd.read_parquet(google_api_workflow.FILE_PATH).set_index('id_text')
+    # nothing fetched is lost: the batch whose extraction failed keeps its rawText, unprocessed and without
+    # a department; everything fetched after it was extracted and filed, in one rewrite
+    assert df['snippet_1'].notna().all() and len(df) == len(ids)
+    failed = df[~df['isProcessed']]
+    assert len(failed) == calls[0]
+    assert failed['department'].isna().all()
+    assert (df.loc[df['isProcessed'], 'department'] == 'history').all()
+    assert not os.path.exists(google_api_workflow.FILE_PATH + dpm.UPDATES_SUFFIX)
+
+    # the next run only redoes the extraction of that batch
+    monkeypatch.setattr(cse, 'fetch_rawText', lambda id_text: pytest.fail("searched again"))
+    google_api_workflow.end_to_end_workflow(fetch_workers=1, batch_size=4)
+    df = pd.read_parquet(google_api_workflow.FILE_PATH)
+    assert df['isProcessed'].all() and (df['department'] == 'history').all()
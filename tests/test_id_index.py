@@ -0,0 +1,52 @@
+import pandas as pd
+import arrow_cache
+import data_pipeline_manager as dpm
+import id_index
+import stats
+
+
+def _rows(ids, raw_text=None):
+    return pd.DataFrame({'id_text': ids, 'rawText': [raw_text] * len(ids)})
+
+
+def test_an_id_in_both_datasets_keeps_both_states_and_is_a_conflict(tmp_path):
+    conn = id_index.open_index(str(tmp_path / 'id_index.sqlite'))
+    id_index.rebuild_state(conn, 'complete', ['a', 'b'], 'c1')
+    id_index.rebuild_state(conn, 'reprocess', ['b', 'c'], 'r1')
+    id_index.rebuild_state(conn, 'complete', ['a', 'b'], 'c2') # re-syncing one state keeps the other
+
+    assert id_index.get_states(conn, ['a', 'b', 'c', 'd']) == {'a': 'complete', 'b': 'complete,reprocess', 'c': 'reprocess'}
+    assert id_index.count_ids(conn) == 3 and id_index.count_ids(conn, 'reprocess') == 2
+    with conn:
+        assert id_index.claim_ids(conn, 'complete', ['b', 'c', 'd', 'd']) == [False, False, True, False]
+        # a move from reprocess is accepted unless the id is filed in complete already
+        assert id_index.claim_ids(conn, 'complete', ['b', 'c'], moving_from='reprocess') == [False, True]
+        assert id_index.claim_ids(conn, 'complete', ['a', 'e'], moving_from='complete') == [True, True]
+    assert id_index.get_states(conn, ['b', 'c']) == {'b': 'complete,reprocess', 'c': 'complete'}
+
+
+def test_filed_rows_are_removed_from_their_source_dataset(tmp_path, monkeypatch):
+    monkeypatch.setenv('STORAGE_DIR', str(tmp_path))
+    dpm.append_to_dataset(dpm.REPROCESS_FILE_PATH, _rows(['r1', 'r2']))
+    dpm.write_to_file(dpm.UNCOMPLETE_FILE_PATH, pd.concat([_rows(['u1'], ['snippet']), _rows(['u2', 'r1'])]))
+
+    assert dpm.file_scraped_rows(dpm.read_dataset(dpm.UNCOMPLETE_FILE_PATH), source=dpm.UNCOMPLETE_FILE_PATH) \
+        == {'complete': 1, 'reprocess': 1}
+    # r1 was already in reprocess: a conflict, left in uncomplete
+    assert dpm.read_dataset(dpm.UNCOMPLETE_FILE_PATH)['id_text'].tolist() == ['r1']
+
+    # a reprocess row that now has results moves to complete
+    assert dpm.file_scraped_rows(_rows(['r2'], ['snippet']), source=dpm.REPROCESS_FILE_PATH) == {'complete': 1, 'reprocess': 0}
+    assert dpm.read_dataset(dpm.REPROCESS_FILE_PATH)['id_text'].tolist() == ['r1', 'u2']
+    assert dpm.read_dataset(dpm.COMPLETE_FILE_PATH)['id_text'].tolist() == ['u1', 'r2']
+    conn = dpm._open_synced_index()
+    assert id_index.get_states(conn, ['r1', 'r2', 'u1', 'u2']) == {'r1': 'reprocess', 'r2': 'complete',
+                                                                   'u1': 'complete', 'u2': 'reprocess'}
+    conn.close()
+
+    progress = stats.get_progress()
+    assert (progress['complete']['records'], progress['reprocess']['records'], progress['uncomplete']['records']) == (2, 2, 1)
+    assert arrow_cache.open_dataset(dpm.REPROCESS_FILE_PATH).to_pandas()['id_text'].tolist() == ['r1', 'u2']
+    dpm.compact_dataset(dpm.REPROCESS_FILE_PATH)
+    df = dpm.read_dataset(dpm.REPROCESS_FILE_PATH, latest_only=False)
+    assert df['id_text'].tolist() == ['r1', 'u2'] and dpm.DELETED_COLUMN not in df
@@ -0,0 +1,86 @@
+import time
+import pytest
+import dess.llms.inference_engine as inference_engine
+from dess.llms.inference_engine import InferenceEngine
+from dess.llms.stub_llm import StubLLM
+
+
+class RateLimited(Exception):
+    code = 429
+
+
+class SlowFirstLLM(StubLLM):
+    """Answers each prompt with itself; earlier prompts take longer, so requests finish in reverse order."""
+    def generate(self, prompt, timeout=None):
+        time.sleep(0.02 * (5 - int(prompt)))
+        return prompt
+
+
+class FlakyLLM(StubLLM):
+    """Fails each prompt with `error` on its first `failures` attempts."""
+    def __init__(self, error, failures):
+        super().__init__()
+        self.error, self.failures, self.attempts = error, failures, {}
+
+    def generate(self, prompt, timeout=None):
+        self.attempts[prompt] = self.attempts.get(prompt, 0) + 1
+        if self.attempts[prompt] <= self.failures:
+            raise self.error
+        return prompt.upper()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Records the backoff delays instead of waiting them out (with the jitter at its minimum)."""
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+    monkeypatch.setattr(inference_engine.asyncio, 'sleep', sleep)
+    monkeypatch.setattr(inference_engine.random, 'random', lambda: 0.0)
+    return delays
+
+
+def _engine(llm, **options):
+    return InferenceEngine(llm, max_in_flight=5, requests_per_minute=0, tokens_per_minute=0, **options)
+
+
+def test_responses_keep_the_input_order_whatever_order_they_finish_in():
+    prompts = [str(i) for i in range(5)]
+    assert _engine(SlowFirstLLM()).run(prompts) == prompts
+
+
+def test_rate_limited_requests_are_retried_with_exponential_backoff(sleeps):
+    llm = FlakyLLM(RateLimited("429 Too Many Requests"), failures=2)
+    engine = _engine(llm, max_retries=3, backoff=0.5)
+
+    assert engine.run(['a', 'b']) == ['A', 'B']
+    assert llm.attempts == {'a': 3, 'b': 3}
+    assert sorted(sleeps) == [0.5, 0.5, 1.0, 1.0]
+    assert engine.metrics['retries'] == 4 and engine.metrics['failures'] == 0
+
+
+def test_prompt_gets_none_once_its_retries_are_used_up(sleeps):
+    llm = FlakyLLM(RateLimited("429 Too Many Requests"), failures=10)
+    engine = _engine(llm, max_retries=2, backoff=0.5)
+
+    assert engine.run(['a']) == [None]
+    assert llm.attempts == {'a': 3} and sleeps == [0.5, 1.0]
+    assert engine.metrics['failures'] == 1
+
+
+def test_errors_that_are_not_transient_are_not_retried(sleeps):
+    llm = FlakyLLM(ValueError("400 Bad Request"), failures=1)
+    engine = _engine(llm, max_retries=3)
+
+    assert engine.run(['a']) == [None]
+    assert llm.attempts == {'a': 1} and sleeps == []
+
+
+def test_rate_limit_budget_is_shared_by_the_runs_of_an_engine():
+    engine = InferenceEngine(StubLLM(), max_in_flight=2, requests_per_minute=10, tokens_per_minute=0)
+
+    engine.run(['a', 'b', 'c'])
+    engine.run(['d', 'e', 'f']) # on a new event loop, like every blocking run
+
+    assert engine.request_limiter.available < 5
@@ -0,0 +1,26 @@
+import pandas as pd
+import parquet_schema
+
+
+def _raw_text(index):
+    return pd.Series([['a1', 'a2'], None, ['c1'], ['d1', 'd2', 'd3']], index=index)
+
+
+def test_split_snippets_keeps_a_non_range_index():
+    raw_text = _raw_text(['w', 'x', 'y', 'z'])
+    snippets = parquet_schema.split_snippets(raw_text, n=3)
+
+    assert list(snippets.index) == ['w', 'x', 'y', 'z']
+    assert snippets.loc['w'].tolist() == ['a1', 'a2', None]
+    assert snippets.loc['x'].isna().all()
+    assert snippets.loc['z'].tolist() == ['d1', 'd2', 'd3']
+
+
+def test_split_snippets_of_a_filtered_frame():
+    df = pd.DataFrame({'rawText': _raw_text(range(4)), 'keep': [False, True, True, True]})
+    snippets = parquet_schema.split_snippets(df.loc[df['keep'], 'rawText'], n=2)
+
+    assert list(snippets.index) == [1, 2, 3]
+    assert snippets.loc[1].isna().all()
+    assert snippets.loc[2].tolist() == ['c1', None]
+    assert snippets.loc[3].tolist() == ['d1', 'd2']
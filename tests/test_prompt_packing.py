@@ -0,0 +1,56 @@
+import json
+import pytest
+from dess.llms.inference_engine import InferenceEngine
+from dess.llms.prompt_packing import pack_records, packed_prompt, parse_packed_response, infer_departments_packed
+from dess.llms.stub_llm import StubLLM
+
+TEXTS = [f"Jane Doe{i} is a professor in the Department of {department}." for i, department in
+         enumerate(['History', 'Physics', 'Economics', 'Art', 'Biology'])]
+
+
+class GarbledPackLLM(StubLLM):
+    """Answers packed prompts with `packed_answer`, single-record prompts like the stub."""
+    def __init__(self, packed_answer):
+        super().__init__()
+        self.packed_answer = packed_answer
+
+    def answer_packed(self, prompt):
+        return self.packed_answer
+
+
+def _engine(llm):
+    return InferenceEngine(llm, max_in_flight=2, requests_per_minute=0, tokens_per_minute=0, max_retries=0)
+
+
+def test_packed_records_round_trip():
+    packs = pack_records(TEXTS, max_records=2)
+    assert [len(pack) for pack in packs] == [2, 2, 1]
+    assert [text for pack in packs for _, text in pack] == TEXTS
+
+    answers = {}
+    for pack in packs:
+        answers.update(parse_packed_response(StubLLM().generate(packed_prompt(pack)), [i for i, _ in pack]))
+    assert answers == {'0': 'History', '1': 'Physics', '2': 'Economics', '3': 'Art', '4': 'Biology'}
+
+
+@pytest.mark.parametrize('response', [None, "Sorry, I can't help with that.", '[{"id": "0", "department": }]',
+                                      '{"id": "0", "department": "History"}'])
+def test_unparseable_packed_response_answers_nothing(response):
+    assert parse_packed_response(response, ['0', '1']) == {}
+
+
+def test_only_well_formed_answers_to_the_packed_records_are_kept():
+    response = json.dumps([{'id': '0', 'department': ' History '},
+                           {'id': '1', 'department': 'Physics'}, {'id': '1', 'department': 'Chemistry'},
+                           {'id': '2', 'department': ''}, {'id': '3'}, {'id': '9', 'department': 'Art'},
+                           "Biology"])
+    assert parse_packed_response(response, ['0', '1', '2', '3', '4']) == {'0': 'History'}
+
+
+def test_records_a_malformed_pack_misses_are_retried_one_by_one():
+    llm = GarbledPackLLM('[{"id": "1", "department": "Physics"}, {"id": "3", "department": 7}]')
+
+    results = infer_departments_packed(llm, TEXTS, _engine(llm), max_records=5)
+
+    assert results == ['History', 'Physics', 'Economics', 'Art', 'Biology']
+    assert llm.calls == 1 + 4  # the pack, then every record it didn't answer properly
@@ -0,0 +1,101 @@
+import pandas as pd
+import pytest
+import cse
+import data_pipeline_manager as dpm
+import rescrape
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    monkeypatch.setenv('STORAGE_DIR', str(tmp_path))
+    monkeypatch.setenv('CSE_REQUESTS_PER_MINUTE', '0')
+    return tmp_path
+
+
+def _state(id_text):
+    conn = rescrape.open_log()
+    try:
+        return conn.execute("SELECT state, failures FROM scrape_log WHERE id_text = ?", (id_text,)).fetchone()
+    finally:
+        conn.close()
+
+
+def test_recovered_row_stays_in_reprocess_until_it_is_filed(storage, monkeypatch):
+    dpm.append_to_dataset(dpm.REPROCESS_FILE_PATH, pd.DataFrame({'id_text': ['a b c'], 'rawText': [None]}))
+    conn = rescrape.open_log()
+    rescrape.sync(conn)
+    conn.execute("UPDATE scrape_log SET retry_after = NULL")
+    conn.commit()
+    conn.close()
+    # The row was filed somewhere else between the selection and the scrape
+    monkeypatch.setattr(rescrape, '_read_records', lambda candidates: {})
+
+    outcomes = rescrape.run(capacity=5, fetch=lambda id_text: ['fresh snippet'])
+
+    assert outcomes == {'unfiled': 1}
+    assert _state('a b c')[0] == 'reprocess'
+
+
+def test_searches_stop_at_the_shared_daily_quota(storage, monkeypatch):
+    monkeypatch.setenv('CSE_DAILY_QUOTA', '3')
+    monkeypatch.setattr(cse.requests, 'get', lambda *args, **kwargs: pytest.fail("quota exceeded"))
+    for _ in range(2):
+        cse.acquire()
+    assert cse.remaining_quota() == 1
+    cse.acquire()
+
+    with pytest.raises(cse.QuotaExceeded):
+        cse.fetch_rawText('a b c')
+    assert cse.remaining_quota() == 0
+
+
+def test_rows_synced_today_do_not_use_up_the_capacity(storage):
+    dpm.append_to_dataset(dpm.REPROCESS_FILE_PATH, pd.DataFrame({'id_text': ['a', 'b', 'c'], 'rawText': [None] * 3}))
+    conn = rescrape.open_log()
+    rescrape.sync(conn) # dates the rows by their part, i.e. today
+    conn.execute("UPDATE scrape_log SET retry_after = NULL")
+    conn.commit()
+
+    assert len(rescrape.select_candidates(conn, capacity=2)) == 2
+    rescrape.record_attempt(conn, 'a', 'reprocess', None)
+    assert rescrape.select_candidates(conn, capacity=2) == [('b', 'reprocess')]
+    conn.close()
+
+
+def test_refreshed_rows_are_filed_without_rewriting_reprocess(storage, monkeypatch):
+    import dess.nlp as nlp
+    monkeypatch.setattr(nlp, 'extract_department_information', lambda df: df.__setitem__('department', 'history'))
+    dpm.append_to_dataset(dpm.REPROCESS_FILE_PATH, pd.DataFrame({'id_text': ['r1', 'r2'], 'rawText': [None] * 2}))
+    dpm.append_to_dataset(dpm.COMPLETE_FILE_PATH, pd.DataFrame({'id_text': ['c1'], 'rawText': [['old snippet']]}))
+    reprocess_parts = dpm.list_parts(dpm.REPROCESS_FILE_PATH)
+    conn = rescrape.open_log()
+    rescrape.sync(conn)
+    conn.execute("UPDATE scrape_log SET retry_after = NULL, fetched_at = '2000-01-01'")
+    conn.commit()
+    conn.close()
+
+    outcomes = rescrape.run(capacity=3, fetch=lambda id_text: None if id_text == 'r2' else ['new snippet'])
+
+    assert outcomes == {'recovered': 1, 'failed': 1, 'changed': 1}
+    assert set(reprocess_parts) < set(dpm.list_parts(dpm.REPROCESS_FILE_PATH)) # appended to, not rewritten
+    assert dpm.read_dataset(dpm.REPROCESS_FILE_PATH)['id_text'].tolist() == ['r2']
+    complete = dpm.read_dataset(dpm.COMPLETE_FILE_PATH).set_index('id_text')
+    assert sorted(complete.index) == ['c1', 'r1']
+    assert (complete['department'] == 'history').all() and complete.loc['c1', 'rawText'].tolist() == ['new snippet']
+    assert _state('r1') == ('complete', 0) and _state('r2') == ('reprocess', 2)
+
+
+def test_snippets_are_compared_by_hash_ignoring_case_and_whitespace(storage):
+    stored = rescrape.snippet_hash(['Jane Doe, Professor of History'])  # the dataset's rawText
+    same = rescrape.snippet_hash(['  jane doe,   professor of HISTORY '])
+    moved = rescrape.snippet_hash(['Jane Doe, Professor of Physics'])
+    assert rescrape.snippet_hash(['x', 'y']) != rescrape.snippet_hash(['y', 'x'])
+    conn = rescrape.open_log()
+
+    assert rescrape.record_attempt(conn, 'a b c', 'complete', same, old_hash=stored) == 'unchanged'
+    assert rescrape.record_attempt(conn, 'a b c', 'complete', moved, old_hash=stored) == 'changed'
+    assert rescrape.record_attempt(conn, 'a b c', 'complete', moved) == 'unchanged' # compared with the logged hash
+
+    checks, changes = conn.execute("SELECT checks, changes FROM scrape_log WHERE id_text = 'a b c'").fetchone()
+    assert (checks, changes) == (2, 1)
+    conn.close()
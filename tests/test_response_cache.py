@@ -0,0 +1,48 @@
+import itertools
+import pytest
+import dess.llms.response_cache as response_cache
+from dess.llms.response_cache import ResponseCache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    # A strictly increasing clock, so entries written in the same microsecond still have an LRU order
+    clock = itertools.count()
+    monkeypatch.setattr(response_cache, '_now', lambda: f"{next(clock):012d}")
+    cache = ResponseCache(str(tmp_path / 'llm_cache.sqlite'), max_entries=10, shared_dir='')
+    yield cache
+    cache.close()
+
+
+def test_least_recently_used_entries_are_evicted(cache):
+    for i in range(10):
+        cache.put('model', f"prompt {i}", f"answer {i}")
+    for i in range(3):  # reading an entry makes it recently used
+        assert cache.get('model', f"prompt {i}") == f"answer {i}"
+
+    cache.put('model', "prompt 10", "answer 10")
+
+    # 11 entries > 10: evicted down to 9, oldest use first
+    assert len(cache) == 9 and cache.metrics['evictions'] == 2
+    assert cache.get('model', "prompt 3") is None and cache.get('model', "prompt 4") is None
+    assert all(cache.get('model', f"prompt {i}") == f"answer {i}" for i in [0, 1, 2, 5, 9, 10])
+
+
+def test_entries_are_keyed_by_model_and_prompt(cache):
+    cache.put('model-a', "Extract the department.\n  Text: Jane Doe", "history")
+
+    assert cache.get('model-a', "Extract the department. Text:   Jane Doe") == "history"  # whitespace only
+    assert cache.get('model-b', "Extract the department.\n  Text: Jane Doe") is None
+    assert cache.get('model-a', "Extract the department.\n  Text: John Doe") is None
+    assert cache.metrics == {'hits': 1, 'misses': 2, 'evictions': 0, 'imported': 0}
+
+
+def test_cache_persists_across_instances(tmp_path):
+    path = str(tmp_path / 'llm_cache.sqlite')
+    cache = ResponseCache(path, shared_dir='')
+    cache.put('model', "prompt", "answer")
+    cache.close()
+
+    cache = ResponseCache(path, shared_dir='')
+    assert len(cache) == 1 and cache.get('model', "prompt") == "answer"
+    cache.close()
@@ -0,0 +1,21 @@
+import datetime
+import pandas as pd
+import pyarrow as pa
+import stata_writer
+
+
+def test_export_writes_datetimes_and_renames_invalid_columns(tmp_path):
+    df = pd.DataFrame({'id text': ['a', 'b'], 'id_text': ['x', 'y'], 'int': [1, 2],
+                       'seen': pd.to_datetime(['2024-01-02 03:04:05.123', None]),
+                       'day': [datetime.date(1959, 12, 31), None],
+                       'rawText': [['s1'], None]})
+    path = tmp_path / 'out.dta'
+    n_rows = stata_writer.export_table(pa.Table.from_pandas(df, preserve_index=False), str(path))
+
+    exported = pd.read_stata(path)
+    assert n_rows == 2
+    assert list(exported.columns) == ['_0id_text', 'id_text', '_int', 'seen', 'day']  # rawText (a list) is left out
+    assert exported['_0id_text'].tolist() == ['a', 'b']
+    assert exported['seen'][0] == pd.Timestamp('2024-01-02 03:04:05.123')
+    assert exported['day'][0] == pd.Timestamp('1959-12-31')
+    assert exported[['seen', 'day']].iloc[1].isna().all()
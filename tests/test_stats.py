@@ -0,0 +1,56 @@
+import os
+import pandas as pd
+import data_pipeline_manager as dpm
+import parquet_schema
+import stats
+
+
+def _rows(ids, professor=True):
+    return pd.DataFrame({'id_text': ids, 'isProfessor': professor, 'department_textual': 'history'})
+
+
+def _records(name):
+    return stats.get_progress()[name]['records']
+
+
+def test_progress_counts_only_the_latest_version_of_each_row(tmp_path, monkeypatch):
+    monkeypatch.setenv('STORAGE_DIR', str(tmp_path))
+    complete = dpm.COMPLETE_FILE_PATH
+    dpm.append_to_dataset(complete, _rows(['a', 'b', 'b', 'c'], professor=False))
+    dpm.append_to_dataset(complete, _rows(['c', 'a']))
+    dpm.remove_from_dataset(complete, ['b'])
+    # a part written elsewhere (e.g. synced from Dropbox), counted when first seen
+    parquet_schema.write_table(_rows(['d', 'a']), os.path.join(complete, dpm._new_part_name()))
+
+    progress = stats.get_progress()['complete']
+    assert progress['records'] == len(dpm.read_dataset(complete)) == 3
+    assert progress['professors'] == 3
+
+    dpm.compact_dataset(complete)
+    assert stats.get_progress()['complete'] == progress
+
+
+def test_progress_reads_only_the_superseded_rows(tmp_path, monkeypatch):
+    monkeypatch.setenv('STORAGE_DIR', str(tmp_path))
+    dpm.append_to_dataset(dpm.COMPLETE_FILE_PATH, _rows([f'id {i}' for i in range(100)]))
+    dpm.append_to_dataset(dpm.COMPLETE_FILE_PATH, _rows(['new']))
+    reads = []
+    read_part = stats._read_part
+    monkeypatch.setattr(stats, '_read_part', lambda part, *args, **kwargs: reads.append(kwargs) or read_part(part, *args, **kwargs))
+
+    assert _records('complete') == 101
+    assert reads == [] # nothing is read once every part is counted
+
+    dpm.append_to_dataset(dpm.COMPLETE_FILE_PATH, _rows(['id 5', 'new']))
+    assert [read['filters'] for read in reads] == [[('id_text', 'in', ['id 5'])], [('id_text', 'in', ['new'])]]
+    assert _records('complete') == 101
+
+
+def test_ledger_keys_datasets_by_their_path_in_storage_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('STORAGE_DIR', str(tmp_path))
+    dpm.append_to_dataset(dpm.COMPLETE_FILE_PATH, _rows(['a']))
+    dpm.append_to_dataset(str(tmp_path / 'dataset' / 'complete.parquet'), _rows(['a', 'b']))
+
+    assert _records('complete') == 1
+    datasets = stats._load_ledger(stats.LEDGER_FILE_PATH)['datasets']
+    assert [entry['counts']['records'] for entry in datasets[os.path.join('dataset', 'complete.parquet')].values()] == [2]